@@ -23,17 +23,32 @@ def get_openai_client() -> OpenAI:
     return OpenAI(api_key=settings.openai_api_key)
 
 
-def estimate_tokens(texts: Iterable[str], model: str | None = None) -> int:
-    settings = get_settings()
-    model_name = model or settings.embedding_model
+@lru_cache(maxsize=8)
+def get_encoding(model_name: str) -> tiktoken.Encoding | None:
     try:
-        encoding = tiktoken.encoding_for_model(model_name)
+        return tiktoken.encoding_for_model(model_name)
     except Exception:
-        encoding = tiktoken.get_encoding("cl100k_base")
+        pass
+    try:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception as exc:
+        # Sin red ni cache local de tiktoken: se usa la aproximacion por caracteres.
+        logger.warning("tiktoken_unavailable model=%s reason=%s using_char_estimate=true", model_name, exc)
+        return None
+
 
+def count_tokens(text: str, model: str | None = None) -> int:
+    encoding = get_encoding(model or get_settings().embedding_model)
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text))
+
+
+def estimate_tokens(texts: Iterable[str], model: str | None = None) -> int:
+    model_name = model or get_settings().embedding_model
     total = 0
     for text in texts:
-        total += len(encoding.encode(text))
+        total += count_tokens(text, model=model_name)
     return total
 
 
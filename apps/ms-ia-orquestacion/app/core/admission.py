@@ -0,0 +1,105 @@
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
+from typing import Any, Callable, TypeVar
+
+from app.core.config import get_settings
+from app.core.logger import get_logger
+from app.core.metrics import ADMISSION_REJECTED, EXECUTOR_PENDING, EXECUTOR_QUEUE_WAIT
+
+
+logger = get_logger("ms-ia-orquestacion.admission")
+
+T = TypeVar("T")
+
+
+class OverloadedError(Exception):
+    """La cola del executor esta llena; el request debe rechazarse con 503."""
+
+    def __init__(self, executor: str, retry_after_s: int) -> None:
+        super().__init__(f"executor '{executor}' saturado")
+        self.executor = executor
+        self.retry_after_s = retry_after_s
+
+
+class BoundedExecutor:
+    """
+    Pool de threads dedicado con admision acotada.
+    Admite hasta max_workers ejecutando + queue_depth en espera; el resto se rechaza al instante.
+    """
+
+    def __init__(self, name: str, max_workers: int, queue_depth: int, retry_after_s: int) -> None:
+        self.name = name
+        self.max_workers = max(1, max_workers)
+        self.queue_depth = max(0, queue_depth)
+        self.retry_after_s = retry_after_s
+        self._capacity = self.max_workers + self.queue_depth
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=f"{name}-worker")
+
+    def _try_acquire(self) -> bool:
+        with self._lock:
+            if self._pending >= self._capacity:
+                return False
+            self._pending += 1
+        EXECUTOR_PENDING.labels(executor=self.name).inc()
+        return True
+
+    def _release(self, _: Future[Any]) -> None:
+        with self._lock:
+            self._pending -= 1
+        EXECUTOR_PENDING.labels(executor=self.name).dec()
+
+    def pending(self) -> int:
+        with self._lock:
+            return self._pending
+
+    async def run(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        if not self._try_acquire():
+            ADMISSION_REJECTED.labels(executor=self.name).inc()
+            logger.warning("admission_rejected executor=%s capacity=%d", self.name, self._capacity)
+            raise OverloadedError(self.name, self.retry_after_s)
+
+        submitted = time.perf_counter()
+        context = contextvars.copy_context()
+
+        def _job() -> T:
+            EXECUTOR_QUEUE_WAIT.labels(executor=self.name).observe(time.perf_counter() - submitted)
+            return context.run(fn, *args, **kwargs)
+
+        future = self._pool.submit(_job)
+        # El cupo se libera cuando el trabajo termina o se cancela antes de empezar,
+        # no cuando el request deja de esperar.
+        future.add_done_callback(self._release)
+        return await asyncio.wrap_future(future)
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+@lru_cache(maxsize=1)
+def get_rag_executor() -> BoundedExecutor:
+    settings = get_settings()
+    return BoundedExecutor(
+        name="rag",
+        max_workers=settings.rag_executor_workers,
+        queue_depth=settings.rag_executor_queue_depth,
+        retry_after_s=settings.admission_retry_after_s,
+    )
+
+
+@lru_cache(maxsize=1)
+def get_classify_executor() -> BoundedExecutor:
+    settings = get_settings()
+    return BoundedExecutor(
+        name="classify",
+        max_workers=settings.classify_executor_workers,
+        queue_depth=settings.classify_executor_queue_depth,
+        retry_after_s=settings.admission_retry_after_s,
+    )
@@ -73,6 +73,13 @@ class Settings:
     chunk_size: int
     chunk_overlap: int
     min_chunk_size: int
+    ingest_queue_size: int
+    ingest_header_sample_pages: int
+    ingest_pdf_workers: int
+    ingest_pdf_cache_dir: str
+    ingest_upsert_in_flight: int
+    ingest_dedup_enabled: bool
+    ingest_dedup_threshold: float
     source_default: str
     version_default: str
     rerank_enabled: bool
@@ -80,9 +87,31 @@ class Settings:
     rag_final_k: int
     rag_score_threshold: float
     rag_rerank_mode: str
+    rag_rerank_timeout_s: float
     rag_filter_source: str | None
     rag_filter_version: str | None
     rag_temperature: float
+    rag_answer_cache_enabled: bool
+    rag_answer_cache_path: str
+    rag_answer_cache_max_entries: int
+    rag_corpus_version: str
+    rag_context_compression_enabled: bool
+    rag_context_token_budget: int
+    rag_context_scorer: str
+    rag_executor_workers: int
+    rag_executor_queue_depth: int
+    classify_executor_workers: int
+    classify_executor_queue_depth: int
+    admission_retry_after_s: int
+    rag_warmup_enabled: bool
+    rag_warmup_retry_s: float
+    rag_batch_concurrency: int
+    rag_ingest_jobs_path: str
+    rag_ingest_workers: int
+    rag_ingest_workers_in_api: bool
+    rag_ingest_poll_interval_s: float
+    rag_ingest_job_stale_s: int
+    rag_ingest_max_attempts: int
 
 
 @lru_cache(maxsize=1)
@@ -111,6 +140,13 @@ def get_settings() -> Settings:
         chunk_size=_get_int("RAG_INGEST_CHUNK_SIZE", 1000),
         chunk_overlap=_get_int("RAG_INGEST_CHUNK_OVERLAP", 150),
         min_chunk_size=_get_int("RAG_INGEST_MIN_CHUNK_SIZE", 300),
+        ingest_queue_size=max(1, _get_int("RAG_INGEST_QUEUE_SIZE", 4)),
+        ingest_header_sample_pages=max(1, _get_int("RAG_INGEST_HEADER_SAMPLE_PAGES", 24)),
+        ingest_pdf_workers=max(1, _get_int("RAG_INGEST_PDF_WORKERS", 1)),
+        ingest_pdf_cache_dir=os.getenv("RAG_INGEST_PDF_CACHE_DIR", str(SERVICE_ROOT / ".cache" / "parsed_pdf")).strip(),
+        ingest_upsert_in_flight=max(1, _get_int("RAG_INGEST_UPSERT_IN_FLIGHT", 4)),
+        ingest_dedup_enabled=_get_bool("RAG_INGEST_DEDUP_ENABLED", True),
+        ingest_dedup_threshold=min(1.0, max(0.5, _get_float("RAG_INGEST_DEDUP_THRESHOLD", 0.85))),
         source_default=os.getenv("RAG_INGEST_SOURCE", "consultorio_juridico"),
         version_default=os.getenv("RAG_INGEST_VERSION", "v1"),
         rerank_enabled=_get_bool("RAG_RERANK_ENABLED", True),
@@ -118,7 +154,29 @@ def get_settings() -> Settings:
         rag_final_k=_get_int("RAG_FINAL_K", 5),
         rag_score_threshold=_get_float("RAG_SCORE_THRESHOLD", 0.72),
         rag_rerank_mode=os.getenv("RAG_RERANK_MODE", "cosine").strip().lower(),
+        rag_rerank_timeout_s=_get_float("RAG_RERANK_TIMEOUT_S", 20.0),
         rag_filter_source=(os.getenv("RAG_FILTER_SOURCE", "").strip() or None),
         rag_filter_version=(os.getenv("RAG_FILTER_VERSION", "").strip() or None),
         rag_temperature=_get_float("RAG_TEMPERATURE", 0.3),
+        rag_answer_cache_enabled=_get_bool("RAG_ANSWER_CACHE_ENABLED", True),
+        rag_answer_cache_path=os.getenv("RAG_ANSWER_CACHE_PATH", str(SERVICE_ROOT / ".cache" / "rag_answers.sqlite3")),
+        rag_answer_cache_max_entries=_get_int("RAG_ANSWER_CACHE_MAX_ENTRIES", 5000),
+        rag_corpus_version=os.getenv("RAG_CORPUS_VERSION", "").strip(),
+        rag_context_compression_enabled=_get_bool("RAG_CONTEXT_COMPRESSION_ENABLED", True),
+        rag_context_token_budget=_get_int("RAG_CONTEXT_TOKEN_BUDGET", 1200),
+        rag_context_scorer=os.getenv("RAG_CONTEXT_SCORER", "lexical").strip().lower(),
+        rag_executor_workers=_get_int("RAG_EXECUTOR_WORKERS", 16),
+        rag_executor_queue_depth=_get_int("RAG_EXECUTOR_QUEUE_DEPTH", 32),
+        classify_executor_workers=_get_int("CLASSIFY_EXECUTOR_WORKERS", 8),
+        classify_executor_queue_depth=_get_int("CLASSIFY_EXECUTOR_QUEUE_DEPTH", 32),
+        admission_retry_after_s=_get_int("ADMISSION_RETRY_AFTER_S", 2),
+        rag_warmup_enabled=_get_bool("RAG_WARMUP_ENABLED", False),
+        rag_warmup_retry_s=max(0.5, _get_float("RAG_WARMUP_RETRY_S", 5.0)),
+        rag_batch_concurrency=max(1, _get_int("RAG_BATCH_CONCURRENCY", 4)),
+        rag_ingest_jobs_path=os.getenv("RAG_INGEST_JOBS_PATH", str(SERVICE_ROOT / ".cache" / "ingest_jobs.sqlite3")),
+        rag_ingest_workers=max(0, _get_int("RAG_INGEST_WORKERS", 1)),
+        rag_ingest_workers_in_api=_get_bool("RAG_INGEST_WORKERS_IN_API", False),
+        rag_ingest_poll_interval_s=_get_float("RAG_INGEST_POLL_INTERVAL_S", 1.0),
+        rag_ingest_job_stale_s=_get_int("RAG_INGEST_JOB_STALE_S", 600),
+        rag_ingest_max_attempts=max(1, _get_int("RAG_INGEST_MAX_ATTEMPTS", 3)),
     )
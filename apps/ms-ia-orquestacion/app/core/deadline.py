@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+import threading
+import time
+
+
+class DeadlineExceeded(TimeoutError):
+    """El presupuesto del request se agoto antes de la etapa indicada."""
+
+    def __init__(self, stage: str) -> None:
+        super().__init__(f"deadline agotado antes de la etapa '{stage}'")
+        self.stage = stage
+
+
+class RequestCancelled(Exception):
+    """El request fue abandonado (cliente desconectado o sin waiters)."""
+
+    def __init__(self, stage: str) -> None:
+        super().__init__(f"request cancelado antes de la etapa '{stage}'")
+        self.stage = stage
+
+
+class Deadline:
+    """
+    Presupuesto de tiempo de un request, compartido entre el event loop y el thread worker.
+    Cada etapa pide su timeout con timeout_for(); si el presupuesto se agoto o el request
+    fue cancelado, la etapa no arranca.
+    """
+
+    def __init__(self, timeout_s: float) -> None:
+        self._expires_at = time.monotonic() + max(0.0, timeout_s)
+        self._cancelled = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def expires_at(self) -> float:
+        return self._expires_at
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def remaining(self) -> float:
+        return max(0.0, self._expires_at - time.monotonic())
+
+    def cancel(self) -> None:
+        self._cancelled.set()
+
+    def fork(self) -> "Deadline":
+        clone = Deadline(0.0)
+        clone._expires_at = self._expires_at
+        return clone
+
+    def extend_to(self, other: "Deadline") -> None:
+        with self._lock:
+            self._expires_at = max(self._expires_at, other.expires_at)
+
+    def check(self, stage: str) -> None:
+        if self.cancelled:
+            raise RequestCancelled(stage)
+        if self.remaining() <= 0.0:
+            raise DeadlineExceeded(stage)
+
+    def timeout_for(self, stage: str, cap: float | None = None) -> float:
+        self.check(stage)
+        remaining = self.remaining()
+        return min(cap, remaining) if cap is not None else remaining
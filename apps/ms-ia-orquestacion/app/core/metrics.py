@@ -0,0 +1,94 @@
+from __future__ import annotations
+
+from typing import Any
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+
+_LATENCY_BUCKETS_S = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 0.75, 1.0, 1.5, 2.5, 4.0, 6.0, 10.0, 20.0, 40.0, 60.0)
+
+RAG_STAGE_DURATION = Histogram(
+    "rag_stage_duration_seconds",
+    "Duracion por etapa del pipeline RAG.",
+    ["stage"],
+    buckets=_LATENCY_BUCKETS_S,
+)
+RAG_ANSWER_STATUS = Counter(
+    "rag_answer_status_total",
+    "Respuestas de /rag-answer por status.",
+    ["status"],
+)
+RAG_THRESHOLD_REJECTIONS = Counter(
+    "rag_threshold_rejections_total",
+    "Consultas rechazadas por RAG_SCORE_THRESHOLD.",
+)
+DEPENDENCY_ERRORS = Counter(
+    "rag_dependency_errors_total",
+    "Errores de dependencias externas.",
+    ["dependency"],
+)
+CACHE_REQUESTS = Counter(
+    "rag_cache_requests_total",
+    "Consultas a caches internos por resultado (hit/miss).",
+    ["cache", "result"],
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    "rag_requests_in_flight",
+    "Requests en curso por endpoint.",
+    ["endpoint"],
+)
+SINGLEFLIGHT_COALESCED = Counter(
+    "rag_singleflight_coalesced_total",
+    "Requests que reutilizaron una ejecucion identica en curso.",
+    ["group"],
+)
+EXECUTOR_QUEUE_WAIT = Histogram(
+    "rag_executor_queue_wait_seconds",
+    "Tiempo en cola antes de que un worker tome el trabajo.",
+    ["executor"],
+    buckets=_LATENCY_BUCKETS_S,
+)
+EXECUTOR_PENDING = Gauge(
+    "rag_executor_pending",
+    "Trabajos admitidos (en cola + ejecutando) por executor.",
+    ["executor"],
+)
+ADMISSION_REJECTED = Counter(
+    "rag_admission_rejected_total",
+    "Requests rechazados con 503 por cola llena.",
+    ["executor"],
+)
+
+_PIPELINE_STAGES = ("embed", "retrieval", "rerank", "generate", "total")
+# Etapas que un batch resuelve una vez para todos sus items (prefetch_batch).
+BATCH_SHARED_STAGES = ("embed", "retrieval")
+
+
+def observe_stage_ms(stage: str, value_ms: float) -> None:
+    RAG_STAGE_DURATION.labels(stage=stage).observe(float(value_ms) / 1000.0)
+
+
+def observe_pipeline_metrics(metrics: dict[str, Any], skip_stages: tuple[str, ...] = ()) -> None:
+    """
+    Agrega las metricas por request que devuelve RetrievalPipelineService.evaluate.
+    skip_stages: etapas ya observadas aparte (las compartidas de un batch se observan una sola vez).
+    """
+    latency = metrics.get("latencyMs") or {}
+    for stage in _PIPELINE_STAGES:
+        if stage in skip_stages:
+            continue
+        value = latency.get(stage)
+        # Las etapas omitidas (p.ej. generate en dry-run) vienen en 0.0 y no se observan.
+        if isinstance(value, (int, float)) and (value > 0 or stage == "total"):
+            observe_stage_ms(stage, value)
+
+    if metrics.get("thresholdTriggered") and metrics.get("top1Score") is not None:
+        RAG_THRESHOLD_REJECTIONS.inc()
+
+    cache_hit = metrics.get("cacheHit")
+    if isinstance(cache_hit, bool):
+        CACHE_REQUESTS.labels(cache="answer", result="hit" if cache_hit else "miss").inc()
+
+
+def render_metrics() -> tuple[bytes, str]:
+    return generate_latest(), CONTENT_TYPE_LATEST
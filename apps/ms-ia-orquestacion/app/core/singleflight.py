@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+import asyncio
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Generic, TypeVar
+
+from app.core.deadline import Deadline
+from app.core.logger import get_logger
+from app.core.metrics import SINGLEFLIGHT_COALESCED
+from app.core.tracing import span
+
+
+logger = get_logger("ms-ia-orquestacion.singleflight")
+
+T = TypeVar("T")
+
+
+@dataclass
+class _Call(Generic[T]):
+    task: "asyncio.Task[T]"
+    deadline: Deadline | None
+    waiters: int = 0
+
+
+class SingleFlight(Generic[T]):
+    """
+    Deduplica ejecuciones concurrentes con la misma llave dentro de un event loop.
+    El primer request (leader) lanza la tarea; los siguientes esperan su resultado.
+    La tarea compartida se protege con shield: si un waiter se va, los demas siguen; cuando
+    se va el ultimo, la ejecucion se cancela y su deadline compartido se marca cancelado.
+    """
+
+    def __init__(self, group: str) -> None:
+        self.group = group
+        self._calls: dict[str, _Call[T]] = {}
+
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+    async def do(
+        self,
+        key: str,
+        fn: Callable[[Deadline | None], Awaitable[T]],
+        deadline: Deadline | None = None,
+    ) -> T:
+        """
+        fn recibe el deadline compartido de la ejecucion: arranca con el del leader y se
+        extiende al mas tardio de los waiters, para no cortar a quien todavia tiene presupuesto.
+        """
+        call = self._calls.get(key)
+        if call is None:
+            shared = deadline.fork() if deadline is not None else None
+            call = _Call(task=asyncio.ensure_future(fn(shared)), deadline=shared)
+            self._calls[key] = call
+            call.task.add_done_callback(lambda done, k=key: self._forget(k, done))
+            return await self._wait(call, deadline)
+
+        SINGLEFLIGHT_COALESCED.labels(group=self.group).inc()
+        logger.info("singleflight_coalesced group=%s key=%s", self.group, key[:12])
+        if deadline is not None and call.deadline is not None:
+            call.deadline.extend_to(deadline)
+        with span("singleflight-wait", group=self.group):
+            return await self._wait(call, deadline)
+
+    async def _wait(self, call: _Call[T], deadline: Deadline | None) -> T:
+        call.waiters += 1
+        try:
+            timeout = deadline.remaining() if deadline is not None else None
+            return await asyncio.wait_for(asyncio.shield(call.task), timeout=timeout)
+        except (asyncio.CancelledError, TimeoutError):
+            if call.waiters == 1 and not call.task.done():
+                logger.info("singleflight_abandoned group=%s", self.group)
+                if call.deadline is not None:
+                    call.deadline.cancel()
+                call.task.cancel()
+            raise
+        finally:
+            call.waiters -= 1
+
+    def _forget(self, key: str, done: asyncio.Task[Any]) -> None:
+        current = self._calls.get(key)
+        if current is not None and current.task is done:
+            self._calls.pop(key, None)
+        if not done.cancelled() and done.exception() is not None:
+            # Evita "Task exception was never retrieved" cuando todos los waiters ya se fueron.
+            logger.debug("singleflight_task_failed group=%s error=%s", self.group, done.exception())
@@ -0,0 +1,204 @@
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Iterator
+
+import httpx
+
+from app.core.logger import get_logger
+
+
+logger = get_logger("ms-ia-orquestacion.tracing")
+
+_current_trace: ContextVar["Trace | None"] = ContextVar("rag_current_trace", default=None)
+_current_span: ContextVar["Span | None"] = ContextVar("rag_current_span", default=None)
+_export_lock = threading.Lock()
+
+
+@dataclass
+class Span:
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: str | None
+    start_epoch_ms: float
+    start_perf: float
+    duration_ms: float | None = None
+    attributes: dict[str, Any] = field(default_factory=dict)
+
+    def finish(self) -> None:
+        if self.duration_ms is None:
+            self.duration_ms = round((time.perf_counter() - self.start_perf) * 1000, 3)
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentId": self.parent_id,
+            "name": self.name,
+            "startMs": round(self.start_epoch_ms, 3),
+            "durationMs": self.duration_ms,
+            "attributes": self.attributes,
+        }
+
+
+@dataclass
+class Trace:
+    trace_id: str
+    spans: list[Span] = field(default_factory=list)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def add(self, span: Span) -> None:
+        with self._lock:
+            self.spans.append(span)
+
+    def finished_spans(self) -> list[Span]:
+        with self._lock:
+            return [span for span in self.spans if span.duration_ms is not None]
+
+
+def _new_span(name: str, trace: Trace, attributes: dict[str, Any]) -> Span:
+    parent = _current_span.get()
+    span = Span(
+        name=name,
+        trace_id=trace.trace_id,
+        span_id=uuid.uuid4().hex[:16],
+        parent_id=parent.span_id if parent is not None else None,
+        start_epoch_ms=time.time() * 1000,
+        start_perf=time.perf_counter(),
+        attributes=dict(attributes),
+    )
+    trace.add(span)
+    return span
+
+
+def start_trace(trace_id: str) -> Trace:
+    trace = Trace(trace_id=trace_id)
+    _current_trace.set(trace)
+    _current_span.set(None)
+    return trace
+
+
+def current_trace() -> Trace | None:
+    return _current_trace.get()
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Span | None]:
+    """Span de una etapa. Sin trace activo (p.ej. scripts CLI) no registra nada."""
+    trace = _current_trace.get()
+    if trace is None:
+        yield None
+        return
+
+    current = _new_span(name, trace, attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as exc:
+        current.attributes["error"] = type(exc).__name__
+        raise
+    finally:
+        current.finish()
+        _current_span.reset(token)
+
+
+def server_timing_header(trace: Trace) -> str:
+    """Suma duraciones por nombre de span en formato Server-Timing."""
+    totals: dict[str, float] = {}
+    for item in trace.finished_spans():
+        metric = item.name.replace(" ", "-").replace(".", "-")
+        totals[metric] = totals.get(metric, 0.0) + float(item.duration_ms or 0.0)
+    return ", ".join(f"{name};dur={duration:.1f}" for name, duration in totals.items())
+
+
+def export_trace(trace: Trace) -> None:
+    path = os.getenv("RAG_TRACE_EXPORT_FILE", "").strip()
+    if not path:
+        return
+    spans = trace.finished_spans()
+    if not spans:
+        return
+    try:
+        target = Path(path)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        lines = "".join(json.dumps(item.to_dict(), ensure_ascii=True) + "\n" for item in spans)
+        with _export_lock, target.open("a", encoding="utf-8") as fp:
+            fp.write(lines)
+    except Exception as exc:
+        logger.warning("trace_export_failed path=%s reason=%s", path, exc)
+
+
+# ---------------------------------------------------------------------------
+# Tiempos HTTP (connect, TLS, TTFB) via event hooks de httpx
+# ---------------------------------------------------------------------------
+
+_HTTPCORE_PHASES = {
+    "connection.connect_tcp": "connect",
+    "connection.start_tls": "tls",
+}
+
+
+def _build_httpcore_trace(dependency: str, trace: Trace, request_span: Span) -> Callable[[str, dict], None]:
+    started: dict[str, float] = {}
+
+    def _on_event(event_name: str, info: dict) -> None:
+        phase_key, _, state = event_name.rpartition(".")
+        if state == "started":
+            started[phase_key] = time.perf_counter()
+            return
+        if state not in {"complete", "failed"}:
+            return
+
+        phase = _HTTPCORE_PHASES.get(phase_key)
+        if phase is None and phase_key.endswith("receive_response_headers"):
+            phase = "ttfb"
+            begin = request_span.start_perf
+        else:
+            begin = started.get(phase_key, request_span.start_perf)
+        if phase is None:
+            return
+
+        item = Span(
+            name=f"{dependency}-{phase}",
+            trace_id=trace.trace_id,
+            span_id=uuid.uuid4().hex[:16],
+            parent_id=request_span.span_id,
+            start_epoch_ms=request_span.start_epoch_ms + (begin - request_span.start_perf) * 1000,
+            start_perf=begin,
+            attributes={"failed": state == "failed"},
+        )
+        item.finish()
+        trace.add(item)
+
+    return _on_event
+
+
+def build_http_event_hooks(dependency: str) -> dict[str, list[Callable[..., Any]]]:
+    def _on_request(request: httpx.Request) -> None:
+        trace = _current_trace.get()
+        if trace is None:
+            return
+        request_span = _new_span(
+            f"{dependency}-http",
+            trace,
+            {"method": request.method, "path": request.url.path},
+        )
+        request.extensions["rag_span"] = request_span
+        request.extensions["trace"] = _build_httpcore_trace(dependency, trace, request_span)
+
+    def _on_response(response: httpx.Response) -> None:
+        request_span = response.request.extensions.get("rag_span")
+        if isinstance(request_span, Span):
+            request_span.attributes["status"] = response.status_code
+            request_span.finish()
+
+    return {"request": [_on_request], "response": [_on_response]}
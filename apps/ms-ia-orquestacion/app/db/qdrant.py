@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import time
 from functools import lru_cache
 from typing import Any
 
@@ -7,6 +8,7 @@ from qdrant_client import QdrantClient, models
 
 from app.core.config import get_settings
 from app.core.logger import get_logger
+from app.core.tracing import build_http_event_hooks
 
 
 logger = get_logger("ms-ia-orquestacion.qdrant")
@@ -49,66 +51,99 @@ def get_qdrant_client() -> QdrantClient:
         url=settings.qdrant_url,
         api_key=settings.qdrant_api_key or None,
         timeout=settings.qdrant_timeout_s,
+        event_hooks=build_http_event_hooks("qdrant"),
     )
     client.get_collections()
     logger.info("qdrant_client_ready url=%s collection=%s", settings.qdrant_url, settings.qdrant_collection)
     return client
 
 
-def ensure_rag_collection() -> None:
-    settings = get_settings()
-    client = get_qdrant_client()
-    collections = client.get_collections().collections
-    exists = any(item.name == settings.qdrant_collection for item in collections)
-    if exists:
-        collection_info = client.get_collection(settings.qdrant_collection)
-        vectors_cfg = collection_info.config.params.vectors
-        current_dim: int | None = None
-
-        if isinstance(vectors_cfg, dict):
-            first_cfg = next(iter(vectors_cfg.values()), None)
-            current_dim = int(first_cfg.size) if first_cfg is not None else None
-        else:
-            current_dim = int(vectors_cfg.size)
-
-        if current_dim != settings.embedding_dimensions:
-            logger.warning(
-                "qdrant_collection_dim_mismatch collection=%s current_dim=%s target_dim=%d recreating=true",
-                settings.qdrant_collection,
-                current_dim,
-                settings.embedding_dimensions,
-            )
-            client.recreate_collection(
-                collection_name=settings.qdrant_collection,
-                vectors_config=models.VectorParams(
-                    size=settings.embedding_dimensions,
-                    distance=models.Distance.COSINE,
-                ),
-            )
-            logger.info(
-                "qdrant_collection_recreated name=%s dim=%d",
-                settings.qdrant_collection,
-                settings.embedding_dimensions,
-            )
-
-        _ensure_payload_index(client, settings.qdrant_collection, "source")
-        _ensure_payload_index(client, settings.qdrant_collection, "version")
-        return
+def versioned_collection_name(alias: str) -> str:
+    return f"{alias}__{time.strftime('%Y%m%d%H%M%S', time.gmtime())}"
+
+
+def resolve_alias(client: QdrantClient, alias: str) -> str | None:
+    """Coleccion a la que apunta el alias, o None si el nombre no es un alias."""
+    for item in client.get_aliases().aliases:
+        if item.alias_name == alias:
+            return item.collection_name
+    return None
+
+
+def switch_alias(client: QdrantClient, alias: str, collection_name: str) -> str | None:
+    """
+    Apunta el alias a collection_name en una sola operacion atomica: las busquedas pasan de la
+    coleccion previa a la nueva sin ventana intermedia. Devuelve la coleccion previa.
+    """
+    previous = resolve_alias(client, alias)
+    operations: list[Any] = []
+    if previous is not None:
+        operations.append(models.DeleteAliasOperation(delete_alias=models.DeleteAlias(alias_name=alias)))
+    operations.append(
+        models.CreateAliasOperation(create_alias=models.CreateAlias(collection_name=collection_name, alias_name=alias))
+    )
+    client.update_collection_aliases(change_aliases_operations=operations)
+    logger.info("qdrant_alias_switched alias=%s collection=%s previous=%s", alias, collection_name, previous)
+    return previous
+
+
+def collection_dim(client: QdrantClient, collection_name: str) -> int | None:
+    vectors_cfg = client.get_collection(collection_name).config.params.vectors
+    if isinstance(vectors_cfg, dict):
+        first_cfg = next(iter(vectors_cfg.values()), None)
+        return int(first_cfg.size) if first_cfg is not None else None
+    return int(vectors_cfg.size)
+
 
+def create_rag_collection(client: QdrantClient, collection_name: str) -> None:
+    settings = get_settings()
     client.create_collection(
-        collection_name=settings.qdrant_collection,
+        collection_name=collection_name,
         vectors_config=models.VectorParams(
             size=settings.embedding_dimensions,
             distance=models.Distance.COSINE,
         ),
     )
-    logger.info(
-        "qdrant_collection_created name=%s dim=%d",
-        settings.qdrant_collection,
-        settings.embedding_dimensions,
-    )
-    _ensure_payload_index(client, settings.qdrant_collection, "source")
-    _ensure_payload_index(client, settings.qdrant_collection, "version")
+    logger.info("qdrant_collection_created name=%s dim=%d", collection_name, settings.embedding_dimensions)
+    _ensure_payload_index(client, collection_name, "source")
+    _ensure_payload_index(client, collection_name, "version")
+    _ensure_payload_index(client, collection_name, "lshBands")
+
+
+def ensure_rag_collection() -> None:
+    """
+    QDRANT_COLLECTION es el nombre de lectura: un alias a una coleccion versionada (nombre__fecha) o,
+    en despliegues previos, la coleccion misma. Si no existe se crea una coleccion versionada con el
+    alias. Con otra dimension de embeddings no se recrea (borraria el indice en uso): hay que
+    reindexar (ingest_pdf --reindex), que construye la coleccion nueva y cambia el alias.
+    """
+    settings = get_settings()
+    client = get_qdrant_client()
+    alias = settings.qdrant_collection
+    current = resolve_alias(client, alias)
+    if current is None and not any(item.name == alias for item in client.get_collections().collections):
+        current = versioned_collection_name(alias)
+        create_rag_collection(client, current)
+        switch_alias(client, alias, current)
+        return
+
+    current = current or alias
+    current_dim = collection_dim(client, current)
+    if current_dim != settings.embedding_dimensions:
+        logger.error(
+            "qdrant_collection_dim_mismatch collection=%s current_dim=%s target_dim=%d",
+            current,
+            current_dim,
+            settings.embedding_dimensions,
+        )
+        raise ValueError(
+            f"La coleccion {current} tiene dimension {current_dim} y RAG_EMBED_DIM es {settings.embedding_dimensions}; "
+            "reindexar con python -m app.scripts.ingest_pdf --dir <pdfs> --reindex"
+        )
+
+    _ensure_payload_index(client, current, "source")
+    _ensure_payload_index(client, current, "version")
+    _ensure_payload_index(client, current, "lshBands")
 
 
 def qdrant_ping() -> dict[str, Any]:
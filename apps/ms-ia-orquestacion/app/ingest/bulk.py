@@ -0,0 +1,186 @@
+from __future__ import annotations
+
+import glob
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field, replace
+from pathlib import Path
+from typing import Any, Callable
+
+from app.core.logger import get_logger
+from app.db.qdrant import ensure_rag_collection
+from app.ingest.ingest_service import IngestOptions, PDFIngestService
+from app.ingest.manifest import IngestManifest, file_sha256
+
+
+logger = get_logger("ms-ia-orquestacion.ingest.bulk")
+
+
+@dataclass
+class BulkIngestReport:
+    files: int
+    completed: int
+    skipped: int
+    failed: int
+    resumed: int
+    totalPages: int
+    totalChunks: int
+    inserted: int
+    nearDuplicates: int
+    estimatedTokens: int
+    estimatedEmbeddingCostUsd: float
+    durationMs: int
+    filesPerSecond: float
+    pagesPerSecond: float
+    chunksPerSecond: float
+    megabytesPerSecond: float
+    processPeakRssMb: float | None = None
+    results: list[dict[str, Any]] = field(default_factory=list)
+
+    def to_dict(self) -> dict[str, Any]:
+        return asdict(self)
+
+
+def resolve_pdf_files(directory: str | None = None, pattern: str | None = None) -> list[str]:
+    """PDFs de un directorio (recursivo) o de un glob, como rutas absolutas ordenadas y sin repetir."""
+    matches: list[Path] = []
+    if directory:
+        root = Path(directory)
+        if not root.is_dir():
+            raise FileNotFoundError(f"Directorio no encontrado: {root}")
+        matches.extend(path for path in root.rglob("*") if path.suffix.lower() == ".pdf")
+    if pattern:
+        matches.extend(Path(path) for path in glob.glob(pattern, recursive=True))
+    return sorted({str(path.resolve()) for path in matches if path.is_file()})
+
+
+def common_root(files: list[str], directory: str | None = None) -> str:
+    """Directorio raiz de una corrida masiva: --dir o, con --glob, el ancestro comun de los PDFs."""
+    parents = [str(Path(path).resolve().parent) for path in files]
+    if directory:
+        parents.append(str(Path(directory).resolve()))
+    return os.path.commonpath(parents)
+
+
+def relative_doc_id(file_path: str, root: str) -> str:
+    """
+    docId de un PDF de una corrida masiva: su ruta relativa a la raiz, sin extension. Con --dir
+    recursivo, a/ley.pdf y b/ley.pdf no comparten docId (ni los ids de sus chunks).
+    """
+    return Path(file_path).resolve().relative_to(Path(root).resolve()).with_suffix("").as_posix()
+
+
+def _options_key(options: IngestOptions) -> str:
+    # Los batches solo son reanudables si el chunking y el tamano de batch no cambiaron.
+    return f"{options.chunk_size}:{options.overlap}:{options.min_chunk_size}:{options.batch_size}:{options.version}"
+
+
+def _ingest_one(
+    service: PDFIngestService,
+    manifest: IngestManifest | None,
+    file_path: str,
+    make_options: Callable[[str], IngestOptions],
+) -> dict[str, Any]:
+    """Un archivo de la corrida: cualquier error (PDF ilegible, hash, ingesta) queda como status failed."""
+    try:
+        return _ingest_file(service, manifest, file_path, make_options)
+    except Exception as exc:
+        logger.exception("ingest_bulk_file_failed file=%s", file_path)
+        if manifest is not None:
+            manifest.fail(file_path, f"{type(exc).__name__}: {exc}")
+        return {"filePath": file_path, "status": "failed", "error": str(exc)}
+
+
+def _ingest_file(
+    service: PDFIngestService,
+    manifest: IngestManifest | None,
+    file_path: str,
+    make_options: Callable[[str], IngestOptions],
+) -> dict[str, Any]:
+    options = make_options(file_path)
+    if manifest is None:
+        return {"filePath": file_path, "status": "done", "report": service.ingest_pdf(options).to_dict()}
+
+    sha256 = file_sha256(file_path)
+    options_key = _options_key(options)
+    resume_from = manifest.resume_point(file_path, sha256, options_key)
+    if resume_from is None:
+        logger.info("ingest_bulk_skip file=%s reason=already_done", file_path)
+        return {"filePath": file_path, "status": "skipped"}
+
+    if resume_from:
+        logger.info("ingest_bulk_resume file=%s from_batch=%d", file_path, resume_from)
+    manifest.start(file_path, sha256, options_key, resume_from)
+    report = service.ingest_pdf(
+        replace(options, resume_from_batch=resume_from),
+        on_batch=lambda batch_index: manifest.batch_done(file_path, batch_index),
+    )
+    manifest.finish(file_path, report.to_dict())
+    return {"filePath": file_path, "status": "done", "resumedFromBatch": resume_from, "report": report.to_dict()}
+
+
+def _summarize(result: dict[str, Any]) -> dict[str, Any]:
+    summary = {key: value for key, value in result.items() if key != "report"}
+    report = result.get("report")
+    if report is not None:
+        summary.update({"inserted": report["inserted"], "skippedChunks": report["skipped"], "durationMs": report["durationMs"]})
+    return summary
+
+
+def ingest_many(
+    files: list[str],
+    make_options: Callable[[str], IngestOptions],
+    manifest: IngestManifest | None,
+    concurrency: int = 2,
+    service: PDFIngestService | None = None,
+) -> BulkIngestReport:
+    """
+    Ingesta varios PDFs con a lo sumo `concurrency` documentos en paralelo (cada uno con su pipeline
+    por etapas). Con manifest, los archivos completos con el mismo hash se saltan y los interrumpidos
+    retoman desde el ultimo batch subido. Sin manifest (dry-run, reindexacion) no se registra nada.
+    service (opcional) fija la coleccion destino; por defecto QDRANT_COLLECTION.
+    """
+    started = time.perf_counter()
+    if service is None:
+        ensure_rag_collection()
+        service = PDFIngestService()
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="ingest-doc") as pool:
+        results = list(pool.map(lambda path: _ingest_one(service, manifest, path, make_options), files))
+
+    duration_s = max(time.perf_counter() - started, 1e-9)
+    reports = [result["report"] for result in results if result["status"] == "done"]
+    processed_bytes = sum(os.path.getsize(result["filePath"]) for result in results if result["status"] == "done")
+    pages = sum(int(report["totalPages"]) for report in reports)
+    chunks = sum(int(report["totalChunks"]) for report in reports)
+    tokens = sum(int(report["estimatedTokens"]) for report in reports)
+
+    bulk_report = BulkIngestReport(
+        files=len(files),
+        completed=len(reports),
+        skipped=sum(1 for result in results if result["status"] == "skipped"),
+        failed=sum(1 for result in results if result["status"] == "failed"),
+        resumed=sum(1 for result in results if result.get("resumedFromBatch")),
+        totalPages=pages,
+        totalChunks=chunks,
+        inserted=sum(int(report["inserted"]) for report in reports),
+        nearDuplicates=sum(int(report.get("nearDuplicates") or 0) for report in reports),
+        estimatedTokens=tokens,
+        estimatedEmbeddingCostUsd=round(sum(float(report["estimatedEmbeddingCostUsd"]) for report in reports), 6),
+        durationMs=int(duration_s * 1000),
+        filesPerSecond=round(len(reports) / duration_s, 3),
+        pagesPerSecond=round(pages / duration_s, 2),
+        chunksPerSecond=round(chunks / duration_s, 2),
+        megabytesPerSecond=round(processed_bytes / (1024 * 1024) / duration_s, 3),
+        processPeakRssMb=max(
+            (report["processPeakRssMb"] for report in reports if report.get("processPeakRssMb") is not None), default=None
+        ),
+        results=[_summarize(result) for result in results],
+    )
+    logger.info(
+        "ingest_bulk end report=%s",
+        json.dumps({key: value for key, value in bulk_report.to_dict().items() if key != "results"}),
+    )
+    return bulk_report
@@ -1,55 +1,225 @@
 from __future__ import annotations
 
 import re
-from dataclasses import dataclass
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass, field
+from typing import Iterable, Iterator
 
+from app.ingest.pdf_loader import PageText
 
-@dataclass(frozen=True)
+
+@dataclass(frozen=True, slots=True, eq=False)
 class Chunk:
+    """
+    Chunk como offsets sobre un buffer de texto normalizado: no guarda copia propia del texto.
+    start_char/end_char son el rango del corte; text_start/text_end, el mismo rango sin espacios de
+    borde. text se arma al accederlo, a partir de buffer (que empieza en el offset buffer_start).
+    Con chunk_text todos los chunks comparten el texto completo; en streaming (iter_page_chunks)
+    cada chunk retiene el buffer de su ventana, que vive mientras viva algun chunk que lo use.
+    Sin igualdad por valor: los offsets solos no identifican un chunk entre documentos.
+    """
+
     chunk_index: int
-    text: str
-    normalized_text: str
     start_char: int
     end_char: int
     page_start: int | None
     page_end: int | None
+    text_start: int
+    text_end: int
+    buffer: str = field(repr=False, compare=False)
+    buffer_start: int = field(default=0, repr=False, compare=False)
+
+    @property
+    def text(self) -> str:
+        return self.buffer[self.text_start - self.buffer_start: self.text_end - self.buffer_start]
+
+    @property
+    def normalized_text(self) -> str:
+        # El buffer ya esta normalizado.
+        return self.text
+
+
+_WHITESPACE_RUN = re.compile(r"\s+")
+_SENTENCE_BREAK = re.compile(r"[\.!?](?=\s)")
+_LINE_BREAK = re.compile(r"\n")
+_SPACE_BREAK = re.compile(r"\s")
+_COMPACT_AFTER = 4096
 
 
 def normalize_text(text: str) -> str:
     text = text.replace("\r", "\n")
     text = text.replace("-\n", "")
-    text = re.sub(r"\s+", " ", text)
+    text = _WHITESPACE_RUN.sub(" ", text)
     return text.strip()
 
 
-def _infer_page_range(spans: list[tuple[int, int, int]], start: int, end: int) -> tuple[int | None, int | None]:
-    pages: list[int] = []
-    for page, p_start, p_end in spans:
-        overlaps = (p_start < end) and (start < p_end)
-        if overlaps:
-            pages.append(page)
+def _validate_chunk_params(chunk_size: int, overlap: int) -> None:
+    if chunk_size <= 0:
+        raise ValueError("chunk_size debe ser > 0")
+    if overlap < 0 or overlap >= chunk_size:
+        raise ValueError("overlap debe ser >= 0 y menor que chunk_size")
 
-    if not pages:
-        return None, None
-    return min(pages), max(pages)
 
+class _Offsets:
+    """Lista creciente de offsets globales; descarta los viejos sin mover memoria en cada corte."""
 
-def _find_split_point(text: str, start: int, target_end: int, hard_end: int) -> int:
-    window = text[start:hard_end]
-    sentence_breaks = [m.start() for m in re.finditer(r"[\.!?]\s", window)]
-    line_breaks = [m.start() for m in re.finditer(r"\n", window)]
-    spaces = [m.start() for m in re.finditer(r"\s", window)]
+    __slots__ = ("values", "first")
 
-    candidates = sentence_breaks or line_breaks or spaces
-    if not candidates:
-        return hard_end
+    def __init__(self) -> None:
+        self.values: list[int] = []
+        self.first = 0
+
+    def drop_through(self, offset: int) -> None:
+        self.first = bisect_right(self.values, offset, self.first)
+        if self.first > _COMPACT_AFTER and self.first * 2 > len(self.values):
+            del self.values[: self.first]
+            self.first = 0
 
-    absolute_candidates = [start + c + 1 for c in candidates]
-    near = [c for c in absolute_candidates if c <= hard_end and c >= start + 1]
-    if not near:
+    def nearest(self, lo: int, hi: int, target: int) -> int | None:
+        """Offset en [lo, hi] mas cercano a target; ante empate, el menor."""
+        left = bisect_left(self.values, lo, self.first)
+        right = bisect_right(self.values, hi, left)
+        if left >= right:
+            return None
+        pos = bisect_left(self.values, target, left, right)
+        best = self.values[pos] if pos < right else None
+        if pos > left:
+            previous = self.values[pos - 1]
+            if best is None or target - previous <= best - target:
+                best = previous
+        return best
+
+
+class _Chunker:
+    """
+    Cortes de chunk_size (hasta chunk_size * 1.15) sobre texto normalizado, en tiempo lineal.
+    Los puntos de corte posibles (fin de oracion, salto de linea, espacio) se indexan una sola vez,
+    al agregar texto; cada corte es una busqueda binaria del mas cercano a start + chunk_size, con la
+    misma prioridad que antes: oracion, luego linea, luego espacio. Las paginas se ubican tambien
+    por busqueda binaria sobre sus rangos (ordenados).
+    """
+
+    def __init__(self, chunk_size: int, overlap: int, min_chunk_size: int) -> None:
+        _validate_chunk_params(chunk_size, overlap)
+        self.chunk_size = chunk_size
+        self.overlap = overlap
+        self.min_chunk_size = min_chunk_size
+        self.lookahead = int(chunk_size * 1.15)
+        self.buffer = ""
+        self.base = 0
+        self.start = 0
+        self.index = 0
+        self.sentences = _Offsets()
+        self.lines = _Offsets()
+        self.spaces = _Offsets()
+        self.page_numbers: list[int] = []
+        self.page_starts: list[int] = []
+        self.page_ends: list[int] = []
+
+    @property
+    def end_offset(self) -> int:
+        return self.base + len(self.buffer)
+
+    def append(self, text: str) -> None:
+        scan_from = len(self.buffer)
+        self.buffer += text
+        base = self.base
+        # Un corte cae justo despues del caracter: offset = fin del match.
+        # Desde un caracter antes: la puntuacion final del texto previo recien ahora tiene su espacio.
+        sentence_from = max(0, scan_from - 1)
+        self.sentences.values += [base + m.end() for m in _SENTENCE_BREAK.finditer(self.buffer, sentence_from)]
+        self.lines.values += [base + m.end() for m in _LINE_BREAK.finditer(self.buffer, scan_from)]
+        self.spaces.values += [base + m.end() for m in _SPACE_BREAK.finditer(self.buffer, scan_from)]
+
+    def drop_last_char(self) -> None:
+        # Solo se usa para el guion final (no es punto de corte), por eso el indice no cambia.
+        self.buffer = self.buffer[:-1]
+
+    def add_page(self, page: int, start: int, end: int) -> None:
+        self.page_numbers.append(page)
+        self.page_starts.append(start)
+        self.page_ends.append(end)
+
+    def _page_range(self, start: int, end: int) -> tuple[int | None, int | None]:
+        first = bisect_right(self.page_ends, start)
+        last = bisect_left(self.page_starts, end) - 1
+        if first > last:
+            return None, None
+        pages = self.page_numbers[first: last + 1]
+        return min(pages), max(pages)
+
+    def _strip_bounds(self, start: int, end: int) -> tuple[int, int]:
+        """Equivale a buffer[start:end].strip(), pero devuelve offsets en vez de copiar el texto."""
+        buffer, base = self.buffer, self.base
+        while start < end and buffer[start - base].isspace():
+            start += 1
+        while end > start and buffer[end - 1 - base].isspace():
+            end -= 1
+        return start, end
+
+    def _split_point(self, start: int, target_end: int, hard_end: int) -> int:
+        # El fin de oracion necesita su espacio dentro de la ventana: corte <= hard_end - 1.
+        for offsets, upper in ((self.sentences, hard_end - 1), (self.lines, hard_end), (self.spaces, hard_end)):
+            split = offsets.nearest(start + 1, upper, target_end)
+            if split is not None:
+                return split
         return hard_end
 
-    return min(near, key=lambda c: abs(c - target_end))
+    def cuts(self, final: bool) -> Iterator[Chunk]:
+        """
+        Emite los chunks cuya ventana ya esta completa. Sin final, el ultimo caracter del buffer se
+        reserva porque el texto siguiente puede modificarlo (guion de corte entre paginas).
+        """
+        text_len = self.end_offset
+        while self.start < text_len and (final or self.start + self.lookahead < text_len):
+            start = self.start
+            target_end = min(start + self.chunk_size, text_len)
+            hard_end = min(start + self.lookahead, text_len)
+            end = self._split_point(start, target_end, hard_end)
+
+            if end <= start:
+                end = min(start + self.chunk_size, text_len)
+
+            text_start, text_end = self._strip_bounds(start, end)
+            if text_end - text_start < self.min_chunk_size and end < text_len:
+                end = min(text_len, start + self.chunk_size)
+                text_start, text_end = self._strip_bounds(start, end)
+
+            if text_end > text_start:
+                page_start, page_end = self._page_range(start, end)
+                # Sin copiar texto: el chunk referencia el buffer actual y sus offsets.
+                yield Chunk(
+                    chunk_index=self.index,
+                    start_char=start,
+                    end_char=end,
+                    page_start=page_start,
+                    page_end=page_end,
+                    text_start=text_start,
+                    text_end=text_end,
+                    buffer=self.buffer,
+                    buffer_start=self.base,
+                )
+                self.index += 1
+
+            if end >= text_len:
+                self.start = text_len
+                break
+            # Siempre avanza: con un corte mas corto que overlap, end - overlap no superaba start y el loop no terminaba.
+            self.start = max(start + 1, end - self.overlap)
+
+        self._discard_consumed()
+
+    def _discard_consumed(self) -> None:
+        # Se descarta el texto ya cortado, sus puntos de corte y las paginas que no tocan chunks futuros.
+        self.buffer = self.buffer[self.start - self.base:]
+        self.base = self.start
+        for offsets in (self.sentences, self.lines, self.spaces):
+            offsets.drop_through(self.start)
+        first_page = bisect_right(self.page_ends, self.start)
+        if first_page:
+            del self.page_numbers[:first_page]
+            del self.page_starts[:first_page]
+            del self.page_ends[:first_page]
 
 
 def chunk_text(
@@ -59,50 +229,42 @@ def chunk_text(
     overlap: int,
     min_chunk_size: int,
 ) -> list[Chunk]:
-    if chunk_size <= 0:
-        raise ValueError("chunk_size debe ser > 0")
-    if overlap < 0 or overlap >= chunk_size:
-        raise ValueError("overlap debe ser >= 0 y menor que chunk_size")
-
+    """page_spans: (page, start, end) ordenados, como los devuelve flatten_pages."""
+    chunker = _Chunker(chunk_size, overlap, min_chunk_size)
     normalized = normalize_text(text)
     if not normalized:
         return []
 
-    chunks: list[Chunk] = []
-    start = 0
-    index = 0
-    text_len = len(normalized)
-
-    while start < text_len:
-        target_end = min(start + chunk_size, text_len)
-        hard_end = min(start + int(chunk_size * 1.15), text_len)
-        end = _find_split_point(normalized, start, target_end, hard_end)
-
-        if end <= start:
-            end = min(start + chunk_size, text_len)
-
-        chunk_text_raw = normalized[start:end].strip()
-        if len(chunk_text_raw) < min_chunk_size and end < text_len:
-            end = min(text_len, start + chunk_size)
-            chunk_text_raw = normalized[start:end].strip()
-
-        if chunk_text_raw:
-            page_start, page_end = _infer_page_range(page_spans, start, end)
-            chunks.append(
-                Chunk(
-                    chunk_index=index,
-                    text=chunk_text_raw,
-                    normalized_text=normalize_text(chunk_text_raw),
-                    start_char=start,
-                    end_char=end,
-                    page_start=page_start,
-                    page_end=page_end,
-                )
-            )
-            index += 1
+    for page, start, end in page_spans:
+        chunker.add_page(page, start, end)
+    chunker.append(normalized)
+    return list(chunker.cuts(final=True))
+
 
-        if end >= text_len:
-            break
-        start = max(0, end - overlap)
+def iter_page_chunks(
+    pages: Iterable[PageText],
+    chunk_size: int,
+    overlap: int,
+    min_chunk_size: int,
+) -> Iterator[Chunk]:
+    """
+    Version en streaming de chunk_text(flatten_pages(pages)): produce los mismos cortes, pero
+    consume las paginas a medida que llegan y solo retiene el texto aun no cortado.
+    Los offsets y el rango de paginas se calculan sobre el texto normalizado.
+    """
+    chunker = _Chunker(chunk_size, overlap, min_chunk_size)
+    for page in pages:
+        piece = normalize_text(page.text)
+        if not piece:
+            continue
+        if chunker.buffer:
+            # Igual que normalize_text sobre el documento unido: "-\n\n" entre paginas se pierde el guion.
+            if chunker.buffer.endswith("-"):
+                chunker.drop_last_char()
+            chunker.append(" ")
+        page_start = chunker.end_offset
+        chunker.append(piece)
+        chunker.add_page(page.page, page_start, chunker.end_offset)
+        yield from chunker.cuts(final=False)
 
-    return chunks
+    yield from chunker.cuts(final=True)
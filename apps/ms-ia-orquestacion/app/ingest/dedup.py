@@ -0,0 +1,222 @@
+from __future__ import annotations
+
+import hashlib
+import threading
+import zlib
+from dataclasses import dataclass, field, replace
+from typing import Any
+
+import numpy as np
+from qdrant_client import QdrantClient, models
+
+from app.core.logger import get_logger
+
+
+logger = get_logger("ms-ia-orquestacion.ingest.dedup")
+
+NUM_PERM = 128
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+SHINGLE_WORDS = 5
+# Payload que solo usa la deduplicacion; el retrieval lo excluye.
+DEDUP_PAYLOAD_FIELDS = ("minhash", "lshBands")
+
+_PRIME = (1 << 61) - 1
+# Semilla fija: las firmas guardadas en Qdrant tienen que ser comparables entre corridas.
+_RNG = np.random.default_rng(20240611)
+_A = _RNG.integers(1, 1 << 29, NUM_PERM, dtype=np.uint64)
+_B = _RNG.integers(0, 1 << 29, NUM_PERM, dtype=np.uint64)
+_SCROLL_LIMIT = 256
+_MERGE_BATCH = 64
+_MERGE_LOCK = threading.Lock()
+
+
+def _shingle_hashes(text: str) -> np.ndarray:
+    words = text.lower().split()
+    if len(words) <= SHINGLE_WORDS:
+        shingles = {" ".join(words)}
+    else:
+        shingles = {" ".join(words[idx: idx + SHINGLE_WORDS]) for idx in range(len(words) - SHINGLE_WORDS + 1)}
+    return np.fromiter((zlib.crc32(shingle.encode("utf-8")) for shingle in shingles), dtype=np.uint64, count=len(shingles))
+
+
+def minhash_signature(text: str) -> np.ndarray:
+    """MinHash de shingles de 5 palabras: NUM_PERM minimos de (a*h + b) mod p, como uint32."""
+    hashes = _shingle_hashes(text)
+    # h < 2^32 y a, b < 2^29: el producto entra en uint64 sin desbordar.
+    permuted = (np.outer(hashes, _A) + _B) % _PRIME
+    return (permuted & 0xFFFFFFFF).min(axis=0).astype(np.uint32)
+
+
+def band_keys(signature: np.ndarray) -> list[str]:
+    """Llaves LSH: BANDS bandas de ROWS filas. Dos chunks son candidatos si comparten alguna banda."""
+    rows = signature.reshape(BANDS, ROWS)
+    return [f"{band}:{hashlib.blake2b(rows[band].tobytes(), digest_size=8).hexdigest()}" for band in range(BANDS)]
+
+
+def estimated_similarity(signature: np.ndarray, others: np.ndarray) -> np.ndarray:
+    """Jaccard estimada (fraccion de minimos iguales) contra cada fila de others."""
+    return (others == signature).mean(axis=1)
+
+
+@dataclass(frozen=True)
+class ChunkSketch:
+    point_id: str
+    signature: np.ndarray
+    bands: list[str]
+    # Referencias ya fusionadas en este mismo punto: el upsert reemplaza el payload y no deben perderse.
+    duplicates: list[dict[str, Any]] = field(default_factory=list)
+
+    def payload(self) -> dict[str, Any]:
+        payload: dict[str, Any] = {"minhash": self.signature.tolist(), "lshBands": self.bands}
+        if self.duplicates:
+            payload["duplicates"] = self.duplicates
+        return payload
+
+
+class NearDuplicateFilter:
+    """
+    Deteccion de chunks casi duplicados de un documento (MinHash + LSH), antes de embeberlos.
+
+    Cada chunk se compara con los ya aceptados del mismo documento (indice en memoria) y con los
+    puntos de la coleccion del mismo source y version que comparten alguna banda LSH (un scroll por
+    batch, filtrando lshBands). Con similitud >= threshold el chunk no se embebe ni se inserta: su
+    referencia (docId, pagina, chunkIndex) se agrega al payload duplicates del punto que ya lo
+    contiene, con apply_merges() despues de la barrera de upsert.
+    Limitar a source y version mantiene al duplicado visible para los filtros del retrieval por
+    source/version, y el punto canonico solo se borra junto con el source entero.
+    exclude_source descarta como candidatos los puntos de un source que se esta reemplazando.
+    """
+
+    def __init__(
+        self,
+        client: QdrantClient,
+        collection_name: str,
+        threshold: float,
+        source: str,
+        version: str,
+        exclude_source: str | None = None,
+    ) -> None:
+        self.client = client
+        self.collection_name = collection_name
+        self.threshold = threshold
+        self.source = source
+        self.version = version
+        self.exclude_source = exclude_source
+        self.duplicates = 0
+        self.merges: dict[str, list[dict[str, Any]]] = {}
+        self._signatures: dict[str, np.ndarray] = {}
+        self._bands: dict[str, list[str]] = {}
+
+    def _stored_candidates(self, keys: set[str]) -> tuple[list[str], np.ndarray | None, dict[str, list[dict[str, Any]]]]:
+        must_not = None
+        if self.exclude_source:
+            must_not = [models.FieldCondition(key="source", match=models.MatchValue(value=self.exclude_source))]
+        candidate_filter = models.Filter(
+            must=[
+                models.FieldCondition(key="source", match=models.MatchValue(value=self.source)),
+                models.FieldCondition(key="version", match=models.MatchValue(value=self.version)),
+            ],
+            should=[models.FieldCondition(key="lshBands", match=models.MatchAny(any=sorted(keys)))],
+            must_not=must_not,
+        )
+        ids: list[str] = []
+        signatures: list[list[int]] = []
+        duplicates: dict[str, list[dict[str, Any]]] = {}
+        offset: str | int | None = None
+        while True:
+            points, offset = self.client.scroll(
+                collection_name=self.collection_name,
+                scroll_filter=candidate_filter,
+                with_payload=["minhash", "duplicates"],
+                with_vectors=False,
+                limit=_SCROLL_LIMIT,
+                offset=offset,
+            )
+            for point in points:
+                payload = point.payload or {}
+                minhash = payload.get("minhash")
+                if minhash and len(minhash) == NUM_PERM:
+                    ids.append(str(point.id))
+                    signatures.append(minhash)
+                    if payload.get("duplicates"):
+                        duplicates[str(point.id)] = list(payload["duplicates"])
+            if offset is None:
+                break
+        if not ids:
+            return [], None, duplicates
+        return ids, np.asarray(signatures, dtype=np.uint32), duplicates
+
+    def _best_match(self, sketch: ChunkSketch, stored_ids: list[str], stored: np.ndarray | None) -> tuple[str, float] | None:
+        best: tuple[str, float] | None = None
+        if stored is not None:
+            scores = estimated_similarity(sketch.signature, stored)
+            for idx in np.flatnonzero(scores >= self.threshold):
+                # El mismo punto (reingesta sin cambios) no es un duplicado: el upsert lo sobrescribe.
+                if stored_ids[idx] != sketch.point_id and (best is None or scores[idx] > best[1]):
+                    best = (stored_ids[idx], float(scores[idx]))
+
+        local_ids = {point_id for key in sketch.bands for point_id in self._bands.get(key, ())}
+        local_ids.discard(sketch.point_id)
+        for point_id in local_ids:
+            score = float(estimated_similarity(sketch.signature, self._signatures[point_id][None, :])[0])
+            if score >= self.threshold and (best is None or score > best[1]):
+                best = (point_id, score)
+        return best
+
+    def filter(self, point_ids: list[str], texts: list[str], refs: list[dict[str, Any]]) -> list[tuple[int, ChunkSketch]]:
+        """Devuelve (posicion, sketch) de los chunks a insertar; los duplicados quedan en merges."""
+        sketches = [
+            ChunkSketch(point_id=point_id, signature=signature, bands=band_keys(signature))
+            for point_id, signature in zip(point_ids, (minhash_signature(text) for text in texts))
+        ]
+        stored_ids, stored, stored_duplicates = self._stored_candidates({key for sketch in sketches for key in sketch.bands})
+
+        kept: list[tuple[int, ChunkSketch]] = []
+        for position, (sketch, ref) in enumerate(zip(sketches, refs)):
+            match = self._best_match(sketch, stored_ids, stored)
+            if match is not None:
+                self.duplicates += 1
+                self.merges.setdefault(match[0], []).append(ref)
+                continue
+            if sketch.point_id in stored_duplicates:
+                sketch = replace(sketch, duplicates=stored_duplicates[sketch.point_id])
+            kept.append((position, sketch))
+            self._signatures[sketch.point_id] = sketch.signature
+            for key in sketch.bands:
+                self._bands.setdefault(key, []).append(sketch.point_id)
+        return kept
+
+    def apply_merges(self) -> int:
+        """Agrega las referencias de los duplicados al payload duplicates de cada punto canonico."""
+        point_ids = list(self.merges)
+        updated = 0
+        # Lectura + escritura del payload: se serializa entre documentos que se ingestan en paralelo.
+        with _MERGE_LOCK:
+            for start in range(0, len(point_ids), _MERGE_BATCH):
+                points = self.client.retrieve(
+                    collection_name=self.collection_name,
+                    ids=point_ids[start: start + _MERGE_BATCH],
+                    with_payload=["duplicates"],
+                )
+                operations = []
+                for point in points:
+                    existing = list((point.payload or {}).get("duplicates") or [])
+                    seen = {(ref.get("docId"), ref.get("chunkIndex")) for ref in existing}
+                    added = [ref for ref in self.merges[str(point.id)] if (ref["docId"], ref["chunkIndex"]) not in seen]
+                    if added:
+                        operations.append(
+                            models.SetPayloadOperation(
+                                set_payload=models.SetPayload(payload={"duplicates": existing + added}, points=[point.id])
+                            )
+                        )
+                if operations:
+                    self.client.batch_update_points(collection_name=self.collection_name, update_operations=operations)
+                    updated += len(operations)
+        logger.info(
+            "ingest_dedup_merged collection=%s duplicates=%d points_updated=%d",
+            self.collection_name,
+            self.duplicates,
+            updated,
+        )
+        return updated
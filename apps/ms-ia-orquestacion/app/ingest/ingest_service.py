@@ -2,25 +2,35 @@ from __future__ import annotations
 
 import hashlib
 import json
+import os
+import sys
 import time
 import uuid
-from dataclasses import asdict, dataclass
+from dataclasses import asdict, dataclass, field
 from datetime import datetime, timezone
+from functools import partial
 from pathlib import Path
-from typing import Any
+from typing import Any, Callable, Iterable, Iterator
 
-from qdrant_client import models
+from qdrant_client import QdrantClient, models
 
 from app.ai.embeddings import embed_texts, estimate_tokens
 from app.core.config import get_settings
 from app.core.logger import get_logger
 from app.db.qdrant import ensure_rag_collection, get_qdrant_client
-from app.ingest.chunking import Chunk, chunk_text
-from app.ingest.pdf_loader import flatten_pages, load_pdf_pages
+from app.ingest.chunking import Chunk, iter_page_chunks
+from app.ingest.dedup import ChunkSketch, NearDuplicateFilter
+from app.ingest.pdf_cache import ParsedPdfCache
+from app.ingest.pdf_loader import PageText, iter_pdf_pages
+from app.ingest.pipeline import Stage, batched, timed
+from app.ingest.upload import QdrantBatchUploader, build_batch
+from app.rag.answer_cache import invalidate_answer_cache
 
 
 logger = get_logger("ms-ia-orquestacion.ingest")
 
+_STAGE_TIMINGS = ("extract", "chunk", "tokenize", "dedup", "embed", "upsert")
+
 
 @dataclass(frozen=True)
 class IngestOptions:
@@ -35,6 +45,10 @@ class IngestOptions:
     batch_size: int
     dry_run: bool
     replace_source: bool
+    extract_workers: int = 1
+    resume_from_batch: int = 0
+    use_pdf_cache: bool = True
+    dedup: bool = True
 
 
 @dataclass
@@ -53,6 +67,13 @@ class IngestReport:
     estimatedEmbeddingCostUsd: float
     durationMs: int
     sourceDocsDeleted: int
+    nearDuplicates: int = 0
+    # Pico de RSS del proceso desde que arranco (ru_maxrss), no de esta ingesta: en la API, el worker o
+    # una corrida masiva con concurrencia lo comparten todos los documentos.
+    processPeakRssMb: float | None = None
+    # RSS al terminar menos RSS al empezar esta ingesta (Linux); con ingestas en paralelo incluye las otras.
+    rssDeltaMb: float | None = None
+    stageMs: dict[str, float] = field(default_factory=dict)
 
     def to_dict(self) -> dict[str, Any]:
         return asdict(self)
@@ -67,6 +88,28 @@ def _point_id_from_hash(text_hash: str) -> str:
     return str(uuid.uuid5(uuid.NAMESPACE_URL, text_hash))
 
 
+def process_peak_rss_mb() -> float | None:
+    """Pico de memoria residente del proceso (high-water mark); None donde no hay resource (Windows)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reporta KiB; macOS, bytes.
+    divisor = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return round(peak / divisor, 1)
+
+
+def current_rss_mb() -> float | None:
+    """Memoria residente actual del proceso; None fuera de Linux (sin /proc)."""
+    try:
+        with open("/proc/self/statm", encoding="ascii") as handle:
+            resident_pages = int(handle.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return round(resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024), 1)
+
+
 def _estimate_embedding_cost_usd(token_count: int) -> float:
     # text-embedding-3-small ~ $0.02 / 1M tokens
     return round((token_count / 1_000_000) * 0.02, 6)
@@ -101,10 +144,62 @@ def _prepare_docs(options: IngestOptions, chunks: list[Chunk], embeddings: list[
     return docs
 
 
+def _chunk_ref(options: IngestOptions, chunk: Chunk) -> dict[str, Any]:
+    return {
+        "docId": options.doc_id,
+        "docName": options.doc_name,
+        "source": options.source,
+        "version": options.version,
+        "chunkIndex": chunk.chunk_index,
+        "pageStart": chunk.page_start,
+        "pageEnd": chunk.page_end,
+    }
+
+
+def _build_batch(
+    options: IngestOptions,
+    chunks: list[Chunk],
+    embeddings: list[list[float]],
+    sketches: list[ChunkSketch] | None = None,
+) -> models.Batch:
+    ids: list[str] = []
+    payloads: list[dict[str, Any]] = []
+    for position, doc in enumerate(_prepare_docs(options, chunks, embeddings)):
+        ids.append(_point_id_from_hash(str(doc["textHash"])))
+        payloads.append(
+            {
+                "docId": doc["docId"],
+                "docName": doc["docName"],
+                "source": doc["source"],
+                "version": doc["version"],
+                "chunkIndex": doc["chunkIndex"],
+                "pageStart": doc["pageStart"],
+                "pageEnd": doc["pageEnd"],
+                "text": doc["text"],
+                "textHash": doc["textHash"],
+                "updatedAt": doc["updatedAt"].isoformat(),
+                **(sketches[position].payload() if sketches is not None else {}),
+            }
+        )
+    return build_batch(ids, embeddings, payloads)
+
+
 class PDFIngestService:
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        collection_name: str | None = None,
+        client: QdrantClient | None = None,
+        embedder: Callable[..., list[list[float]]] | None = None,
+    ) -> None:
+        """
+        collection_name: coleccion destino; por defecto QDRANT_COLLECTION (una reindexacion usa la nueva).
+        client y embedder reemplazan al cliente Qdrant y a embed_texts (benchmark offline).
+        """
         self.settings = get_settings()
-        self.client = get_qdrant_client()
+        self.client = client or get_qdrant_client()
+        self.embedder = embedder or embed_texts
+        self.collection_name = collection_name or self.settings.qdrant_collection
+        self.pdf_cache = ParsedPdfCache(self.settings.ingest_pdf_cache_dir) if self.settings.ingest_pdf_cache_dir else None
 
     def _count_source_points(self, source: str) -> int:
         total = 0
@@ -114,7 +209,7 @@ class PDFIngestService:
         )
         while True:
             points, next_offset = self.client.scroll(
-                collection_name=self.settings.qdrant_collection,
+                collection_name=self.collection_name,
                 scroll_filter=source_filter,
                 with_payload=False,
                 with_vectors=False,
@@ -126,117 +221,197 @@ class PDFIngestService:
                 return total
             offset = next_offset
 
-    def ingest_pdf(self, options: IngestOptions) -> IngestReport:
-        started = time.perf_counter()
-
-        ensure_rag_collection()
-
-        pages = load_pdf_pages(options.file_path)
-        full_text, page_spans = flatten_pages(pages)
-        chunks = chunk_text(
-            text=full_text,
-            page_spans=page_spans,
+    def _chunk_batches(
+        self,
+        pages: Iterable[PageText],
+        options: IngestOptions,
+        stats: dict[str, int],
+        timings: dict[str, float],
+    ) -> Iterator[list[Chunk]]:
+        """Etapa de chunking: corta las paginas a medida que llegan y estima tokens por batch."""
+
+        def _counted(items: Iterable[PageText]) -> Iterator[PageText]:
+            for page in items:
+                stats["pages"] += 1
+                yield page
+
+        # Lo que tarda la etapa previa en entregar paginas se descuenta del tiempo de chunking.
+        pages_wait: dict[str, float] = {"chunk": 0.0}
+        chunks = iter_page_chunks(
+            timed(_counted(pages), pages_wait, "chunk"),
             chunk_size=options.chunk_size,
             overlap=options.overlap,
             min_chunk_size=options.min_chunk_size,
         )
+        for batch in timed(batched(chunks, options.batch_size), timings, "chunk"):
+            timings["chunk"] -= pages_wait["chunk"]
+            pages_wait["chunk"] = 0.0
+            stats["chunks"] += len(batch)
+            started = time.perf_counter()
+            stats["tokens"] += estimate_tokens([chunk.text for chunk in batch], model=self.settings.embedding_model)
+            timings["tokenize"] += time.perf_counter() - started
+            yield batch
+        timings["chunk"] -= pages_wait["chunk"]
+
+    def _embed_batches(
+        self,
+        batches: Iterable[list[Chunk]],
+        options: IngestOptions,
+        stats: dict[str, int],
+        timings: dict[str, float],
+        dedup: NearDuplicateFilter | None,
+    ) -> Iterator[tuple[int, list[Chunk], list[list[float]], list[ChunkSketch] | None]]:
+        for batch_index, batch in enumerate(batches):
+            # Reanudacion: los batches ya subidos en una corrida previa no se vuelven a embeber.
+            if batch_index < options.resume_from_batch:
+                stats["resumed"] += len(batch)
+                continue
+            sketches: list[ChunkSketch] | None = None
+            if dedup is not None:
+                # Los casi duplicados se descartan antes de embeber: no cuestan tokens ni ocupan puntos.
+                started = time.perf_counter()
+                kept = dedup.filter(
+                    [_point_id_from_hash(_hash_chunk(options.doc_id, chunk)) for chunk in batch],
+                    [chunk.text for chunk in batch],
+                    [_chunk_ref(options, chunk) for chunk in batch],
+                )
+                timings["dedup"] += time.perf_counter() - started
+                batch = [batch[position] for position, _ in kept]
+                sketches = [sketch for _, sketch in kept]
+                if not batch:
+                    continue
+            started = time.perf_counter()
+            embeddings = self.embedder([chunk.text for chunk in batch], batch_size=options.batch_size)
+            timings["embed"] += time.perf_counter() - started
+            yield batch_index, batch, embeddings, sketches
+
+    def _replace_source(self, source: str) -> int:
+        deleted = self._count_source_points(source)
+        source_filter = models.Filter(
+            must=[models.FieldCondition(key="source", match=models.MatchValue(value=source))]
+        )
+        self.client.delete(
+            collection_name=self.collection_name,
+            points_selector=models.FilterSelector(filter=source_filter),
+        )
+        logger.info("ingest_pdf replace_source=true source=%s deleted=%d", source, deleted)
+        return deleted
+
+    def ingest_pdf(
+        self,
+        options: IngestOptions,
+        on_batch: Callable[[int], None] | None = None,
+    ) -> IngestReport:
+        """
+        Ingesta en streaming: extraccion de paginas, chunking, embeddings y upsert corren como
+        etapas solapadas con colas acotadas (RAG_INGEST_QUEUE_SIZE) entre ellas. El documento nunca
+        se materializa completo y el tiempo total tiende al de la etapa mas lenta.
+        Los upserts van como batches columnares con wait=False y varias requests en vuelo
+        (RAG_INGEST_UPSERT_IN_FLIGHT); al final una sola barrera espera a que todo quede aplicado.
+        Con options.dedup, los chunks casi duplicados (MinHash, RAG_INGEST_DEDUP_THRESHOLD) de este
+        documento o de la coleccion (mismo source y version) no se embeben: se registran como
+        referencia en el punto existente.
+        on_batch (opcional) recibe el indice de cada batch apenas Qdrant lo acepta, en orden.
+        """
+        started = time.perf_counter()
+        rss_start_mb = current_rss_mb()
+        queue_size = self.settings.ingest_queue_size
 
-        estimated_tokens = estimate_tokens([chunk.text for chunk in chunks], model=self.settings.embedding_model)
-        estimated_cost = _estimate_embedding_cost_usd(estimated_tokens)
-
+        if self.collection_name == self.settings.qdrant_collection:
+            ensure_rag_collection()
         logger.info(
-            "ingest_pdf start file=%s pages=%d chunks=%d dry_run=%s",
-            options.file_path,
-            len(pages),
-            len(chunks),
-            options.dry_run,
+            "ingest_pdf start file=%s collection=%s dry_run=%s", options.file_path, self.collection_name, options.dry_run
         )
 
-        if options.dry_run:
-            duration_ms = int((time.perf_counter() - started) * 1000)
-            return IngestReport(
-                filePath=options.file_path,
-                docId=options.doc_id,
-                docName=options.doc_name,
-                source=options.source,
-                version=options.version,
-                totalPages=len(pages),
-                totalChunks=len(chunks),
-                inserted=0,
-                updated=0,
-                skipped=len(chunks),
-                estimatedTokens=estimated_tokens,
-                estimatedEmbeddingCostUsd=estimated_cost,
-                durationMs=duration_ms,
-                sourceDocsDeleted=0,
-            )
+        stats = {"pages": 0, "chunks": 0, "tokens": 0, "resumed": 0}
+        # Tiempo ocupado de cada etapa; corren en paralelo, asi que la suma puede superar durationMs.
+        timings = dict.fromkeys(_STAGE_TIMINGS, 0.0)
+        pages = Stage(
+            "extract",
+            timed(
+                iter_pdf_pages(
+                    options.file_path,
+                    header_sample_pages=self.settings.ingest_header_sample_pages,
+                    workers=options.extract_workers,
+                    cache=self.pdf_cache if options.use_pdf_cache else None,
+                ),
+                timings,
+                "extract",
+            ),
+            maxsize=queue_size,
+        )
+        batches = Stage("chunk", self._chunk_batches(pages, options, stats, timings), maxsize=queue_size)
+        stages: list[Stage] = [pages, batches]
 
         inserted = 0
         updated = 0
-        skipped = 0
         source_docs_deleted = 0
-
-        if options.replace_source:
-            source_docs_deleted = self._count_source_points(options.source)
-            source_filter = models.Filter(
-                must=[models.FieldCondition(key="source", match=models.MatchValue(value=options.source))]
-            )
-            self.client.delete(
-                collection_name=self.settings.qdrant_collection,
-                points_selector=models.FilterSelector(filter=source_filter),
-            )
-            logger.info(
-                "ingest_pdf replace_source=true source=%s deleted=%d",
-                options.source,
-                source_docs_deleted,
-            )
-
-        for start_idx in range(0, len(chunks), options.batch_size):
-            batch_chunks = chunks[start_idx: start_idx + options.batch_size]
-            embeddings = embed_texts([chunk.text for chunk in batch_chunks], batch_size=options.batch_size)
-            docs = _prepare_docs(options, batch_chunks, embeddings)
-
-            points: list[models.PointStruct] = []
-            for doc in docs:
-                point_id = _point_id_from_hash(str(doc["textHash"]))
-                points.append(
-                    models.PointStruct(
-                        id=point_id,
-                        vector=doc["embedding"],
-                        payload={
-                            "docId": doc["docId"],
-                            "docName": doc["docName"],
-                            "source": doc["source"],
-                            "version": doc["version"],
-                            "chunkIndex": doc["chunkIndex"],
-                            "pageStart": doc["pageStart"],
-                            "pageEnd": doc["pageEnd"],
-                            "text": doc["text"],
-                            "textHash": doc["textHash"],
-                            "updatedAt": doc["updatedAt"].isoformat() if isinstance(doc["updatedAt"], datetime) else str(doc["updatedAt"]),
-                        },
+        uploader: QdrantBatchUploader | None = None
+        dedup: NearDuplicateFilter | None = None
+        try:
+            if options.dry_run:
+                for _ in batches:
+                    pass
+            else:
+                if options.dedup:
+                    dedup = NearDuplicateFilter(
+                        self.client,
+                        self.collection_name,
+                        threshold=self.settings.ingest_dedup_threshold,
+                        source=options.source,
+                        version=options.version,
+                        exclude_source=options.source if options.replace_source else None,
                     )
+                embedded = Stage("embed", self._embed_batches(batches, options, stats, timings, dedup), maxsize=queue_size)
+                stages.append(embedded)
+                # El borrado corre mientras las etapas anteriores ya extraen y embeben.
+                # Al reanudar no se borra: eliminaria los batches ya subidos.
+                if options.replace_source and options.resume_from_batch == 0:
+                    source_docs_deleted = self._replace_source(options.source)
+
+                uploader = QdrantBatchUploader(
+                    self.client,
+                    self.collection_name,
+                    max_in_flight=self.settings.ingest_upsert_in_flight,
                 )
-
-            self.client.upsert(collection_name=self.settings.qdrant_collection, points=points)
-            inserted += len(points)
+                for batch_index, batch_chunks, embeddings, sketches in embedded:
+                    done = partial(on_batch, batch_index) if on_batch is not None else None
+                    uploader.submit(_build_batch(options, batch_chunks, embeddings, sketches), on_done=done)
+                inserted = uploader.finish()
+                timings["upsert"] = uploader.request_s
+                uploader = None
+                if dedup is not None and dedup.merges:
+                    dedup.apply_merges()
+        finally:
+            if uploader is not None:
+                uploader.close()
+            for stage in reversed(stages):
+                stage.close()
+
+        if inserted or source_docs_deleted or (dedup is not None and dedup.duplicates):
+            invalidate_answer_cache()
 
         duration_ms = int((time.perf_counter() - started) * 1000)
+        rss_end_mb = current_rss_mb()
         report = IngestReport(
             filePath=options.file_path,
             docId=options.doc_id,
             docName=options.doc_name,
             source=options.source,
             version=options.version,
-            totalPages=len(pages),
-            totalChunks=len(chunks),
+            totalPages=stats["pages"],
+            totalChunks=stats["chunks"],
             inserted=inserted,
             updated=updated,
-            skipped=skipped,
-            estimatedTokens=estimated_tokens,
-            estimatedEmbeddingCostUsd=estimated_cost,
+            skipped=stats["chunks"] if options.dry_run else stats["resumed"],
+            estimatedTokens=stats["tokens"],
+            estimatedEmbeddingCostUsd=_estimate_embedding_cost_usd(stats["tokens"]),
             durationMs=duration_ms,
             sourceDocsDeleted=source_docs_deleted,
+            nearDuplicates=dedup.duplicates if dedup is not None else 0,
+            stageMs={stage: round(seconds * 1000, 1) for stage, seconds in timings.items()},
+            processPeakRssMb=process_peak_rss_mb(),
+            rssDeltaMb=round(rss_end_mb - rss_start_mb, 1) if rss_start_mb is not None and rss_end_mb is not None else None,
         )
         logger.info("ingest_pdf end report=%s", json.dumps(report.to_dict(), ensure_ascii=True))
         return report
@@ -252,6 +427,9 @@ def build_ingest_options(
     dry_run: bool,
     version: str | None,
     replace_source: bool,
+    extract_workers: int | None = None,
+    use_pdf_cache: bool = True,
+    dedup: bool | None = None,
 ) -> IngestOptions:
     settings = get_settings()
     path = Path(file_path)
@@ -268,4 +446,7 @@ def build_ingest_options(
         batch_size=batch_size or settings.embedding_batch_size,
         dry_run=dry_run,
         replace_source=replace_source,
+        extract_workers=max(1, extract_workers or settings.ingest_pdf_workers),
+        use_pdf_cache=use_pdf_cache,
+        dedup=settings.ingest_dedup_enabled if dedup is None else dedup,
     )
@@ -0,0 +1,249 @@
+from __future__ import annotations
+
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from functools import lru_cache
+from pathlib import Path
+from typing import Any
+
+from app.core.config import get_settings
+from app.core.logger import get_logger
+
+
+logger = get_logger("ms-ia-orquestacion.ingest.jobs")
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+
+_PROGRESS_FIELDS = ("chunksTotal", "chunksEmbedded", "chunksUpserted", "chunksDeleted")
+
+_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS ingest_jobs (
+        job_id TEXT PRIMARY KEY,
+        status TEXT NOT NULL,
+        source TEXT NOT NULL,
+        title TEXT,
+        payload TEXT,
+        progress TEXT NOT NULL DEFAULT '{}',
+        result TEXT,
+        error TEXT,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        worker_id TEXT,
+        created_at REAL NOT NULL,
+        started_at REAL,
+        heartbeat_at REAL,
+        finished_at REAL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_ingest_jobs_status ON ingest_jobs (status, created_at)",
+)
+
+
+def _iso(epoch: float | None) -> str | None:
+    if epoch is None:
+        return None
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(epoch))
+
+
+class IngestJobStore:
+    """
+    Cola durable de jobs de ingesta en SQLite local.
+    La API encola y consulta; los procesos worker reclaman jobs con una transaccion IMMEDIATE,
+    asi dos workers nunca toman el mismo job.
+    """
+
+    def __init__(self, path: str, stale_after_s: int = 600, max_attempts: int = 3) -> None:
+        self.path = path
+        self.stale_after_s = stale_after_s
+        self.max_attempts = max(1, max_attempts)
+        self._lock = threading.Lock()
+
+        if path != ":memory:":
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10.0)
+        self._conn.row_factory = sqlite3.Row
+        if path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        for statement in _SCHEMA:
+            self._conn.execute(statement)
+
+    def enqueue(
+        self,
+        source: str,
+        text: str,
+        title: str | None = None,
+        metadata: dict[str, Any] | None = None,
+        mode: str = "diff",
+    ) -> dict[str, Any]:
+        job_id = uuid.uuid4().hex
+        payload = json.dumps({"text": text, "metadata": metadata or {}, "mode": mode}, ensure_ascii=False)
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT INTO ingest_jobs (job_id, status, source, title, payload, created_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (job_id, JOB_QUEUED, source, title, payload, time.time()),
+            )
+        logger.info("ingest_job_enqueued job_id=%s source=%s text_len=%d", job_id, source, len(text))
+        return self.get(job_id) or {}
+
+    def get(self, job_id: str) -> dict[str, Any] | None:
+        with self._lock:
+            row = self._conn.execute(
+                """
+                SELECT job_id, status, source, title, progress, result, error, attempts,
+                       created_at, started_at, finished_at
+                FROM ingest_jobs WHERE job_id = ?
+                """,
+                (job_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        progress = json.loads(row["progress"] or "{}")
+        return {
+            "jobId": row["job_id"],
+            "status": row["status"],
+            "source": row["source"],
+            "title": row["title"],
+            "progress": {field: int(progress.get(field, 0)) for field in _PROGRESS_FIELDS},
+            "result": json.loads(row["result"]) if row["result"] else None,
+            "error": row["error"],
+            "attempts": int(row["attempts"]),
+            "createdAt": _iso(row["created_at"]),
+            "startedAt": _iso(row["started_at"]),
+            "finishedAt": _iso(row["finished_at"]),
+        }
+
+    def claim_next(self, worker_id: str) -> dict[str, Any] | None:
+        """
+        Toma el job encolado mas antiguo y lo marca running. Devuelve source/title/text/metadata/mode.
+        Salta los sources con un job running: dos ingestas diff del mismo source en paralelo mezclarian
+        sus chunks, asi que se ejecutan en orden de llegada.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._requeue_stale(now)
+                row = self._conn.execute(
+                    """
+                    SELECT job_id, source, title, payload FROM ingest_jobs
+                    WHERE status = ?
+                      AND source NOT IN (SELECT source FROM ingest_jobs WHERE status = ?)
+                    ORDER BY created_at ASC, rowid ASC LIMIT 1
+                    """,
+                    (JOB_QUEUED, JOB_RUNNING),
+                ).fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        """
+                        UPDATE ingest_jobs
+                        SET status = ?, worker_id = ?, attempts = attempts + 1,
+                            started_at = ?, heartbeat_at = ?, error = NULL
+                        WHERE job_id = ?
+                        """,
+                        (JOB_RUNNING, worker_id, now, now, row["job_id"]),
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        payload = json.loads(row["payload"] or "{}")
+        return {
+            "jobId": row["job_id"],
+            "source": row["source"],
+            "title": row["title"],
+            "text": str(payload.get("text") or ""),
+            "metadata": dict(payload.get("metadata") or {}),
+            "mode": str(payload.get("mode") or "diff"),
+        }
+
+    def _requeue_stale(self, now: float) -> None:
+        # Jobs running sin heartbeat reciente: el worker murio. Se reintentan hasta max_attempts.
+        cutoff = now - self.stale_after_s
+        self._conn.execute(
+            """
+            UPDATE ingest_jobs SET status = ?, finished_at = ?, error = 'worker perdido: reintentos agotados'
+            WHERE status = ? AND heartbeat_at < ? AND attempts >= ?
+            """,
+            (JOB_FAILED, now, JOB_RUNNING, cutoff, self.max_attempts),
+        )
+        requeued = self._conn.execute(
+            "UPDATE ingest_jobs SET status = ?, worker_id = NULL WHERE status = ? AND heartbeat_at < ?",
+            (JOB_QUEUED, JOB_RUNNING, cutoff),
+        ).rowcount
+        if requeued:
+            logger.warning("ingest_jobs_requeued_stale count=%d", requeued)
+
+    def update_progress(self, job_id: str, progress: dict[str, int]) -> None:
+        clean = {field: int(progress.get(field, 0)) for field in _PROGRESS_FIELDS}
+        with self._lock:
+            self._conn.execute(
+                "UPDATE ingest_jobs SET progress = ?, heartbeat_at = ? WHERE job_id = ?",
+                (json.dumps(clean), time.time(), job_id),
+            )
+
+    def complete(self, job_id: str, result: dict[str, Any]) -> None:
+        # El texto ya esta en Qdrant: se descarta del payload para que la cola no crezca.
+        with self._lock:
+            self._conn.execute(
+                """
+                UPDATE ingest_jobs SET status = ?, result = ?, payload = NULL, finished_at = ?
+                WHERE job_id = ?
+                """,
+                (JOB_SUCCEEDED, json.dumps(result, ensure_ascii=False, default=str), time.time(), job_id),
+            )
+
+    def heartbeat(self, job_id: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "UPDATE ingest_jobs SET heartbeat_at = ? WHERE job_id = ? AND status = ?",
+                (time.time(), job_id, JOB_RUNNING),
+            )
+
+    def fail(self, job_id: str, error: str) -> bool:
+        """
+        Registra el error de un intento. Como con un worker perdido, el job vuelve a la cola hasta
+        max_attempts; despues queda failed. Devuelve True si se reencolo.
+        """
+        with self._lock:
+            requeued = self._conn.execute(
+                """
+                UPDATE ingest_jobs SET status = ?, worker_id = NULL, error = ?
+                WHERE job_id = ? AND attempts < ?
+                """,
+                (JOB_QUEUED, error[:2000], job_id, self.max_attempts),
+            ).rowcount
+            if not requeued:
+                self._conn.execute(
+                    "UPDATE ingest_jobs SET status = ?, error = ?, finished_at = ? WHERE job_id = ?",
+                    (JOB_FAILED, error[:2000], time.time(), job_id),
+                )
+        return bool(requeued)
+
+    def counts(self) -> dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM ingest_jobs GROUP BY status").fetchall()
+        return {str(row[0]): int(row[1]) for row in rows}
+
+
+@lru_cache(maxsize=1)
+def get_ingest_job_store() -> IngestJobStore:
+    settings = get_settings()
+    store = IngestJobStore(
+        path=settings.rag_ingest_jobs_path,
+        stale_after_s=settings.rag_ingest_job_stale_s,
+        max_attempts=settings.rag_ingest_max_attempts,
+    )
+    logger.info("ingest_job_store_ready path=%s", store.path)
+    return store
@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any
+
+
+FILE_RUNNING = "running"
+FILE_DONE = "done"
+FILE_FAILED = "failed"
+
+_MANIFEST_VERSION = 1
+_HASH_BLOCK_BYTES = 1024 * 1024
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as handle:
+        for block in iter(lambda: handle.read(_HASH_BLOCK_BYTES), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _now_iso() -> str:
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+
+
+class IngestManifest:
+    """
+    Estado por archivo de una ingesta masiva, persistido en JSON.
+    Cada entrada guarda hash del contenido, parametros de chunking, estado y el ultimo batch subido;
+    una corrida interrumpida se reanuda desde ahi. Se reescribe completo (tmp + rename) en cada cambio.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._files: dict[str, dict[str, Any]] = {}
+        manifest_path = Path(path)
+        if manifest_path.exists():
+            data = json.loads(manifest_path.read_text(encoding="utf-8") or "{}")
+            self._files = dict(data.get("files") or {})
+        manifest_path.parent.mkdir(parents=True, exist_ok=True)
+
+    def resume_point(self, file_path: str, sha256: str, options_key: str) -> int | None:
+        """
+        None si el archivo ya quedo completo con el mismo contenido y parametros; si no, el
+        primer batch a subir (0 cuando cambio el archivo, los parametros o no hay registro).
+        """
+        with self._lock:
+            entry = self._files.get(file_path)
+        if entry is None or entry.get("sha256") != sha256 or entry.get("optionsKey") != options_key:
+            return 0
+        if entry.get("status") == FILE_DONE:
+            return None
+        return int(entry.get("lastBatch", -1)) + 1
+
+    def start(self, file_path: str, sha256: str, options_key: str, resume_from_batch: int) -> None:
+        with self._lock:
+            previous = self._files.get(file_path) or {}
+            self._files[file_path] = {
+                "sha256": sha256,
+                "optionsKey": options_key,
+                "status": FILE_RUNNING,
+                "lastBatch": resume_from_batch - 1,
+                "attempts": int(previous.get("attempts", 0)) + 1,
+                "error": None,
+                "report": None,
+                "updatedAt": _now_iso(),
+            }
+            self._flush()
+
+    def batch_done(self, file_path: str, batch_index: int) -> None:
+        with self._lock:
+            entry = self._files[file_path]
+            entry["lastBatch"] = max(int(entry.get("lastBatch", -1)), batch_index)
+            entry["updatedAt"] = _now_iso()
+            self._flush()
+
+    def finish(self, file_path: str, report: dict[str, Any]) -> None:
+        with self._lock:
+            entry = self._files[file_path]
+            entry.update({"status": FILE_DONE, "report": report, "updatedAt": _now_iso()})
+            self._flush()
+
+    def fail(self, file_path: str, error: str) -> None:
+        # Puede fallar antes de start() (p.ej. el hash de un archivo ilegible): la entrada se crea aca.
+        with self._lock:
+            entry = self._files.setdefault(file_path, {"attempts": 0})
+            entry.update({"status": FILE_FAILED, "error": error[:2000], "updatedAt": _now_iso()})
+            self._flush()
+
+    def entry(self, file_path: str) -> dict[str, Any] | None:
+        with self._lock:
+            entry = self._files.get(file_path)
+            return dict(entry) if entry is not None else None
+
+    def _flush(self) -> None:
+        payload = json.dumps({"version": _MANIFEST_VERSION, "files": self._files}, ensure_ascii=False, indent=2)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as handle:
+            handle.write(payload)
+        os.replace(tmp_path, self.path)
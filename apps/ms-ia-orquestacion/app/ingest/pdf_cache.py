@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+import gzip
+import json
+import os
+import uuid
+from pathlib import Path
+from typing import Iterator
+
+import pypdf
+
+from app.core.logger import get_logger
+from app.ingest.manifest import file_sha256
+
+
+logger = get_logger("ms-ia-orquestacion.ingest.pdf_cache")
+
+# Subir _CLEANER_VERSION cuando cambie _clean_page_text: invalida los artefactos previos.
+_CLEANER_VERSION = 1
+EXTRACTOR_VERSION = f"pypdf-{pypdf.__version__}-clean{_CLEANER_VERSION}"
+
+
+class ParsedPdfCache:
+    """
+    Texto limpio por pagina (antes de quitar headers/footers) de cada PDF ya extraido, en disco.
+    La llave es el sha256 del archivo mas EXTRACTOR_VERSION; el artefacto es JSONL comprimido con
+    gzip: una linea de cabecera y luego el texto de cada pagina, en orden, como string JSON.
+    """
+
+    def __init__(self, directory: str) -> None:
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def key_for(self, file_path: str) -> str:
+        return f"{file_sha256(file_path)}-{EXTRACTOR_VERSION}"
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.jsonl.gz"
+
+    def page_count(self, key: str) -> int | None:
+        """Cantidad de paginas del artefacto, o None si no existe o esta corrupto."""
+        path = self._path(key)
+        if not path.exists():
+            return None
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as handle:
+                header = json.loads(handle.readline() or "{}")
+        except (OSError, ValueError) as exc:
+            logger.warning("pdf_cache_unreadable path=%s reason=%s", path, exc)
+            return None
+        if header.get("extractor") != EXTRACTOR_VERSION:
+            return None
+        return int(header.get("pages", 0))
+
+    def iter_pages(self, key: str) -> Iterator[str]:
+        with gzip.open(self._path(key), "rt", encoding="utf-8") as handle:
+            handle.readline()
+            for line in handle:
+                yield json.loads(line)
+
+    def writer(self, key: str, total_pages: int) -> "ParsedPdfWriter":
+        return ParsedPdfWriter(self._path(key), total_pages)
+
+
+class ParsedPdfWriter:
+    """Escribe el artefacto en un archivo temporal; solo commit() lo publica (extraccion completa)."""
+
+    def __init__(self, path: Path, total_pages: int) -> None:
+        self.path = path
+        self.total_pages = total_pages
+        self.written = 0
+        self._tmp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+        self._handle = gzip.open(self._tmp_path, "wt", encoding="utf-8", compresslevel=6)
+        self._handle.write(json.dumps({"extractor": EXTRACTOR_VERSION, "pages": total_pages}) + "\n")
+
+    def write(self, text: str) -> None:
+        self._handle.write(json.dumps(text, ensure_ascii=False) + "\n")
+        self.written += 1
+
+    def commit(self) -> None:
+        self._handle.close()
+        if self.written != self.total_pages:
+            self.discard()
+            return
+        os.replace(self._tmp_path, self.path)
+        logger.info("pdf_cache_stored path=%s pages=%d", self.path, self.written)
+
+    def discard(self) -> None:
+        self._handle.close()
+        self._tmp_path.unlink(missing_ok=True)
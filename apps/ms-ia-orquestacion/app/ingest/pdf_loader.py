@@ -1,11 +1,21 @@
 from __future__ import annotations
 
-from collections import Counter
+import math
+import multiprocessing
+import sys
+from collections import Counter, deque
+from concurrent.futures import Future, ProcessPoolExecutor
 from dataclasses import dataclass
 from pathlib import Path
+from typing import Iterator
 
 from pypdf import PdfReader
 
+from app.ingest.pdf_cache import ParsedPdfCache
+
+
+_MAX_SHARD_PAGES = 32
+
 
 @dataclass(frozen=True)
 class PageText:
@@ -26,42 +36,176 @@ def _clean_page_text(text: str) -> str:
     return "\n".join(cleaned_lines)
 
 
-def load_pdf_pages(file_path: str) -> list[PageText]:
+def _extract_page(reader: PdfReader, idx: int) -> str:
+    return _clean_page_text(reader.pages[idx].extract_text() or "")
+
+
+def _edge_lines(text: str) -> list[str]:
+    lines = [line for line in text.split("\n") if line]
+    return [_normalize_line_for_repetition(line) for line in lines[:2] + lines[-2:]]
+
+
+def _sample_indexes(total: int, sample_size: int) -> list[int]:
+    if total <= sample_size:
+        return list(range(total))
+    step = total / sample_size
+    return sorted({int(i * step) for i in range(sample_size)})
+
+
+def _detect_repeated_edge_lines(sampled_texts: list[str]) -> set[str]:
+    """
+    Lineas de borde (2 primeras y 2 ultimas) repetidas en al menos un tercio de las paginas muestreadas.
+    Con todas las paginas en la muestra equivale a la deteccion sobre el documento completo.
+    """
+    repeated = Counter(line for text in sampled_texts if text for line in _edge_lines(text))
+    threshold = max(3, len(sampled_texts) // 3)
+    return {line for line, count in repeated.items() if count >= threshold and len(line) > 3}
+
+
+def _strip_repeated_lines(text: str, repeated_headers: set[str]) -> str:
+    lines = [line for line in text.split("\n") if line]
+    filtered = [line for line in lines if _normalize_line_for_repetition(line) not in repeated_headers]
+    return "\n".join(filtered).strip()
+
+
+def _extract_pages(file_path: str, indexes: list[int]) -> list[str]:
+    """Tarea de un proceso del pool: abre el PDF y extrae las paginas pedidas, en orden."""
+    reader = PdfReader(file_path)
+    return [_extract_page(reader, idx) for idx in indexes]
+
+
+def _shard(indexes: list[int], shard_pages: int) -> list[list[int]]:
+    return [indexes[pos: pos + shard_pages] for pos in range(0, len(indexes), shard_pages)]
+
+
+def _shard_size(total: int, workers: int) -> int:
+    # Varios shards por worker para repartir paginas de costo desigual, sin pasar de _MAX_SHARD_PAGES.
+    return max(1, min(_MAX_SHARD_PAGES, math.ceil(total / (workers * 4))))
+
+
+def _iter_extracted(
+    file_path: str,
+    indexes: list[int],
+    reader: PdfReader,
+    pool: ProcessPoolExecutor | None,
+    workers: int,
+) -> Iterator[tuple[int, str]]:
+    """
+    (indice, texto limpio) en orden de pagina. Con pool, las paginas se reparten en shards contiguos
+    y se reensamblan en orden; a lo sumo workers * 2 shards quedan en vuelo para acotar la memoria.
+    """
+    if pool is None:
+        for idx in indexes:
+            yield idx, _extract_page(reader, idx)
+        return
+
+    shards = iter(_shard(indexes, _shard_size(len(indexes), workers)))
+    pending: deque[tuple[list[int], Future[list[str]]]] = deque()
+
+    def _submit() -> None:
+        shard = next(shards, None)
+        if shard is not None:
+            pending.append((shard, pool.submit(_extract_pages, file_path, shard)))
+
+    for _ in range(workers * 2):
+        _submit()
+    while pending:
+        shard, future = pending.popleft()
+        texts = future.result()
+        _submit()
+        yield from zip(shard, texts)
+
+
+def _final_page(idx: int, cleaned: str, repeated_headers: set[str]) -> PageText | None:
+    if not cleaned:
+        return None
+    final_text = _strip_repeated_lines(cleaned, repeated_headers)
+    return PageText(page=idx + 1, text=final_text) if final_text else None
+
+
+def _iter_cached_pages(cache: ParsedPdfCache, key: str, total: int, header_sample_pages: int) -> Iterator[PageText]:
+    # Dos pasadas sobre el artefacto: la muestra para headers y luego las paginas en streaming.
+    sample = set(_sample_indexes(total, header_sample_pages))
+    repeated_headers = _detect_repeated_edge_lines(
+        [text for idx, text in enumerate(cache.iter_pages(key)) if idx in sample]
+    )
+    for idx, cleaned in enumerate(cache.iter_pages(key)):
+        page = _final_page(idx, cleaned, repeated_headers)
+        if page is not None:
+            yield page
+
+
+def iter_pdf_pages(
+    file_path: str,
+    header_sample_pages: int = 24,
+    workers: int = 1,
+    cache: ParsedPdfCache | None = None,
+) -> Iterator[PageText]:
+    """
+    Extrae las paginas una a una, sin retener el documento completo.
+    Headers/footers se detectan antes con una muestra de hasta header_sample_pages paginas
+    repartidas en el documento; las paginas muestreadas no se extraen dos veces.
+    Con workers > 1 la extraccion (CPU) corre en un pool de procesos por rangos de paginas;
+    el resultado es el mismo que con un solo proceso.
+    Con cache, un PDF ya extraido (mismo contenido y version de extractor) se lee del artefacto
+    sin pasar por pypdf; si no esta, el texto limpio se guarda mientras se extrae.
+    """
     pdf_path = Path(file_path)
     if not pdf_path.exists():
         raise FileNotFoundError(f"PDF no encontrado: {pdf_path}")
 
+    cache_key = ""
+    if cache is not None:
+        cache_key = cache.key_for(str(pdf_path))
+        cached_total = cache.page_count(cache_key)
+        if cached_total is not None:
+            yield from _iter_cached_pages(cache, cache_key, cached_total, header_sample_pages)
+            return
+
     reader = PdfReader(str(pdf_path))
-    raw_pages: list[PageText] = []
-    edge_lines: list[str] = []
-
-    for idx, page in enumerate(reader.pages, start=1):
-        extracted = page.extract_text() or ""
-        cleaned = _clean_page_text(extracted)
-        raw_pages.append(PageText(page=idx, text=cleaned))
-
-        if not cleaned:
-            continue
-
-        lines = [line for line in cleaned.split("\n") if line]
-        edge_lines.extend(_normalize_line_for_repetition(line) for line in lines[:2])
-        edge_lines.extend(_normalize_line_for_repetition(line) for line in lines[-2:])
-
-    repeated = Counter(edge_lines)
-    threshold = max(3, len(raw_pages) // 3)
-    repeated_headers = {line for line, count in repeated.items() if count >= threshold and len(line) > 3}
-
-    final_pages: list[PageText] = []
-    for page in raw_pages:
-        if not page.text:
-            continue
-        lines = [line for line in page.text.split("\n") if line]
-        filtered = [line for line in lines if _normalize_line_for_repetition(line) not in repeated_headers]
-        final_text = "\n".join(filtered).strip()
-        if final_text:
-            final_pages.append(PageText(page=page.page, text=final_text))
-
-    return final_pages
+    total = len(reader.pages)
+    pool = None
+    if workers > 1 and total > 1:
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    writer = cache.writer(cache_key, total) if cache is not None else None
+
+    try:
+        sample = _sample_indexes(total, header_sample_pages)
+        sampled = dict(_iter_extracted(str(pdf_path), sample, reader, pool, workers))
+        repeated_headers = _detect_repeated_edge_lines(list(sampled.values()))
+
+        remaining = [idx for idx in range(total) if idx not in sampled]
+        extracted = _iter_extracted(str(pdf_path), remaining, reader, pool, workers)
+        for idx in range(total):
+            if idx in sampled:
+                cleaned = sampled.pop(idx)
+            else:
+                _, cleaned = next(extracted)
+            if writer is not None:
+                writer.write(cleaned)
+            page = _final_page(idx, cleaned, repeated_headers)
+            if page is not None:
+                yield page
+        if writer is not None:
+            writer.commit()
+            writer = None
+    finally:
+        if writer is not None:
+            writer.discard()
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+
+def load_pdf_pages(
+    file_path: str,
+    header_sample_pages: int | None = None,
+    workers: int = 1,
+    cache: ParsedPdfCache | None = None,
+) -> list[PageText]:
+    """Todas las paginas en memoria. Sin header_sample_pages la deteccion de headers usa el documento completo."""
+    return list(
+        iter_pdf_pages(file_path, header_sample_pages=header_sample_pages or sys.maxsize, workers=workers, cache=cache)
+    )
 
 
 def flatten_pages(pages: list[PageText]) -> tuple[str, list[tuple[int, int, int]]]:
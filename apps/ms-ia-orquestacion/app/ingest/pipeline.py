@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+import queue
+import threading
+import time
+from dataclasses import dataclass
+from typing import Generic, Iterable, Iterator, TypeVar
+
+from app.core.logger import get_logger
+
+
+logger = get_logger("ms-ia-orquestacion.ingest.pipeline")
+
+T = TypeVar("T")
+
+_DONE = object()
+_POLL_SECONDS = 0.1
+
+
+@dataclass(frozen=True)
+class _Failure:
+    error: BaseException
+
+
+class Stage(Generic[T]):
+    """
+    Etapa de un pipeline de ingesta: consume items en un thread propio y los entrega por una cola
+    acotada (maxsize). La cola llena frena a la etapa anterior, asi la memoria queda limitada a
+    unos pocos items por etapa mientras todas trabajan en paralelo.
+    Un error de la etapa se relanza en quien itera; close() detiene la etapa y libera a quien la espera.
+    """
+
+    def __init__(self, name: str, items: Iterable[T], maxsize: int) -> None:
+        self.name = name
+        self.produced = 0
+        self._queue: queue.Queue = queue.Queue(maxsize=max(1, maxsize))
+        self._stop = threading.Event()
+        self._finished = False
+        self._thread = threading.Thread(target=self._run, args=(items,), name=f"ingest-{name}", daemon=True)
+        self._thread.start()
+
+    def _run(self, items: Iterable[T]) -> None:
+        try:
+            for item in items:
+                if not self._put(item):
+                    return
+                self.produced += 1
+            self._put(_DONE)
+        except BaseException as exc:
+            self._put(_Failure(exc))
+        finally:
+            # El iterable de entrada se cierra en el mismo thread que lo consume (generadores, etapas previas).
+            close = getattr(items, "close", None)
+            if close is not None:
+                close()
+
+    def _put(self, item: object) -> bool:
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=_POLL_SECONDS)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def __iter__(self) -> Iterator[T]:
+        return self
+
+    def __next__(self) -> T:
+        if self._finished:
+            raise StopIteration
+        while True:
+            try:
+                item = self._queue.get(timeout=_POLL_SECONDS)
+                break
+            except queue.Empty:
+                if self._stop.is_set():
+                    # Etapa cerrada: quien quedo esperando (la etapa siguiente) termina tambien.
+                    self._finished = True
+                    raise StopIteration from None
+        if item is _DONE:
+            self._finished = True
+            raise StopIteration
+        if isinstance(item, _Failure):
+            self._finished = True
+            logger.warning("ingest_stage_failed stage=%s error=%s", self.name, item.error)
+            raise item.error
+        return item
+
+    def close(self) -> None:
+        self._stop.set()
+        self._finished = True
+
+
+def batched(items: Iterable[T], size: int) -> Iterator[list[T]]:
+    batch: list[T] = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def timed(items: Iterable[T], timings: dict[str, float], key: str) -> Iterator[T]:
+    """Suma en timings[key] el tiempo que items tarda en producir cada elemento (sin contar al consumidor)."""
+    iterator = iter(items)
+    try:
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                timings[key] += time.perf_counter() - started
+            yield item
+    finally:
+        # Igual que Stage: cerrar el envoltorio cierra el iterable de adentro (pool de extraccion).
+        close = getattr(iterator, "close", None)
+        if close is not None:
+            close()
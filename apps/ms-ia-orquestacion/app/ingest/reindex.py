@@ -0,0 +1,211 @@
+from __future__ import annotations
+
+import json
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Any, Callable
+
+from qdrant_client import models
+
+from app.ai.embeddings import embed_texts
+from app.core.config import get_settings
+from app.core.logger import get_logger
+from app.db.qdrant import (
+    collection_dim,
+    create_rag_collection,
+    get_qdrant_client,
+    resolve_alias,
+    switch_alias,
+    versioned_collection_name,
+)
+from app.ingest.bulk import ingest_many
+from app.ingest.ingest_service import IngestOptions, PDFIngestService
+from app.ingest.upload import QdrantBatchUploader, build_batch
+from app.rag.answer_cache import invalidate_answer_cache
+
+
+logger = get_logger("ms-ia-orquestacion.ingest.reindex")
+
+_READY_POLL_SECONDS = 1.0
+_CARRY_OVER_BATCH = 256
+# Un punto recuperado por su propio vector tiene similitud coseno 1 (salvo redondeo float32).
+_SELF_MATCH_SCORE = 0.999
+_SMOKE_PROBE_LIMIT = 10
+
+
+@dataclass
+class ReindexReport:
+    alias: str
+    collection: str
+    previousCollection: str | None
+    previousDeleted: bool
+    pointsCount: int
+    smoke: dict[str, Any]
+    durationMs: int
+    carriedOver: int = 0
+    ingest: dict[str, Any] = field(default_factory=dict)
+
+    def to_dict(self) -> dict[str, Any]:
+        return asdict(self)
+
+
+def _wait_until_green(collection_name: str, timeout_s: float) -> None:
+    # Con el optimizador aun indexando, las busquedas recorren segmentos sin HNSW: no se cambia el alias hasta green.
+    client = get_qdrant_client()
+    deadline = time.monotonic() + timeout_s
+    while True:
+        status = client.get_collection(collection_name).status
+        if status == models.CollectionStatus.GREEN:
+            return
+        if time.monotonic() >= deadline:
+            raise RuntimeError(f"La coleccion {collection_name} no quedo green en {timeout_s:.0f}s (status={status})")
+        time.sleep(_READY_POLL_SECONDS)
+
+
+def _smoke_check(collection_name: str, smoke_query: str | None) -> dict[str, Any]:
+    """
+    Verifica la coleccion nueva antes de exponerla: tiene puntos, un punto se recupera a si mismo
+    por su vector y, si hay smoke_query, la consulta devuelve resultados. Chunks con el mismo texto en
+    otro documento tienen el mismo vector con otro id: basta con que el probe este entre los primeros
+    hits o que el primero tenga similitud ~1.
+    """
+    settings = get_settings()
+    client = get_qdrant_client()
+    count = client.count(collection_name=collection_name, exact=True).count
+    if count == 0:
+        raise RuntimeError(f"La coleccion {collection_name} quedo vacia")
+
+    probe, _ = client.scroll(collection_name=collection_name, limit=1, with_payload=False, with_vectors=True)
+    hits = client.query_points(collection_name=collection_name, query=probe[0].vector, limit=_SMOKE_PROBE_LIMIT).points
+    probe_found = any(str(hit.id) == str(probe[0].id) for hit in hits)
+    if not hits or not (probe_found or hits[0].score >= _SELF_MATCH_SCORE):
+        raise RuntimeError(f"Smoke check fallido en {collection_name}: el punto {probe[0].id} no se recupera por su vector")
+
+    result: dict[str, Any] = {"count": count, "probeId": str(probe[0].id), "query": smoke_query, "queryHits": None}
+    if smoke_query:
+        vector = embed_texts([smoke_query])[0]
+        query_hits = client.query_points(collection_name=collection_name, query=vector, limit=settings.rag_final_k).points
+        if not query_hits:
+            raise RuntimeError(f"Smoke check fallido en {collection_name}: la consulta no devolvio resultados")
+        result["queryHits"] = len(query_hits)
+        result["topScore"] = round(float(query_hits[0].score), 4)
+    return result
+
+
+def _carry_over_text_points(previous: str, target: str) -> int:
+    """
+    Copia a la coleccion nueva los puntos de /rag-ingest (sin docId: no vienen de un PDF y la
+    reindexacion no los reconstruye). Con la misma dimension se copian los vectores; si cambio
+    RAG_EMBED_DIM se re-embebe chunkText. Devuelve la cantidad de puntos copiados.
+    """
+    settings = get_settings()
+    client = get_qdrant_client()
+    reuse_vectors = collection_dim(client, previous) == settings.embedding_dimensions
+    text_filter = models.Filter(must=[models.IsEmptyCondition(is_empty=models.PayloadField(key="docId"))])
+    uploader = QdrantBatchUploader(client, target, max_in_flight=settings.ingest_upsert_in_flight)
+    offset: str | int | None = None
+    try:
+        while True:
+            points, offset = client.scroll(
+                collection_name=previous,
+                scroll_filter=text_filter,
+                with_payload=True,
+                with_vectors=reuse_vectors,
+                limit=_CARRY_OVER_BATCH,
+                offset=offset,
+            )
+            if points:
+                payloads = [dict(point.payload or {}) for point in points]
+                if reuse_vectors:
+                    vectors = [list(point.vector) for point in points]
+                else:
+                    vectors = embed_texts([str(payload.get("chunkText") or "") for payload in payloads])
+                uploader.submit(build_batch([point.id for point in points], vectors, payloads))
+            if offset is None:
+                break
+        copied = uploader.finish()
+    finally:
+        uploader.close()
+    logger.info(
+        "reindex_carry_over previous=%s collection=%s points=%d reembedded=%s", previous, target, copied, not reuse_vectors
+    )
+    return copied
+
+
+def reindex_collection(
+    files: list[str],
+    make_options: Callable[[str], IngestOptions],
+    concurrency: int = 2,
+    smoke_query: str | None = None,
+    keep_previous: bool = False,
+    ready_timeout_s: float = 600.0,
+) -> ReindexReport:
+    """
+    Reindexacion blue/green: ingesta los PDFs en una coleccion versionada nueva mientras las busquedas
+    siguen sobre la actual, la verifica (green + smoke check) y recien entonces cambia el alias
+    QDRANT_COLLECTION de forma atomica. Los puntos de /rag-ingest (sources de texto, sin PDF) se
+    copian de la coleccion previa antes del cambio; la previa se borra salvo keep_previous.
+    Si algo falla antes del cambio (incluido un solo PDF), la coleccion nueva se borra y el alias queda
+    como estaba.
+    Lo que /rag-ingest escriba en el alias despues de esa copia no pasa a la coleccion nueva.
+    """
+    started = time.perf_counter()
+    settings = get_settings()
+    client = get_qdrant_client()
+    alias = settings.qdrant_collection
+    target = versioned_collection_name(alias)
+
+    current = resolve_alias(client, alias)
+    if current is None and any(item.name == alias for item in client.get_collections().collections):
+        current = alias
+
+    create_rag_collection(client, target)
+    logger.info("reindex_start alias=%s collection=%s files=%d", alias, target, len(files))
+    try:
+        bulk_report = ingest_many(
+            files,
+            make_options=make_options,
+            manifest=None,
+            concurrency=concurrency,
+            service=PDFIngestService(collection_name=target),
+        )
+        if bulk_report.failed:
+            # Cambiar el alias dejaria fuera de la busqueda a los documentos que fallaron.
+            failed_files = [result["filePath"] for result in bulk_report.results if result["status"] == "failed"]
+            raise RuntimeError(f"Reindexacion abortada: {bulk_report.failed} PDF(s) fallaron: {failed_files}")
+        carried_over = _carry_over_text_points(current, target) if current is not None else 0
+        _wait_until_green(target, ready_timeout_s)
+        smoke = _smoke_check(target, smoke_query)
+    except BaseException:
+        logger.exception("reindex_failed alias=%s collection=%s dropping=true", alias, target)
+        client.delete_collection(target)
+        raise
+
+    previous_deleted = False
+    if current == alias:
+        # Migracion desde una coleccion real con el nombre del alias: hay que borrarla para crear el alias
+        # (unico caso sin cambio atomico).
+        logger.warning("reindex_migrating_to_alias collection=%s", alias)
+        client.delete_collection(alias)
+        previous_deleted = True
+    previous = switch_alias(client, alias, target) or (alias if previous_deleted else None)
+    invalidate_answer_cache()
+
+    if previous is not None and not previous_deleted and not keep_previous:
+        client.delete_collection(previous)
+        previous_deleted = True
+        logger.info("reindex_previous_deleted collection=%s", previous)
+
+    report = ReindexReport(
+        alias=alias,
+        collection=target,
+        previousCollection=previous,
+        previousDeleted=previous_deleted,
+        pointsCount=int(smoke["count"]),
+        smoke=smoke,
+        durationMs=int((time.perf_counter() - started) * 1000),
+        carriedOver=carried_over,
+        ingest={key: value for key, value in bulk_report.to_dict().items() if key != "results"},
+    )
+    logger.info("reindex_done report=%s", json.dumps({k: v for k, v in report.to_dict().items() if k != "ingest"}))
+    return report
@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable
+
+from qdrant_client import QdrantClient, models
+
+from app.core.logger import get_logger
+
+
+logger = get_logger("ms-ia-orquestacion.ingest.upload")
+
+
+def build_batch(ids: list[str], vectors: list[list[float]], payloads: list[dict[str, Any]]) -> models.Batch:
+    """Batch columnar: un solo modelo con listas paralelas, en vez de un PointStruct por punto."""
+    return models.Batch(ids=list(ids), vectors=vectors, payloads=payloads)
+
+
+def _is_single_shard(client: QdrantClient, collection_name: str) -> bool:
+    # El modo local (":memory:"/path) no tiene shards y reporta shard_number=None.
+    try:
+        shard_number = client.get_collection(collection_name).config.params.shard_number
+    except Exception as exc:
+        logger.warning("qdrant_shard_number_unavailable collection=%s error=%s", collection_name, exc)
+        return False
+    return shard_number is None or shard_number <= 1
+
+
+class QdrantBatchUploader:
+    """
+    Upserts de Qdrant con hasta max_in_flight requests en vuelo y wait=False: cada request vuelve
+    cuando Qdrant la acepta en su WAL, sin esperar a que se aplique, y el siguiente batch no espera
+    el round-trip del anterior.
+
+    finish() es la barrera de consistencia: espera el acuse de todos los batches y recien entonces
+    envia el ultimo (retenido hasta ese momento) con wait=True. Qdrant aplica las operaciones de cada
+    shard en orden, asi que con un solo shard cuando esa request vuelve los batches previos ya son
+    visibles. Con varios shards (o si no se puede leer shard_number) ese orden no cubre a los demas:
+    todos los batches van con wait=True y finish() solo espera el acuse de cada uno.
+    on_done de cada batch se llama en orden de envio, cuando Qdrant lo acepto.
+    """
+
+    def __init__(
+        self,
+        client: QdrantClient,
+        collection_name: str,
+        max_in_flight: int = 4,
+        single_shard: bool | None = None,
+    ) -> None:
+        self.client = client
+        self.collection_name = collection_name
+        self.max_in_flight = max(1, max_in_flight)
+        self.single_shard = _is_single_shard(client, collection_name) if single_shard is None else single_shard
+        self._wait_each = not self.single_shard
+        self.points_sent = 0
+        # Suma de la duracion de cada request (en paralelo puede superar el tiempo de pared).
+        self.request_s = 0.0
+        self._timing_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix="qdrant-upsert")
+        self._in_flight: deque[tuple[Future, int, Callable[[], None] | None]] = deque()
+        self._held: tuple[models.Batch, Callable[[], None] | None] | None = None
+
+    def _upsert(self, batch: models.Batch, wait: bool) -> None:
+        started = time.perf_counter()
+        self.client.upsert(collection_name=self.collection_name, points=batch, wait=wait)
+        with self._timing_lock:
+            self.request_s += time.perf_counter() - started
+
+    def _complete_oldest(self) -> None:
+        future, count, on_done = self._in_flight.popleft()
+        future.result()
+        self.points_sent += count
+        if on_done is not None:
+            on_done()
+
+    def submit(self, batch: models.Batch, on_done: Callable[[], None] | None = None) -> None:
+        """Encola un batch. Bloquea solo si ya hay max_in_flight requests sin acuse."""
+        if self._held is not None:
+            held, held_done = self._held
+            while self._in_flight and (len(self._in_flight) >= self.max_in_flight or self._in_flight[0][0].done()):
+                self._complete_oldest()
+            self._in_flight.append(
+                (self._executor.submit(self._upsert, held, self._wait_each), len(held.ids), held_done)
+            )
+        self._held = (batch, on_done)
+
+    def finish(self) -> int:
+        """Barrera: todos los batches enviados quedan aplicados. Devuelve la cantidad de puntos."""
+        while self._in_flight:
+            self._complete_oldest()
+        if self._held is not None:
+            batch, on_done = self._held
+            self._held = None
+            self._upsert(batch, wait=True)
+            self.points_sent += len(batch.ids)
+            if on_done is not None:
+                on_done()
+        self._executor.shutdown(wait=True)
+        return self.points_sent
+
+    def close(self) -> None:
+        """
+        Cierra sin barrera (camino de error): descarta el batch retenido y espera lo ya enviado.
+        Los batches aceptados antes del primer error igual llaman a su on_done, asi una reanudacion
+        no vuelve a embeberlos.
+        """
+        if self._held is not None:
+            logger.warning("qdrant_upload_aborted collection=%s in_flight=%d", self.collection_name, len(self._in_flight))
+        self._held = None
+        try:
+            while self._in_flight:
+                self._complete_oldest()
+        except Exception as exc:
+            logger.warning("qdrant_upload_failed collection=%s error=%s", self.collection_name, exc)
+        finally:
+            self._in_flight.clear()
+            self._executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,148 @@
+from __future__ import annotations
+
+import argparse
+import multiprocessing
+import os
+import socket
+import sys
+import threading
+import time
+from multiprocessing.synchronize import Event
+
+from app.core.config import get_settings
+from app.core.logger import configure_logging, get_logger
+from app.ingest.jobs import IngestJobStore, get_ingest_job_store
+
+
+logger = get_logger("ms-ia-orquestacion.ingest.worker")
+
+
+def _heartbeat_loop(store: IngestJobStore, job_id: str, stop: threading.Event, interval_s: float) -> None:
+    while not stop.wait(interval_s):
+        store.heartbeat(job_id)
+
+
+def run_job(store: IngestJobStore, job: dict, worker_id: str) -> None:
+    """
+    Ejecuta un job. Un thread aparte renueva el heartbeat mientras corre, asi una llamada larga de
+    embeddings o upsert sin progreso no lo hace pasar por un worker perdido.
+    """
+    from app.services.rag_service import get_rag_service
+
+    job_id = job["jobId"]
+    logger.info("ingest_job_start job_id=%s worker=%s source=%s", job_id, worker_id, job["source"])
+    stop_heartbeat = threading.Event()
+    heartbeat = threading.Thread(
+        target=_heartbeat_loop,
+        args=(store, job_id, stop_heartbeat, max(1.0, store.stale_after_s / 4)),
+        name=f"ingest-heartbeat-{job_id[:8]}",
+        daemon=True,
+    )
+    heartbeat.start()
+    try:
+        result = get_rag_service().ingest(
+            source=job["source"],
+            text=job["text"],
+            title=job["title"],
+            metadata=job["metadata"],
+            mode=job["mode"],
+            progress=lambda counts: store.update_progress(job_id, counts),
+        )
+    except Exception as exc:
+        requeued = store.fail(job_id, f"{type(exc).__name__}: {exc}")
+        logger.exception("ingest_job_failed job_id=%s requeued=%s", job_id, requeued)
+        return
+    finally:
+        stop_heartbeat.set()
+        heartbeat.join()
+    store.complete(job_id, result)
+    logger.info(
+        "ingest_job_done job_id=%s added=%s unchanged=%s removed=%s",
+        job_id,
+        result.get("chunks_added"),
+        result.get("chunks_unchanged"),
+        result.get("chunks_removed"),
+    )
+
+
+def run_worker(stop_event: Event | None = None, once: bool = False) -> None:
+    """Loop de un proceso worker: reclama jobs de la cola SQLite y los ejecuta uno a la vez."""
+    settings = get_settings()
+    store = get_ingest_job_store()
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    logger.info("ingest_worker_ready worker=%s jobs_path=%s", worker_id, store.path)
+
+    while stop_event is None or not stop_event.is_set():
+        job = store.claim_next(worker_id)
+        if job is not None:
+            run_job(store, job, worker_id)
+            continue
+        if once:
+            return
+        if stop_event is not None:
+            stop_event.wait(settings.rag_ingest_poll_interval_s)
+        else:
+            time.sleep(settings.rag_ingest_poll_interval_s)
+
+
+def _worker_entrypoint(stop_event: Event) -> None:
+    configure_logging()
+    try:
+        run_worker(stop_event)
+    except KeyboardInterrupt:
+        pass
+
+
+def start_worker_processes(count: int) -> tuple[list[multiprocessing.Process], Event]:
+    """Lanza count procesos worker (spawn) y devuelve el evento para detenerlos."""
+    context = multiprocessing.get_context("spawn")
+    stop_event = context.Event()
+    processes = []
+    for idx in range(count):
+        process = context.Process(
+            target=_worker_entrypoint,
+            args=(stop_event,),
+            name=f"rag-ingest-worker-{idx}",
+            daemon=True,
+        )
+        process.start()
+        processes.append(process)
+    logger.info("ingest_workers_started count=%d", count)
+    return processes, stop_event
+
+
+def stop_worker_processes(processes: list[multiprocessing.Process], stop_event: Event, timeout_s: float = 10.0) -> None:
+    stop_event.set()
+    for process in processes:
+        process.join(timeout=timeout_s)
+        if process.is_alive():
+            logger.warning("ingest_worker_terminate pid=%s", process.pid)
+            process.terminate()
+
+
+def _build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Workers de ingesta RAG (cola SQLite)")
+    parser.add_argument("--processes", type=int, default=None, help="Cantidad de procesos worker (default RAG_INGEST_WORKERS)")
+    parser.add_argument("--once", action="store_true", help="Procesa los jobs encolados y termina")
+    return parser
+
+
+def main() -> int:
+    configure_logging()
+    args = _build_parser().parse_args()
+    count = args.processes if args.processes is not None else max(1, get_settings().rag_ingest_workers)
+    if args.once or count <= 1:
+        run_worker(once=args.once)
+        return 0
+
+    processes, stop_event = start_worker_processes(count)
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        stop_worker_processes(processes, stop_event)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -13,7 +13,11 @@ ENV_PATH = os.path.abspath(os.path.join(BASE_DIR, "..", ".env"))
 
 load_dotenv(dotenv_path=ENV_PATH)
 
+from app.core.config import get_settings
+from app.core.metrics import render_metrics
+from app.core.tracing import export_trace, server_timing_header, span, start_trace
 from app.routers import ia_router, rag_router
+from app.services.warmup import readiness, start_warmup, stop_warmup
 
 logging.basicConfig(
     level=logging.INFO,
@@ -28,6 +32,8 @@ def _safe_qdrant_target(url: str) -> str:
     collection = os.getenv("QDRANT_COLLECTION", "rag_documents")
     return f"{url}/{collection}"
 
+_UNTRACED_PATHS = {"/health", "/ready", "/metrics"}
+
 app = FastAPI(
     title="SOFIA - MS IA Orquestacion",
     version="0.2.0",
@@ -38,6 +44,7 @@ app.add_middleware(
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "X-Request-Id", "X-Correlation-Id"],
 )
 
 
@@ -47,7 +54,14 @@ async def request_id_middleware(request: Request, call_next):
     request_id = correlation_id or request.headers.get("x-request-id", str(uuid.uuid4()))
     request.state.request_id = request_id
     request.state.correlation_id = correlation_id or request_id
-    response: Response = await call_next(request)
+    if request.url.path in _UNTRACED_PATHS:
+        response: Response = await call_next(request)
+    else:
+        trace = start_trace(request_id)
+        with span("total", method=request.method, path=request.url.path):
+            response = await call_next(request)
+        response.headers["Server-Timing"] = server_timing_header(trace)
+        export_trace(trace)
     response.headers["X-Request-Id"] = request_id
     response.headers["X-Correlation-Id"] = str(getattr(request.state, "correlation_id", request_id))
     return response
@@ -75,7 +89,7 @@ async def http_exception_handler(request: Request, exc: HTTPException):
     request_id = getattr(request.state, "request_id", "unknown")
     logger.warning("[%s] http_error status=%s detail=%s", request_id, exc.status_code, exc.detail)
     detail = exc.detail if isinstance(exc.detail, dict) else {"message": str(exc.detail)}
-    return JSONResponse(status_code=exc.status_code, content={"error": detail})
+    return JSONResponse(status_code=exc.status_code, content={"error": detail}, headers=exc.headers)
 
 
 @app.exception_handler(Exception)
@@ -112,6 +126,45 @@ def startup_debug_summary() -> None:
     )
 
 
+@app.on_event("startup")
+def start_warmup_thread() -> None:
+    # Opt-in: sin warmup el primer /rag-answer construye los clientes y asegura la coleccion.
+    if get_settings().rag_warmup_enabled:
+        start_warmup()
+
+
+@app.on_event("shutdown")
+def stop_warmup_thread() -> None:
+    stop_warmup()
+
+
+_ingest_workers: dict = {}
+
+
+@app.on_event("startup")
+def start_ingest_workers() -> None:
+    # Rol explicito: cada proceso de la API (uvicorn --workers, replicas) lanzaria sus propios workers.
+    # Por defecto la cola la atienden workers externos (python -m app.ingest.worker).
+    settings = get_settings()
+    count = settings.rag_ingest_workers
+    if not settings.rag_ingest_workers_in_api or count <= 0:
+        return
+    from app.ingest.worker import start_worker_processes
+
+    processes, stop_event = start_worker_processes(count)
+    _ingest_workers.update({"processes": processes, "stop_event": stop_event})
+
+
+@app.on_event("shutdown")
+def stop_ingest_workers() -> None:
+    if not _ingest_workers:
+        return
+    from app.ingest.worker import stop_worker_processes
+
+    stop_worker_processes(_ingest_workers["processes"], _ingest_workers["stop_event"])
+    _ingest_workers.clear()
+
+
 @app.get("/health")
 def health():
     return {
@@ -121,5 +174,24 @@ def health():
     }
 
 
+@app.get("/ready")
+def ready() -> JSONResponse:
+    """
+    Readiness para el balanceador/autoscaler: 503 hasta que termina el warmup (RAG_WARMUP_ENABLED).
+    /health sigue siendo liveness estatico.
+    """
+    is_ready, warmup = readiness()
+    return JSONResponse(
+        status_code=200 if is_ready else 503,
+        content={"status": "ready" if is_ready else "warming", "service": "ms-ia-orquestacion", "warmup": warmup},
+    )
+
+
+@app.get("/metrics", include_in_schema=False)
+def metrics() -> Response:
+    payload, content_type = render_metrics()
+    return Response(content=payload, media_type=content_type)
+
+
 app.include_router(ia_router.router, prefix="/v1/ai", tags=["IA"])
 app.include_router(rag_router.router, prefix="/v1/ai", tags=["RAG"])
@@ -0,0 +1,176 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+from pathlib import Path
+
+from app.core.config import get_settings
+from app.core.logger import get_logger
+
+
+logger = get_logger("ms-ia-orquestacion.rag.answer_cache")
+
+_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS answers (
+        cache_key TEXT PRIMARY KEY,
+        answer TEXT NOT NULL,
+        used_chunk_ids TEXT,
+        corpus_version TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        last_used_at REAL NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_answers_last_used ON answers (last_used_at)",
+    "CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT NOT NULL)",
+)
+
+
+def build_answer_cache_key(
+    query: str,
+    chunk_ids: list[str],
+    model: str,
+    temperature: float,
+    prompt_version: str,
+) -> str:
+    """
+    Hash deterministico de las entradas exactas de la generacion.
+    El orden de chunk_ids importa porque define el orden de la evidencia en el prompt.
+    """
+    raw = json.dumps(
+        {
+            "query": query,
+            "chunkIds": list(chunk_ids),
+            "model": model,
+            "temperature": round(float(temperature), 4),
+            "promptVersion": prompt_version,
+        },
+        ensure_ascii=True,
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class AnswerCache:
+    """Cache exacto de respuestas generadas, persistido en SQLite local."""
+
+    def __init__(self, path: str, max_entries: int, base_corpus_version: str = "") -> None:
+        self.path = path
+        self.max_entries = max(1, max_entries)
+        self._base_corpus_version = base_corpus_version
+        self._lock = threading.Lock()
+
+        if path != ":memory:":
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5.0)
+        if path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        for statement in _SCHEMA:
+            self._conn.execute(statement)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(answers)")}
+        if "used_chunk_ids" not in columns:
+            # Caches creados antes de guardar los chunks usados: sus filas quedan con NULL.
+            self._conn.execute("ALTER TABLE answers ADD COLUMN used_chunk_ids TEXT")
+        self._conn.execute(
+            "INSERT OR IGNORE INTO meta (name, value) VALUES ('corpus_generation', '0')"
+        )
+
+    def _corpus_version_sql(self) -> str:
+        # El setting permite invalidar por despliegue; la generacion la incrementa cada ingest.
+        return "(? || ':' || (SELECT value FROM meta WHERE name = 'corpus_generation'))"
+
+    def get(self, cache_key: str) -> str | None:
+        entry = self.get_entry(cache_key)
+        return entry[0] if entry is not None else None
+
+    def get_entry(self, cache_key: str) -> tuple[str, list[str] | None] | None:
+        """Respuesta y chunks que quedaron en el prompt (None si la fila no los guardo)."""
+        with self._lock:
+            row = self._conn.execute(
+                f"""
+                SELECT answer, used_chunk_ids FROM answers
+                WHERE cache_key = ? AND corpus_version = {self._corpus_version_sql()}
+                """,
+                (cache_key, self._base_corpus_version),
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE answers SET last_used_at = ? WHERE cache_key = ?",
+                (time.time(), cache_key),
+            )
+        return str(row[0]), (json.loads(row[1]) if row[1] else None)
+
+    def put(self, cache_key: str, answer: str, used_chunk_ids: list[str] | None = None) -> None:
+        now = time.time()
+        used = json.dumps(list(used_chunk_ids)) if used_chunk_ids is not None else None
+        with self._lock:
+            self._conn.execute(
+                f"""
+                INSERT OR REPLACE INTO answers
+                    (cache_key, answer, used_chunk_ids, corpus_version, created_at, last_used_at)
+                VALUES (?, ?, ?, {self._corpus_version_sql()}, ?, ?)
+                """,
+                (cache_key, answer, used, self._base_corpus_version, now, now),
+            )
+            self._conn.execute(
+                """
+                DELETE FROM answers WHERE cache_key IN (
+                    SELECT cache_key FROM answers ORDER BY last_used_at ASC
+                    LIMIT max(0, (SELECT COUNT(*) FROM answers) - ?)
+                )
+                """,
+                (self.max_entries,),
+            )
+
+    def invalidate_corpus(self) -> None:
+        """Marca como obsoletas todas las respuestas previas al cambio de corpus."""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE meta SET value = CAST(value AS INTEGER) + 1 WHERE name = 'corpus_generation'"
+            )
+            deleted = self._conn.execute(
+                f"DELETE FROM answers WHERE corpus_version != {self._corpus_version_sql()}",
+                (self._base_corpus_version,),
+            ).rowcount
+        logger.info("answer_cache_invalidated path=%s deleted=%d", self.path, deleted)
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            total = self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+        return {"entries": int(total), "maxEntries": self.max_entries}
+
+
+@lru_cache(maxsize=1)
+def get_answer_cache() -> AnswerCache | None:
+    settings = get_settings()
+    if not settings.rag_answer_cache_enabled:
+        return None
+    cache = AnswerCache(
+        path=settings.rag_answer_cache_path,
+        max_entries=settings.rag_answer_cache_max_entries,
+        base_corpus_version=settings.rag_corpus_version,
+    )
+    logger.info(
+        "answer_cache_ready path=%s max_entries=%d corpus_version=%s",
+        cache.path,
+        cache.max_entries,
+        settings.rag_corpus_version or "-",
+    )
+    return cache
+
+
+def invalidate_answer_cache() -> None:
+    try:
+        cache = get_answer_cache()
+    except Exception as exc:
+        logger.warning("answer_cache_invalidate_failed: %s", exc)
+        return
+    if cache is not None:
+        cache.invalidate_corpus()
@@ -0,0 +1,210 @@
+from __future__ import annotations
+
+import hashlib
+import math
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable
+
+import numpy as np
+
+from app.core.metrics import CACHE_REQUESTS
+from app.rag.reranker import cosine_scores
+from app.rag.retriever import ChunkCandidate
+
+
+_SENTENCE_SPLIT_RE = re.compile(r"(?<=[\.!?;:])\s+|\n+")
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+_STOPWORDS = {
+    "a", "al", "como", "con", "de", "del", "el", "en", "es", "la", "las", "lo", "los",
+    "me", "mi", "o", "para", "por", "que", "se", "si", "su", "sus", "un", "una", "y",
+}
+
+
+@dataclass(frozen=True)
+class CompressionResult:
+    evidence: list[str]
+    sentences_total: int
+    sentences_kept: int
+    evidence_tokens_before: int
+    evidence_tokens_after: int
+    scorer: str
+
+
+class SentenceEmbeddingCache:
+    """LRU en proceso de embeddings de oraciones (float32), compartido entre requests."""
+
+    def __init__(self, max_entries: int = 20_000) -> None:
+        self.max_entries = max_entries
+        self._items: OrderedDict[str, np.ndarray] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(sentence: str) -> str:
+        return hashlib.sha1(sentence.encode("utf-8")).hexdigest()
+
+    def get_many(
+        self,
+        sentences: list[str],
+        embed_fn: Callable[[list[str]], list[list[float]]],
+    ) -> list[np.ndarray]:
+        keys = [self._key(sentence) for sentence in sentences]
+        found: dict[str, np.ndarray] = {}
+        with self._lock:
+            for key in keys:
+                vector = self._items.get(key)
+                if vector is not None:
+                    self._items.move_to_end(key)
+                    found[key] = vector
+
+        missing: dict[str, str] = {}
+        for key, sentence in zip(keys, sentences):
+            if key not in found and key not in missing:
+                missing[key] = sentence
+        CACHE_REQUESTS.labels(cache="sentence_embedding", result="hit").inc(len(keys) - len(missing))
+        CACHE_REQUESTS.labels(cache="sentence_embedding", result="miss").inc(len(missing))
+
+        if missing:
+            vectors = np.asarray(embed_fn(list(missing.values())), dtype=np.float32)
+            with self._lock:
+                for key, vector in zip(missing.keys(), vectors):
+                    # Copia por fila: una vista mantendria viva la matriz del batch completo.
+                    found[key] = vector.copy()
+                    self._items[key] = found[key]
+                    self._items.move_to_end(key)
+                while len(self._items) > self.max_entries:
+                    self._items.popitem(last=False)
+
+        return [found[key] for key in keys]
+
+
+_sentence_embedding_cache = SentenceEmbeddingCache()
+
+
+def split_sentences(text: str) -> list[str]:
+    return [part.strip() for part in _SENTENCE_SPLIT_RE.split(text or "") if part and part.strip()]
+
+
+def _fold(word: str) -> str:
+    decomposed = unicodedata.normalize("NFKD", word.lower())
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+
+def _terms(text: str) -> list[str]:
+    return [term for term in (_fold(w) for w in _WORD_RE.findall(text)) if len(term) > 2 and term not in _STOPWORDS]
+
+
+def _lexical_scores(query: str, sentences: list[str]) -> list[float]:
+    query_terms = set(_terms(query))
+    if not query_terms:
+        return [0.0 for _ in sentences]
+
+    sentence_terms = [set(_terms(sentence)) for sentence in sentences]
+    doc_freq: dict[str, int] = {}
+    for terms in sentence_terms:
+        for term in terms & query_terms:
+            doc_freq[term] = doc_freq.get(term, 0) + 1
+
+    total = len(sentences)
+    scores: list[float] = []
+    for terms in sentence_terms:
+        matched = terms & query_terms
+        score = sum(math.log(1.0 + total / doc_freq[term]) for term in matched)
+        scores.append(score / math.sqrt(len(terms) + 1.0))
+    return scores
+
+
+def _truncate_to_budget(sentence: str, token_budget: int, count_tokens: Callable[[str], int]) -> tuple[str, int]:
+    # Prefijo de palabras mas largo que entra en el presupuesto (busqueda binaria sobre count_tokens).
+    words = sentence.split()
+    low, high = 0, len(words)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if count_tokens(" ".join(words[:mid])) <= token_budget:
+            low = mid
+        else:
+            high = mid - 1
+    text = " ".join(words[:low])
+    return text, count_tokens(text) if text else 0
+
+
+def compress_context(
+    query: str,
+    chunks: list[ChunkCandidate],
+    token_budget: int,
+    count_tokens: Callable[[str], int],
+    query_embedding: list[float] | None = None,
+    embed_fn: Callable[[list[str]], list[list[float]]] | None = None,
+) -> CompressionResult:
+    """
+    Conserva las oraciones mas relevantes para la pregunta hasta llenar token_budget.
+    La salida queda alineada con chunks (un texto por chunk, posiblemente vacio) y
+    mantiene el orden original de las oraciones dentro de cada chunk. Si ninguna oracion entra
+    completa, la mejor se trunca al presupuesto.
+    """
+    per_chunk = [split_sentences(chunk.text) for chunk in chunks]
+    flat: list[tuple[int, int, str]] = [
+        (chunk_pos, sent_pos, sentence)
+        for chunk_pos, sentences in enumerate(per_chunk)
+        for sent_pos, sentence in enumerate(sentences)
+    ]
+    sentence_tokens = [count_tokens(sentence) for _, _, sentence in flat]
+    tokens_before = sum(count_tokens(chunk.text) for chunk in chunks)
+
+    if tokens_before <= token_budget or not flat:
+        return CompressionResult(
+            evidence=[chunk.text for chunk in chunks],
+            sentences_total=len(flat),
+            sentences_kept=len(flat),
+            evidence_tokens_before=tokens_before,
+            evidence_tokens_after=tokens_before,
+            scorer="none",
+        )
+
+    texts = [sentence for _, _, sentence in flat]
+    scorer = "lexical"
+    scores: list[float]
+    if query_embedding is not None and embed_fn is not None:
+        try:
+            vectors = _sentence_embedding_cache.get_many(texts, embed_fn)
+            scores = cosine_scores(query_embedding, vectors).tolist()
+            scorer = "embedding"
+        except Exception:
+            scores = _lexical_scores(query, texts)
+    else:
+        scores = _lexical_scores(query, texts)
+
+    # Desempate estable: a igual score gana el chunk mejor rankeado y la oracion mas temprana.
+    order = sorted(range(len(flat)), key=lambda i: (-scores[i], flat[i][0], flat[i][1]))
+    kept: set[int] = set()
+    used = 0
+    for idx in order:
+        cost = sentence_tokens[idx]
+        if used + cost > token_budget:
+            continue
+        kept.add(idx)
+        used += cost
+
+    truncated: dict[int, str] = {}
+    if not kept:
+        text, used = _truncate_to_budget(flat[order[0]][2], token_budget, count_tokens)
+        if text:
+            kept.add(order[0])
+            truncated[order[0]] = text
+
+    grouped: list[list[str]] = [[] for _ in chunks]
+    for idx in sorted(kept):
+        chunk_pos, _, sentence = flat[idx]
+        grouped[chunk_pos].append(truncated.get(idx, sentence))
+
+    return CompressionResult(
+        evidence=[" ".join(sentences) for sentences in grouped],
+        sentences_total=len(flat),
+        sentences_kept=len(kept),
+        evidence_tokens_before=tokens_before,
+        evidence_tokens_after=used,
+        scorer=scorer,
+    )
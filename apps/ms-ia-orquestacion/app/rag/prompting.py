@@ -3,12 +3,27 @@ from __future__ import annotations
 from app.rag.retriever import ChunkCandidate
 
 
-def build_grounded_prompt(query: str, top_chunks: list[ChunkCandidate]) -> tuple[str, str]:
+# Incrementar cuando cambie el texto de los prompts: invalida el cache de respuestas.
+PROMPT_TEMPLATE_VERSION = "grounded-v1"
+
+
+def build_grounded_prompt(
+    query: str,
+    top_chunks: list[ChunkCandidate],
+    evidence_texts: list[str] | None = None,
+) -> tuple[str, str]:
+    """
+    evidence_texts (opcional) reemplaza el texto de cada chunk, p.ej. tras compresion.
+    Los chunks sin texto se omiten pero conservan su numero [E#] original.
+    """
     evidence = []
     for idx, chunk in enumerate(top_chunks, start=1):
+        text = evidence_texts[idx - 1] if evidence_texts is not None else chunk.text
+        if not text:
+            continue
         evidence.append(
             f"[E{idx}] source={chunk.source} chunk={chunk.chunk_index} page={chunk.page_start}-{chunk.page_end}\n"
-            f"{chunk.text}"
+            f"{text}"
         )
 
     context = "\n\n---\n\n".join(evidence)
@@ -1,39 +1,66 @@
 from __future__ import annotations
 
 import json
-import math
 from typing import Any
 
+import numpy as np
 from openai import OpenAI
 
+from app.core.metrics import DEPENDENCY_ERRORS
 from app.rag.retriever import ChunkCandidate
 
 
-def _cosine_similarity(a: list[float], b: list[float]) -> float:
-    if not a or not b or len(a) != len(b):
-        return 0.0
-    dot = sum(x * y for x, y in zip(a, b))
-    norm_a = math.sqrt(sum(x * x for x in a))
-    norm_b = math.sqrt(sum(y * y for y in b))
-    if norm_a == 0 or norm_b == 0:
-        return 0.0
-    return dot / (norm_a * norm_b)
+def _stack_embeddings(rows: list[np.ndarray]) -> np.ndarray:
+    """
+    Matriz (n, dim) de las filas dadas. Si son las filas de la matriz compartida del retrieval,
+    en orden, se usa esa matriz sin copiar; si no, se apilan.
+    """
+    base = rows[0].base
+    if (
+        isinstance(base, np.ndarray)
+        and base.ndim == 2
+        and base.shape[0] == len(rows)
+        and all(
+            row.base is base and row.shape == base[idx].shape and np.shares_memory(row, base[idx])
+            for idx, row in enumerate(rows)
+        )
+    ):
+        return base
+    return np.vstack(rows)
+
+
+def cosine_scores(query_embedding: list[float] | np.ndarray, rows: list[np.ndarray]) -> np.ndarray:
+    """Similitud coseno de la consulta contra cada fila; 0 si alguna norma es 0 o la dimension no coincide."""
+    if len(query_embedding) == 0:
+        return np.zeros(len(rows), dtype=np.float32)
+    query = np.asarray(query_embedding, dtype=np.float32)
+    matrix = _stack_embeddings(rows)
+    if matrix.shape[1] != query.shape[0]:
+        return np.zeros(len(rows), dtype=np.float32)
+
+    norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(query)
+    dots = matrix @ query
+    return np.divide(dots, norms, out=np.zeros_like(dots), where=norms > 0)
 
 
 def rerank_cosine(
-    query_embedding: list[float],
+    query_embedding: list[float] | np.ndarray,
     candidates: list[ChunkCandidate],
     mongo_weight: float = 0.7,
     cosine_weight: float = 0.3,
 ) -> list[ChunkCandidate]:
-    scored: list[ChunkCandidate] = []
+    with_embedding = [c for c in candidates if c.embedding is not None and len(c.embedding) > 0]
+    cosine_by_id: dict[int, float] = {}
+    if with_embedding:
+        scores = cosine_scores(query_embedding, [c.embedding for c in with_embedding])
+        cosine_by_id = {id(c): float(score) for c, score in zip(with_embedding, scores)}
+
     for candidate in candidates:
-        cosine_score = _cosine_similarity(query_embedding, candidate.embedding) if candidate.embedding else candidate.mongo_score
+        cosine_score = cosine_by_id.get(id(candidate), candidate.mongo_score)
         combined = (mongo_weight * candidate.mongo_score) + (cosine_weight * cosine_score)
         candidate.rerank_score = float(combined)
-        scored.append(candidate)
 
-    return sorted(scored, key=lambda c: c.rerank_score or 0.0, reverse=True)
+    return sorted(candidates, key=lambda c: c.rerank_score or 0.0, reverse=True)
 
 
 def rerank_llm(
@@ -42,6 +69,8 @@ def rerank_llm(
     candidates: list[ChunkCandidate],
     model: str,
     max_candidates: int = 12,
+    timeout: float = 20.0,
+    max_retries: int = 1,
 ) -> list[ChunkCandidate]:
     if not candidates:
         return []
@@ -58,7 +87,7 @@ def rerank_llm(
     )
     user_prompt = f"Pregunta: {query}\n\nFragmentos:\n" + "\n\n".join(snippets)
 
-    completion = client.with_options(timeout=20, max_retries=1).chat.completions.create(
+    completion = client.with_options(timeout=timeout, max_retries=max_retries).chat.completions.create(
         model=model,
         temperature=0.0,
         messages=[
@@ -99,12 +128,17 @@ def rerank_candidates(
     candidates: list[ChunkCandidate],
     openai_client: OpenAI | None,
     llm_model: str,
+    llm_timeout: float = 20.0,
+    llm_max_retries: int = 1,
 ) -> list[ChunkCandidate]:
     selected_mode = (mode or "cosine").lower()
     if selected_mode == "llm" and openai_client is not None:
         try:
-            return rerank_llm(openai_client, query, candidates, model=llm_model)
+            return rerank_llm(
+                openai_client, query, candidates, model=llm_model, timeout=llm_timeout, max_retries=llm_max_retries
+            )
         except Exception:
+            DEPENDENCY_ERRORS.labels(dependency="openai").inc()
             return rerank_cosine(query_embedding, candidates)
     return rerank_cosine(query_embedding, candidates)
 
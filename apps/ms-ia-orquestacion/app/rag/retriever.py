@@ -3,16 +3,26 @@ from __future__ import annotations
 from dataclasses import dataclass
 from typing import Any
 
+import numpy as np
 from qdrant_client import QdrantClient, models
 
 from app.core.logger import get_logger
+from app.ingest.dedup import DEDUP_PAYLOAD_FIELDS
 
 
 logger = get_logger("ms-ia-orquestacion.rag.retriever")
 
+# Firmas MinHash de la deduplicacion de ingesta: ~1.5 KB por punto que el retrieval no necesita.
+_PAYLOAD_SELECTOR = models.PayloadSelectorExclude(exclude=list(DEDUP_PAYLOAD_FIELDS))
 
-@dataclass
+
+@dataclass(slots=True)
 class ChunkCandidate:
+    """
+    Candidato recuperado de Qdrant. embedding es una vista float32 (una fila) sobre la matriz
+    compartida del retrieval; no se guardan listas de floats por candidato.
+    """
+
     chunk_id: str
     source: str
     version: str
@@ -21,49 +31,54 @@ class ChunkCandidate:
     text: str
     metadata: dict[str, Any]
     mongo_score: float
-    embedding: list[float] | None
+    embedding: np.ndarray | None
     page_start: int | None
     page_end: int | None
     rerank_score: float | None = None
 
+    def __post_init__(self) -> None:
+        if self.embedding is not None and not isinstance(self.embedding, np.ndarray):
+            self.embedding = np.asarray(self.embedding, dtype=np.float32)
 
-def retrieve_candidates(
-    client: QdrantClient,
-    collection_name: str,
-    query_embedding: list[float],
-    topk: int,
-    filters: dict[str, Any] | None,
-    include_embedding: bool,
-) -> list[ChunkCandidate]:
-    qdrant_filter: models.Filter | None = None
-    if filters:
-        qdrant_filter = models.Filter(
-            must=[
-                models.FieldCondition(
-                    key=str(key),
-                    match=models.MatchValue(value=value),
-                )
-                for key, value in filters.items()
-                if value is not None
-            ]
-        )
 
-    response = client.query_points(
-        collection_name=collection_name,
-        query=query_embedding,
-        query_filter=qdrant_filter,
-        limit=topk,
-        with_payload=True,
-        with_vectors=include_embedding,
+def _build_qdrant_filter(filters: dict[str, Any] | None) -> models.Filter | None:
+    if not filters:
+        return None
+    return models.Filter(
+        must=[
+            models.FieldCondition(
+                key=str(key),
+                match=models.MatchValue(value=value),
+            )
+            for key, value in filters.items()
+            if value is not None
+        ]
     )
-    docs = list(response.points or [])
+
+
+def _embedding_matrix(points: list[Any]) -> np.ndarray | None:
+    """Copia los vectores de la respuesta a una sola matriz float32 contigua (una fila por punto)."""
+    vectors = [doc.vector if isinstance(doc.vector, list) else None for doc in points]
+    dims = {len(vector) for vector in vectors if vector}
+    if len(dims) != 1:
+        return None
+    dim = dims.pop()
+    if all(vector is not None and len(vector) == dim for vector in vectors):
+        return np.array(vectors, dtype=np.float32)
+    matrix = np.zeros((len(points), dim), dtype=np.float32)
+    for row, vector in enumerate(vectors):
+        if vector and len(vector) == dim:
+            matrix[row] = vector
+    return matrix
+
+
+def _to_candidates(points: list[Any], include_embedding: bool) -> list[ChunkCandidate]:
+    matrix = _embedding_matrix(points) if include_embedding else None
 
     candidates: list[ChunkCandidate] = []
-    for doc in docs:
-        payload = dict(doc.payload or {})
-        vector = doc.vector if include_embedding else None
-        if isinstance(vector, dict):
-            vector = None
+    for row, doc in enumerate(points):
+        payload = doc.payload or {}
+        has_vector = matrix is not None and isinstance(doc.vector, list) and len(doc.vector) == matrix.shape[1]
 
         candidates.append(
             ChunkCandidate(
@@ -73,11 +88,66 @@ def retrieve_candidates(
                 title=str(payload.get("title") or payload.get("docName") or ""),
                 chunk_index=int(payload.get("chunkIndex") or 0),
                 text=str(payload.get("chunkText") or payload.get("text") or ""),
-                metadata=dict(payload.get("metadata") or {}),
+                # El payload ya es un dict propio de esta respuesta: se referencia sin copiarlo.
+                metadata=payload.get("metadata") or {},
                 mongo_score=float(doc.score or 0.0),
-                embedding=vector if isinstance(vector, list) else None,
+                embedding=matrix[row] if has_vector else None,
                 page_start=payload.get("pageStart"),
                 page_end=payload.get("pageEnd"),
             )
         )
     return candidates
+
+
+def retrieve_candidates(
+    client: QdrantClient,
+    collection_name: str,
+    query_embedding: list[float],
+    topk: int,
+    filters: dict[str, Any] | None,
+    include_embedding: bool,
+    timeout: int | None = None,
+) -> list[ChunkCandidate]:
+    response = client.query_points(
+        collection_name=collection_name,
+        query=query_embedding,
+        query_filter=_build_qdrant_filter(filters),
+        limit=topk,
+        with_payload=_PAYLOAD_SELECTOR,
+        with_vectors=include_embedding,
+        timeout=timeout,
+    )
+    return _to_candidates(list(response.points or []), include_embedding)
+
+
+def retrieve_candidates_batch(
+    client: QdrantClient,
+    collection_name: str,
+    query_embeddings: list[list[float]],
+    topk: int,
+    filters: list[dict[str, Any] | None],
+    include_embedding: bool,
+    timeout: int | None = None,
+) -> list[list[ChunkCandidate]]:
+    """Una sola llamada query_batch_points para varias preguntas; el resultado respeta el orden de entrada."""
+    if len(query_embeddings) != len(filters):
+        raise ValueError("query_embeddings y filters deben tener el mismo largo")
+    if not query_embeddings:
+        return []
+
+    requests = [
+        models.QueryRequest(
+            query=embedding,
+            filter=_build_qdrant_filter(item_filters),
+            limit=topk,
+            with_payload=_PAYLOAD_SELECTOR,
+            with_vector=include_embedding,
+        )
+        for embedding, item_filters in zip(query_embeddings, filters)
+    ]
+    responses = client.query_batch_points(
+        collection_name=collection_name,
+        requests=requests,
+        timeout=timeout,
+    )
+    return [_to_candidates(list(response.points or []), include_embedding) for response in responses]
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import math
 import time
 from dataclasses import dataclass
 from typing import Any
@@ -7,11 +8,17 @@ from typing import Any
 from openai import OpenAI
 from qdrant_client import QdrantClient
 
+from app.ai.embeddings import count_tokens
 from app.core.config import get_settings
+from app.core.deadline import Deadline
 from app.core.logger import get_logger
-from app.rag.prompting import build_grounded_prompt
+from app.core.metrics import BATCH_SHARED_STAGES, observe_pipeline_metrics, observe_stage_ms
+from app.core.tracing import span
+from app.rag.answer_cache import AnswerCache, build_answer_cache_key
+from app.rag.compression import compress_context
+from app.rag.prompting import PROMPT_TEMPLATE_VERSION, build_grounded_prompt
 from app.rag.reranker import rerank_candidates, should_reject_by_threshold
-from app.rag.retriever import ChunkCandidate, retrieve_candidates
+from app.rag.retriever import ChunkCandidate, retrieve_candidates, retrieve_candidates_batch
 
 
 logger = get_logger("ms-ia-orquestacion.rag.pipeline")
@@ -38,6 +45,16 @@ class PipelineRunConfig:
     dry_run: bool
 
 
+@dataclass(frozen=True)
+class PrefetchedRetrieval:
+    """Embedding y candidatos ya resueltos para una pregunta (p.ej. por un batch)."""
+
+    query_embedding: list[float]
+    candidates: list[ChunkCandidate]
+    embed_ms: float
+    retrieval_ms: float
+
+
 def _build_retrieval_filters(
     incoming_filters: dict[str, Any] | None,
     source_filter: str | None,
@@ -63,21 +80,125 @@ def _build_retrieval_filters(
 
 
 class RetrievalPipelineService:
-    def __init__(self, qdrant_client: QdrantClient, qdrant_collection: str, openai_client: OpenAI, embedding_model: str, answer_model: str) -> None:
+    def __init__(
+        self,
+        qdrant_client: QdrantClient,
+        qdrant_collection: str,
+        openai_client: OpenAI,
+        embedding_model: str,
+        answer_model: str,
+        answer_cache: AnswerCache | None = None,
+        openai_timeout_s: float = 30.0,
+        qdrant_timeout_s: float = 20.0,
+        rerank_timeout_s: float = 20.0,
+    ) -> None:
         self.qdrant_client = qdrant_client
         self.qdrant_collection = qdrant_collection
         self.openai_client = openai_client
         self.embedding_model = embedding_model
         self.answer_model = answer_model
-
-    def _embed_query(self, query: str, dimensions: int) -> list[float]:
-        result = self.openai_client.embeddings.create(
+        self.answer_cache = answer_cache
+        self.openai_timeout_s = openai_timeout_s
+        self.qdrant_timeout_s = qdrant_timeout_s
+        self.rerank_timeout_s = rerank_timeout_s
+
+    def _openai_timeout(self, deadline: Deadline | None, stage: str) -> dict[str, Any]:
+        """Timeout por request para el SDK de OpenAI: el presupuesto restante, acotado por el default."""
+        if deadline is None:
+            return {}
+        return {"timeout": deadline.timeout_for(stage, cap=self.openai_timeout_s)}
+
+    def _openai(self, deadline: Deadline | None) -> OpenAI:
+        """
+        Cliente para una llamada del pipeline. Con deadline no hay reintentos: cada intento tendria
+        de nuevo todo el presupuesto restante y la etapa podria durar varias veces el deadline.
+        """
+        if deadline is None:
+            return self.openai_client
+        return self.openai_client.with_options(max_retries=0)
+
+    def _embed_query(self, query: str, dimensions: int, deadline: Deadline | None = None) -> list[float]:
+        result = self._openai(deadline).embeddings.create(
             model=self.embedding_model,
             input=[query],
             dimensions=dimensions,
+            **self._openai_timeout(deadline, "embed"),
         )
         return result.data[0].embedding
 
+    def _embed_queries(self, queries: list[str], dimensions: int, deadline: Deadline | None = None) -> list[list[float]]:
+        result = self._openai(deadline).embeddings.create(
+            model=self.embedding_model,
+            input=queries,
+            dimensions=dimensions,
+            **self._openai_timeout(deadline, "embed"),
+        )
+        return [item.embedding for item in sorted(result.data, key=lambda item: item.index)]
+
+    def _qdrant_timeout(self, deadline: Deadline | None) -> int | None:
+        if deadline is None:
+            return None
+        # Qdrant acepta segundos enteros; se redondea hacia arriba para no cortar en 0.
+        return max(1, math.ceil(deadline.timeout_for("retrieve", cap=self.qdrant_timeout_s)))
+
+    def _prompt_version(self) -> str:
+        settings = get_settings()
+        if not settings.rag_context_compression_enabled:
+            return PROMPT_TEMPLATE_VERSION
+        return f"{PROMPT_TEMPLATE_VERSION}|ctx={settings.rag_context_token_budget}:{settings.rag_context_scorer}"
+
+    def _embed_sentences(self, sentences: list[str], deadline: Deadline | None = None) -> list[list[float]]:
+        result = self._openai(deadline).embeddings.create(
+            model=self.embedding_model,
+            input=sentences,
+            dimensions=get_settings().embedding_dimensions,
+            **self._openai_timeout(deadline, "prompt"),
+        )
+        return [item.embedding for item in sorted(result.data, key=lambda item: item.index)]
+
+    def _build_prompt(
+        self,
+        query: str,
+        top_chunks: list[ChunkCandidate],
+        query_embedding: list[float],
+        deadline: Deadline | None = None,
+    ) -> tuple[str, str, dict[str, Any], list[ChunkCandidate]]:
+        """
+        Devuelve tambien los chunks que aportan evidencia al prompt: los que la compresion deja
+        vacios no se envian al modelo ni se reportan en usedChunks.
+        """
+        settings = get_settings()
+        system_prompt, user_prompt = build_grounded_prompt(query, top_chunks)
+        tokens_before = count_tokens(system_prompt + user_prompt, model=self.answer_model)
+        stats: dict[str, Any] = {"before": tokens_before, "after": tokens_before, "compressed": False}
+        if not settings.rag_context_compression_enabled:
+            return system_prompt, user_prompt, stats, top_chunks
+
+        use_embeddings = settings.rag_context_scorer == "embedding"
+        compression = compress_context(
+            query=query,
+            chunks=top_chunks,
+            token_budget=settings.rag_context_token_budget,
+            count_tokens=lambda text: count_tokens(text, model=self.answer_model),
+            query_embedding=query_embedding if use_embeddings else None,
+            embed_fn=(lambda sentences: self._embed_sentences(sentences, deadline)) if use_embeddings else None,
+        )
+        if compression.scorer == "none":
+            return system_prompt, user_prompt, stats, top_chunks
+
+        used_chunks = [chunk for chunk, text in zip(top_chunks, compression.evidence) if text]
+        system_prompt, user_prompt = build_grounded_prompt(query, top_chunks, evidence_texts=compression.evidence)
+        stats.update(
+            {
+                "after": count_tokens(system_prompt + user_prompt, model=self.answer_model),
+                "compressed": True,
+                "scorer": compression.scorer,
+                "sentencesKept": compression.sentences_kept,
+                "sentencesTotal": compression.sentences_total,
+            }
+        )
+        return system_prompt, user_prompt, stats, used_chunks
+
     def _build_output(self, chunks: list[ChunkCandidate], answer: str) -> dict[str, Any]:
         citations = [{"source": c.source, "chunkIndex": c.chunk_index} for c in chunks]
         used_chunks = [
@@ -123,38 +244,128 @@ class RetrievalPipelineService:
             dry_run=bool(overrides.get("dry_run", base.dry_run)),
         )
 
+    def prefetch_batch(
+        self,
+        queries: list[str],
+        incoming_filters: list[dict[str, Any] | None],
+        overrides: dict[str, Any] | None = None,
+        deadline: Deadline | None = None,
+    ) -> list[PrefetchedRetrieval]:
+        """
+        Embedding y retrieval de varias preguntas en una llamada a OpenAI y una a Qdrant.
+        El resultado se pasa a evaluate(prefetched=...) para rerank y generacion por item.
+        Las latencias de embed y retrieval se observan aca, una vez por batch.
+        """
+        settings = get_settings()
+        run_config = self._merge_run_config(overrides=overrides)
+
+        embed_started = time.perf_counter()
+        with span("embed", batch=len(queries)):
+            embeddings = self._embed_queries(queries, settings.embedding_dimensions, deadline)
+        embed_ms = round((time.perf_counter() - embed_started) * 1000, 2)
+
+        filters = [
+            _build_retrieval_filters(
+                item_filters,
+                source_filter=run_config.source_filter,
+                version_filter=run_config.version_filter,
+            )
+            for item_filters in incoming_filters
+        ]
+        retrieval_started = time.perf_counter()
+        with span("retrieve", topk=run_config.candidate_topk, batch=len(queries)):
+            batches = retrieve_candidates_batch(
+                client=self.qdrant_client,
+                collection_name=self.qdrant_collection,
+                query_embeddings=embeddings,
+                topk=run_config.candidate_topk,
+                filters=filters,
+                include_embedding=run_config.rerank_enabled and run_config.rerank_mode == "cosine",
+                timeout=self._qdrant_timeout(deadline),
+            )
+        retrieval_ms = round((time.perf_counter() - retrieval_started) * 1000, 2)
+        observe_stage_ms("embed", embed_ms)
+        observe_stage_ms("retrieval", retrieval_ms)
+        logger.info(
+            "rag_pipeline batch_retrieval queries=%d candidate_topk=%d embed_ms=%.2f retrieval_ms=%.2f",
+            len(queries),
+            run_config.candidate_topk,
+            embed_ms,
+            retrieval_ms,
+        )
+        return [
+            PrefetchedRetrieval(
+                query_embedding=embedding,
+                candidates=candidates,
+                embed_ms=embed_ms,
+                retrieval_ms=retrieval_ms,
+            )
+            for embedding, candidates in zip(embeddings, batches)
+        ]
+
     def evaluate(
         self,
         query: str,
         incoming_filters: dict[str, Any] | None,
         overrides: dict[str, Any] | None = None,
         dry_run: bool = False,
+        deadline: Deadline | None = None,
+        prefetched: PrefetchedRetrieval | None = None,
+    ) -> dict[str, Any]:
+        result = self._evaluate(
+            query,
+            incoming_filters,
+            overrides=overrides,
+            dry_run=dry_run,
+            deadline=deadline,
+            prefetched=prefetched,
+        )
+        observe_pipeline_metrics(result["metrics"], skip_stages=BATCH_SHARED_STAGES if prefetched is not None else ())
+        return result
+
+    def _evaluate(
+        self,
+        query: str,
+        incoming_filters: dict[str, Any] | None,
+        overrides: dict[str, Any] | None = None,
+        dry_run: bool = False,
+        deadline: Deadline | None = None,
+        prefetched: PrefetchedRetrieval | None = None,
     ) -> dict[str, Any]:
         settings = get_settings()
         run_config = self._merge_run_config(overrides=overrides, dry_run=dry_run)
         overall_started = time.perf_counter()
 
-        embed_started = time.perf_counter()
-        query_embedding = self._embed_query(query, settings.embedding_dimensions)
-        embed_ms = round((time.perf_counter() - embed_started) * 1000, 2)
-
         filters = _build_retrieval_filters(
             incoming_filters,
             source_filter=run_config.source_filter,
             version_filter=run_config.version_filter,
         )
-        retrieval_started = time.perf_counter()
 
-        include_embedding = run_config.rerank_enabled and run_config.rerank_mode == "cosine"
-        candidates = retrieve_candidates(
-            client=self.qdrant_client,
-            collection_name=self.qdrant_collection,
-            query_embedding=query_embedding,
-            topk=run_config.candidate_topk,
-            filters=filters,
-            include_embedding=include_embedding,
-        )
-        retrieval_ms = round((time.perf_counter() - retrieval_started) * 1000, 2)
+        if prefetched is not None:
+            query_embedding = prefetched.query_embedding
+            candidates = prefetched.candidates
+            embed_ms = prefetched.embed_ms
+            retrieval_ms = prefetched.retrieval_ms
+        else:
+            embed_started = time.perf_counter()
+            with span("embed"):
+                query_embedding = self._embed_query(query, settings.embedding_dimensions, deadline)
+            embed_ms = round((time.perf_counter() - embed_started) * 1000, 2)
+
+            retrieval_started = time.perf_counter()
+            include_embedding = run_config.rerank_enabled and run_config.rerank_mode == "cosine"
+            with span("retrieve", topk=run_config.candidate_topk):
+                candidates = retrieve_candidates(
+                    client=self.qdrant_client,
+                    collection_name=self.qdrant_collection,
+                    query_embedding=query_embedding,
+                    topk=run_config.candidate_topk,
+                    filters=filters,
+                    include_embedding=include_embedding,
+                    timeout=self._qdrant_timeout(deadline),
+                )
+            retrieval_ms = round((time.perf_counter() - retrieval_started) * 1000, 2)
 
         sample_scores = [round(c.mongo_score, 4) for c in candidates[:5]]
         logger.info(
@@ -200,14 +411,22 @@ class RetrievalPipelineService:
             }
 
         rerank_started = time.perf_counter()
-        ranked = rerank_candidates(
-            mode=run_config.rerank_mode if run_config.rerank_enabled else "cosine",
-            query=query,
-            query_embedding=query_embedding,
-            candidates=candidates,
-            openai_client=self.openai_client if run_config.rerank_enabled and run_config.rerank_mode == "llm" else None,
-            llm_model=self.answer_model,
-        )
+        llm_rerank = run_config.rerank_enabled and run_config.rerank_mode == "llm"
+        # El rerank coseno es local y no necesita timeout: solo el de LLM consume presupuesto.
+        llm_timeout = self.rerank_timeout_s
+        if llm_rerank and deadline is not None:
+            llm_timeout = deadline.timeout_for("rerank", cap=self.rerank_timeout_s)
+        with span("rerank", mode=run_config.rerank_mode):
+            ranked = rerank_candidates(
+                mode=run_config.rerank_mode if run_config.rerank_enabled else "cosine",
+                query=query,
+                query_embedding=query_embedding,
+                candidates=candidates,
+                openai_client=self.openai_client if llm_rerank else None,
+                llm_model=self.answer_model,
+                llm_timeout=llm_timeout,
+                llm_max_retries=0 if deadline is not None else 1,
+            )
         top_chunks = ranked[: run_config.final_k]
         rerank_ms = round((time.perf_counter() - rerank_started) * 1000, 2)
 
@@ -294,26 +513,69 @@ class RetrievalPipelineService:
             }
 
         generation_started = time.perf_counter()
-        system_prompt, user_prompt = build_grounded_prompt(query, top_chunks)
-        completion = self.openai_client.chat.completions.create(
-            model=self.answer_model,
-            temperature=run_config.temperature,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt},
-            ],
-        )
-        answer = (completion.choices[0].message.content or "").strip()
+        # La clave usa las entradas previas a la compresion (presupuesto y scorer van en _prompt_version):
+        # un hit no comprime de nuevo y recupera los chunks que quedaron en el prompt.
+        cache_key: str | None = None
+        cached: tuple[str, list[str] | None] | None = None
+        if self.answer_cache is not None:
+            cache_key = build_answer_cache_key(
+                query=query,
+                chunk_ids=[chunk.chunk_id for chunk in top_chunks],
+                model=self.answer_model,
+                temperature=run_config.temperature,
+                prompt_version=self._prompt_version(),
+            )
+            try:
+                cached = self.answer_cache.get_entry(cache_key)
+            except Exception as exc:
+                logger.warning("rag_pipeline answer_cache_get_failed: %s", exc)
+
+        cache_hit = cached is not None
+        prompt_tokens: dict[str, Any] | None = None
+        if cached is not None:
+            answer, cached_chunk_ids = cached
+            used_chunks = top_chunks
+            if cached_chunk_ids is not None:
+                kept_ids = set(cached_chunk_ids)
+                used_chunks = [chunk for chunk in top_chunks if chunk.chunk_id in kept_ids]
+        else:
+            with span("prompt"):
+                system_prompt, user_prompt, prompt_tokens, used_chunks = self._build_prompt(
+                    query, top_chunks, query_embedding, deadline
+                )
+            with span("generate", model=self.answer_model):
+                completion = self._openai(deadline).chat.completions.create(
+                    model=self.answer_model,
+                    temperature=run_config.temperature,
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": user_prompt},
+                    ],
+                    **self._openai_timeout(deadline, "generate"),
+                )
+            answer = (completion.choices[0].message.content or "").strip()
+            if answer and cache_key is not None and self.answer_cache is not None:
+                try:
+                    self.answer_cache.put(cache_key, answer, used_chunk_ids=[chunk.chunk_id for chunk in used_chunks])
+                except Exception as exc:
+                    logger.warning("rag_pipeline answer_cache_put_failed: %s", exc)
         generation_ms = round((time.perf_counter() - generation_started) * 1000, 2)
         total_ms = round((time.perf_counter() - overall_started) * 1000, 2)
-        logger.info("rag_pipeline generate answer_len=%d duration_ms=%.2f total_ms=%.2f", len(answer), generation_ms, total_ms)
+        logger.info(
+            "rag_pipeline generate answer_len=%d cache_hit=%s prompt_tokens=%s duration_ms=%.2f total_ms=%.2f",
+            len(answer),
+            cache_hit,
+            prompt_tokens,
+            generation_ms,
+            total_ms,
+        )
 
         if not answer:
             answer = NO_INFO_MESSAGE
 
         answerable = not _is_no_info_answer(answer)
 
-        response = self._build_output(top_chunks, answer)
+        response = self._build_output(used_chunks, answer)
         return {
             "response": response,
             "metrics": {
@@ -321,9 +583,11 @@ class RetrievalPipelineService:
                 "thresholdTriggered": False,
                 "top1Score": best_score,
                 "top5Scores": top_scores,
-                "usedChunkIds": [chunk.chunk_id for chunk in top_chunks],
-                "usedChunksCount": len(top_chunks),
+                "usedChunkIds": [chunk.chunk_id for chunk in used_chunks],
+                "usedChunksCount": len(used_chunks),
                 "answerLength": len(answer),
+                "cacheHit": cache_hit,
+                "promptTokens": prompt_tokens,
                 "latencyMs": {
                     "embed": embed_ms,
                     "retrieval": retrieval_ms,
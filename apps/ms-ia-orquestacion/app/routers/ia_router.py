@@ -2,6 +2,8 @@ import logging
 
 from fastapi import APIRouter, HTTPException, Request
 
+from app.core.admission import OverloadedError, get_classify_executor
+from app.core.metrics import REQUESTS_IN_FLIGHT
 from app.schemas.ia_schemas import ClassifyExtractRequest, ClassifyExtractResponse
 from app.services.ia_service import get_ia_service
 
@@ -10,16 +12,31 @@ router = APIRouter()
 
 
 @router.post("/classify-extract", response_model=ClassifyExtractResponse, response_model_exclude_none=True)
-def classify_extract(body: ClassifyExtractRequest, request: Request) -> ClassifyExtractResponse:
+async def classify_extract(body: ClassifyExtractRequest, request: Request) -> ClassifyExtractResponse:
+    with REQUESTS_IN_FLIGHT.labels(endpoint="classify-extract").track_inprogress():
+        return await _classify_extract(body, request)
+
+
+async def _classify_extract(body: ClassifyExtractRequest, request: Request) -> ClassifyExtractResponse:
     request_id = getattr(request.state, "request_id", "unknown")
     logger.info("[%s] classify_extract received", request_id)
 
     try:
         service = get_ia_service()
-        result = service.classify_extract(body.text)
+        result = await get_classify_executor().run(service.classify_extract, body.text)
         return result
     except HTTPException:
         raise
+    except OverloadedError as exc:
+        raise HTTPException(
+            status_code=503,
+            detail={
+                "code": "OVERLOADED",
+                "message": "Servicio saturado, reintenta en unos segundos",
+                "detail": exc.executor,
+            },
+            headers={"Retry-After": str(exc.retry_after_s)},
+        ) from exc
     except Exception as exc:
         logger.exception("[%s] classify_extract_unhandled_error", request_id)
         raise HTTPException(
@@ -27,6 +44,6 @@ def classify_extract(body: ClassifyExtractRequest, request: Request) -> Classify
             detail={
                 "code": "INTERNAL_ERROR",
                 "message": "Error interno del servidor",
-                "details": str(exc),
+                "detail": str(exc),
             },
         ) from exc
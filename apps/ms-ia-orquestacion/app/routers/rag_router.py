@@ -1,24 +1,37 @@
 """
 Router para endpoints RAG (Retrieval Augmented Generation).
-Endpoints bajo /v1/ai: rag-ingest, rag-answer.
+Endpoints bajo /v1/ai: rag-ingest (+ estado del job), rag-answer, rag-answer-batch.
 """
 import asyncio
 import logging
 import os
+from typing import Any
 
 from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel
+
+from app.core.admission import OverloadedError
+from app.core.deadline import Deadline, RequestCancelled
+from app.core.metrics import DEPENDENCY_ERRORS, RAG_ANSWER_STATUS, REQUESTS_IN_FLIGHT
+from app.ingest.jobs import get_ingest_job_store
 
 from app.schemas.rag_schemas import (
+    RagAnswerBatchItem,
+    RagAnswerBatchRequest,
+    RagAnswerBatchResponse,
     RagAnswerRequest,
     RagAnswerResponse,
+    RagErrorDetail,
+    RagIngestJobResponse,
     RagIngestRequest,
-    RagIngestResponse,
 )
 from app.services.rag_service import get_rag_service
 from app.services.rag_service import get_runtime_env_summary
 
 logger = logging.getLogger("ms-ia-orquestacion")
 REQUEST_TIMEOUT_SECONDS = 60
+DISCONNECT_POLL_SECONDS = 0.25
 NO_INFO_ANSWER = "No tengo suficiente informacion en el documento"
 
 router = APIRouter()
@@ -53,6 +66,12 @@ def _is_openai_error(exc: Exception) -> bool:
     return "openai" in module.lower()
 
 
+def _is_qdrant_error(exc: BaseException) -> bool:
+    """Detecta si una excepcion proviene de qdrant_client (p.ej. ResponseHandlingException, UnexpectedResponse)."""
+    module = getattr(type(exc), "__module__", "")
+    return module.startswith("qdrant_client")
+
+
 def _error_payload(code: str, message: str, detail: object | None = None) -> dict:
     payload = {"code": code, "message": message}
     if detail is not None:
@@ -60,66 +79,79 @@ def _error_payload(code: str, message: str, detail: object | None = None) -> dic
     return payload
 
 
+def _overloaded_http_error(exc: OverloadedError) -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail=_error_payload("OVERLOADED", "Servicio saturado, reintenta en unos segundos", exc.executor),
+        headers={"Retry-After": str(exc.retry_after_s)},
+    )
+
+
+async def _run_unless_disconnected(request: Request, awaitable, deadline: Deadline):
+    """
+    Espera el resultado mientras el cliente siga conectado.
+    Si se desconecta, cancela el trabajo (y su deadline) y levanta RequestCancelled.
+    """
+    task = asyncio.ensure_future(awaitable)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_SECONDS)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                deadline.cancel()
+                task.cancel()
+                raise RequestCancelled("client-disconnect")
+    finally:
+        if not task.done():
+            task.cancel()
+
+
 # ---------------------------------------------------------------------------
 # POST /rag-ingest
 # ---------------------------------------------------------------------------
 
-@router.post("/rag-ingest", response_model=RagIngestResponse)
-async def rag_ingest(body: RagIngestRequest, request: Request) -> RagIngestResponse:
+@router.post("/rag-ingest", response_model=RagIngestJobResponse, status_code=202)
+async def rag_ingest(body: RagIngestRequest, request: Request) -> RagIngestJobResponse:
     """
-    Ingesta un documento al pipeline RAG.
-    Si ya existe el source, elimina chunks previos y reinserta (upsert por source).
+    Encola la ingesta de un documento y devuelve el job de inmediato (202).
+    Por defecto (mode="diff") los workers solo embeben los chunks nuevos o modificados y borran
+    los que desaparecieron; mode="replace" reinserta todo el source.
+    El avance se consulta en GET /rag-ingest/{jobId}.
     """
     request_id = getattr(request.state, "request_id", "unknown")
     correlation_id = getattr(request.state, "correlation_id", request_id)
     logger.info("[%s][corr:%s] rag_ingest source='%s'", request_id, correlation_id, body.source)
 
     try:
-        service = get_rag_service()
-        result = service.ingest(
+        job = await asyncio.to_thread(
+            get_ingest_job_store().enqueue,
             source=body.source,
             text=body.text,
             title=body.title,
             metadata=body.metadata,
+            mode=body.mode,
         )
-        return RagIngestResponse(**result)
+        return RagIngestJobResponse(**job)
 
-    except ValueError as exc:
-        logger.error("[%s] rag_ingest config_error: %s", request_id, exc)
+    except Exception as exc:
+        logger.exception("[%s] rag_ingest enqueue_failed", request_id)
         raise HTTPException(
-            status_code=400,
-            detail=_error_payload("CONFIG_ERROR", str(exc)),
+            status_code=500,
+            detail=_error_payload("INGEST_QUEUE_ERROR", "No se pudo encolar la ingesta", str(exc)),
         ) from exc
 
-    except RuntimeError as exc:
-        error_msg = str(exc)
-        logger.error("[%s] rag_ingest runtime_error: %s", request_id, error_msg)
-        if "qdrant" in error_msg.lower():
-            raise HTTPException(
-                status_code=502,
-                detail=_error_payload("QDRANT_ERROR", "Error de Qdrant", error_msg),
-            ) from exc
-        raise HTTPException(
-            status_code=502,
-            detail=_error_payload("RAG_BACKEND_ERROR", error_msg),
-        ) from exc
 
-    except Exception as exc:
-        logger.exception("[%s] rag_ingest unhandled_error", request_id)
-        if _is_openai_error(exc):
-            raise HTTPException(
-                status_code=502,
-                detail=_error_payload("OPENAI_ERROR", "Error al comunicarse con OpenAI", str(exc)),
-            ) from exc
-        if "qdrant" in str(exc).lower():
-            raise HTTPException(
-                status_code=502,
-                detail=_error_payload("QDRANT_ERROR", "Error de Qdrant", str(exc)),
-            ) from exc
+@router.get("/rag-ingest/{job_id}", response_model=RagIngestJobResponse)
+async def rag_ingest_status(job_id: str, request: Request) -> RagIngestJobResponse:
+    """Estado, avance (chunks embebidos/insertados) y error de un job de ingesta."""
+    job = await asyncio.to_thread(get_ingest_job_store().get, job_id)
+    if job is None:
         raise HTTPException(
-            status_code=500,
-            detail=_error_payload("INTERNAL_ERROR", "Error interno del servidor", str(exc)),
-        ) from exc
+            status_code=404,
+            detail=_error_payload("JOB_NOT_FOUND", f"No existe el job de ingesta '{job_id}'"),
+        )
+    return RagIngestJobResponse(**job)
 
 
 # ---------------------------------------------------------------------------
@@ -152,138 +184,263 @@ async def env_check(request: Request):
         }
 
 @router.post("/rag-answer", response_model=RagAnswerResponse)
-async def rag_answer(body: RagAnswerRequest, request: Request) -> RagAnswerResponse:
+async def rag_answer(body: RagAnswerRequest, request: Request) -> ORJSONResponse:
     """
     Pipeline RAG completo: retrieve(topK=5) -> rerank(k=5) -> generate answer.
     """
-    request_id = getattr(request.state, "request_id", "unknown")
-    correlation_id = getattr(request.state, "correlation_id", request_id)
-    resolved_query = body.query or ""
+    with REQUESTS_IN_FLIGHT.labels(endpoint="rag-answer").track_inprogress():
+        return await _rag_answer(body, request)
+
+
+def _resolve_answer_filters(body: RagAnswerRequest) -> dict[str, Any]:
     request_filters = dict(body.filters or {})
     if body.source and "source" not in request_filters:
         request_filters["source"] = body.source
     if body.tenantId and "tenantId" not in request_filters:
         request_filters["tenantId"] = body.tenantId
+    return request_filters
 
-    source_applied = request_filters.get("source")
-    tenant_applied = request_filters.get("tenantId")
-    top_k = os.getenv("RAG_CANDIDATE_TOPK", os.getenv("RAG_TOPK", "20"))
-    threshold = os.getenv("RAG_SCORE_THRESHOLD", "0.6")
 
+def _build_answer_response(
+    evaluation: dict[str, Any],
+    correlation_id: str,
+    top_k: str,
+    threshold: str,
+) -> RagAnswerResponse:
+    """
+    Calcula status/confidence a partir de las metricas del pipeline y valida la respuesta una sola vez.
+    Los textos de usedChunks se referencian tal cual desde el pipeline, sin copias intermedias.
+    """
+    response_payload = evaluation.get("response") or {}
+    metrics = evaluation.get("metrics") or {}
+    config = metrics.get("config") or {}
+
+    best_score_raw = metrics.get("top1Score")
+    best_score = float(best_score_raw) if isinstance(best_score_raw, (int, float)) else None
+    threshold_raw = config.get("threshold", threshold)
+    threshold_value = float(threshold_raw) if isinstance(threshold_raw, (int, float, str)) else 0.6
+
+    answer_text = str(response_payload.get("answer") or "")
+    answerable = metrics.get("answerable")
+    if not isinstance(answerable, bool):
+        answerable = not _is_no_info_answer(answer_text)
+
+    if best_score is None:
+        status = "no_context"
+        confidence = 0.0
+    elif not answerable:
+        status = "low_confidence"
+        confidence = min(_clamp_01(best_score), 0.49)
+    elif best_score < threshold_value or bool(metrics.get("thresholdTriggered")):
+        status = "low_confidence"
+        confidence = _clamp_01(best_score)
+    else:
+        status = "ok"
+        confidence = _clamp_01(best_score)
+
+    cache_hit = bool(metrics.get("cacheHit", False))
+    top_k_log = config.get("candidateTopK", top_k)
+    final_k_log = config.get("finalK", os.getenv("RAG_FINAL_K", "5"))
     logger.info(
-        "[rag-answer] corr=%s queryFinal=\"%s\" source=\"%s\" tenant=\"%s\" top_k=%s threshold=%s",
+        "[rag-answer] corr=%s status=%s bestScore=%s confidence=%.4f threshold=%s top_k=%s final_k=%s cache_hit=%s",
         correlation_id,
-        resolved_query[:80],
-        source_applied if source_applied is not None else "",
-        tenant_applied if tenant_applied is not None else "",
-        top_k,
-        threshold,
+        status,
+        best_score,
+        confidence,
+        threshold_value,
+        top_k_log,
+        final_k_log,
+        cache_hit,
     )
 
-    try:
-        service = get_rag_service()
-        evaluation = await asyncio.wait_for(
-            asyncio.to_thread(service.rag_evaluate, query=resolved_query, filters=(request_filters or None), dry_run=False),
-            timeout=REQUEST_TIMEOUT_SECONDS,
-        )
-        response_payload = dict(evaluation.get("response", {}))
-        metrics = dict(evaluation.get("metrics", {}))
-        config = dict(metrics.get("config", {}))
-
-        best_score_raw = metrics.get("top1Score")
-        best_score = float(best_score_raw) if isinstance(best_score_raw, (int, float)) else None
-        threshold_raw = config.get("threshold", threshold)
-        threshold_value = float(threshold_raw) if isinstance(threshold_raw, (int, float, str)) else 0.6
-
-        answer_text = str(response_payload.get("answer") or "")
-        answerable = metrics.get("answerable")
-        if not isinstance(answerable, bool):
-            answerable = not _is_no_info_answer(answer_text)
-
-        if best_score is None:
-            status = "no_context"
-            confidence = 0.0
-        elif not answerable:
-            status = "low_confidence"
-            confidence = min(_clamp_01(best_score), 0.49)
-        elif best_score < threshold_value or bool(metrics.get("thresholdTriggered")):
-            status = "low_confidence"
-            confidence = _clamp_01(best_score)
-        else:
-            status = "ok"
-            confidence = _clamp_01(best_score)
-
-        top_k_log = config.get("candidateTopK", top_k)
-        final_k_log = config.get("finalK", os.getenv("RAG_FINAL_K", "5"))
-        logger.info(
-            "[rag-answer] corr=%s status=%s bestScore=%s confidence=%.4f threshold=%s top_k=%s final_k=%s",
-            correlation_id,
-            status,
-            best_score,
-            confidence,
-            threshold_value,
-            top_k_log,
-            final_k_log,
-        )
+    RAG_ANSWER_STATUS.labels(status=status).inc()
+    return RagAnswerResponse.model_validate(
+        {
+            **response_payload,
+            "confidenceScore": confidence,
+            "bestScore": best_score,
+            "status": status,
+            "correlationId": str(correlation_id),
+            "cacheHit": cache_hit,
+        }
+    )
+
+
+def _json_response(model: BaseModel) -> ORJSONResponse:
+    """
+    Serializa con orjson un modelo ya validado. Al devolver un Response, FastAPI no vuelve a
+    validar contra response_model (que queda solo para el contrato OpenAPI).
+    """
+    return ORJSONResponse(content=model.model_dump())
+
+
+def _rag_http_error(exc: BaseException, request_id: str, operation: str) -> HTTPException:
+    """Mapea una excepcion del pipeline RAG al HTTPException que devuelve el endpoint."""
+    if isinstance(exc, OverloadedError):
+        return _overloaded_http_error(exc)
 
-        response_payload.update(
-            {
-                "confidenceScore": confidence,
-                "bestScore": best_score,
-                "status": status,
-                "correlationId": str(correlation_id),
-            }
+    if isinstance(exc, RequestCancelled):
+        logger.info("[%s] %s cancelled stage=%s", request_id, operation, exc.stage)
+        return HTTPException(
+            status_code=499,
+            detail=_error_payload("CLIENT_CLOSED_REQUEST", "El cliente cerro la conexion", exc.stage),
         )
-        return RagAnswerResponse(**response_payload)
 
-    except TimeoutError as exc:
-        logger.error("[%s] rag_answer timeout_after_%ss", request_id, REQUEST_TIMEOUT_SECONDS)
-        raise HTTPException(
+    if isinstance(exc, TimeoutError):
+        logger.error("[%s] %s timeout_after_%ss", request_id, operation, REQUEST_TIMEOUT_SECONDS)
+        return HTTPException(
             status_code=502,
             detail=_error_payload(
                 code="UPSTREAM_TIMEOUT",
                 message=f"RAG excedio el timeout de {REQUEST_TIMEOUT_SECONDS}s",
             ),
-        ) from exc
+        )
 
-    except ValueError as exc:
-        logger.error("[%s] rag_answer config_error: %s", request_id, exc)
-        raise HTTPException(
+    if _is_qdrant_error(exc):
+        # Los errores de conexion de qdrant_client ("Connection refused") no mencionan a Qdrant en el mensaje.
+        logger.error("[%s] %s qdrant_error: %s", request_id, operation, exc)
+        DEPENDENCY_ERRORS.labels(dependency="qdrant").inc()
+        return HTTPException(
+            status_code=502,
+            detail=_error_payload("QDRANT_ERROR", "Error de Qdrant", str(exc)),
+        )
+
+    if isinstance(exc, ValueError):
+        logger.error("[%s] %s config_error: %s", request_id, operation, exc)
+        return HTTPException(
             status_code=400,
             detail=_error_payload("CONFIG_ERROR", str(exc)),
-        ) from exc
+        )
 
-    except RuntimeError as exc:
+    if isinstance(exc, RuntimeError):
         error_msg = str(exc)
-        logger.error("[%s] rag_answer runtime_error: %s", request_id, error_msg)
+        logger.error("[%s] %s runtime_error: %s", request_id, operation, error_msg)
         if "qdrant" in error_msg.lower():
-            raise HTTPException(
+            DEPENDENCY_ERRORS.labels(dependency="qdrant").inc()
+            return HTTPException(
                 status_code=502,
                 detail=_error_payload("QDRANT_ERROR", "Error de Qdrant", error_msg),
-            ) from exc
+            )
         if "index" in error_msg.lower() or "collection" in error_msg.lower():
-            raise HTTPException(
+            return HTTPException(
                 status_code=400,
                 detail=_error_payload("INDEX_ERROR", error_msg),
-            ) from exc
-        raise HTTPException(
+            )
+        return HTTPException(
             status_code=502,
             detail=_error_payload("RAG_BACKEND_ERROR", error_msg),
-        ) from exc
+        )
+
+    logger.error("[%s] %s unhandled_error", request_id, operation, exc_info=exc)
+    if isinstance(exc, Exception) and _is_openai_error(exc):
+        DEPENDENCY_ERRORS.labels(dependency="openai").inc()
+        return HTTPException(
+            status_code=502,
+            detail=_error_payload("OPENAI_ERROR", "Error al comunicarse con OpenAI", str(exc)),
+        )
+    if "qdrant" in str(exc).lower():
+        DEPENDENCY_ERRORS.labels(dependency="qdrant").inc()
+        return HTTPException(
+            status_code=502,
+            detail=_error_payload("QDRANT_ERROR", "Error de Qdrant", str(exc)),
+        )
+    return HTTPException(
+        status_code=500,
+        detail=_error_payload("INTERNAL_ERROR", "Error interno del servidor", str(exc)),
+    )
+
+
+async def _rag_answer(body: RagAnswerRequest, request: Request) -> ORJSONResponse:
+    request_id = getattr(request.state, "request_id", "unknown")
+    correlation_id = getattr(request.state, "correlation_id", request_id)
+    resolved_query = body.query or ""
+    request_filters = _resolve_answer_filters(body)
+
+    source_applied = request_filters.get("source")
+    tenant_applied = request_filters.get("tenantId")
+    top_k = os.getenv("RAG_CANDIDATE_TOPK", os.getenv("RAG_TOPK", "20"))
+    threshold = os.getenv("RAG_SCORE_THRESHOLD", "0.6")
+
+    logger.info(
+        "[rag-answer] corr=%s queryFinal=\"%s\" source=\"%s\" tenant=\"%s\" top_k=%s threshold=%s",
+        correlation_id,
+        resolved_query[:80],
+        source_applied if source_applied is not None else "",
+        tenant_applied if tenant_applied is not None else "",
+        top_k,
+        threshold,
+    )
+
+    try:
+        service = get_rag_service()
+        deadline = Deadline(REQUEST_TIMEOUT_SECONDS)
+        evaluation = await _run_unless_disconnected(
+            request,
+            service.rag_evaluate_async(
+                query=resolved_query,
+                filters=(request_filters or None),
+                dry_run=False,
+                deadline=deadline,
+            ),
+            deadline,
+        )
+        return _json_response(_build_answer_response(evaluation, str(correlation_id), top_k, threshold))
 
     except Exception as exc:
-        logger.exception("[%s] rag_answer unhandled_error", request_id)
-        if _is_openai_error(exc):
-            raise HTTPException(
-                status_code=502,
-                detail=_error_payload("OPENAI_ERROR", "Error al comunicarse con OpenAI", str(exc)),
-            ) from exc
-        if "qdrant" in str(exc).lower():
-            raise HTTPException(
-                status_code=502,
-                detail=_error_payload("QDRANT_ERROR", "Error de Qdrant", str(exc)),
-            ) from exc
-        raise HTTPException(
-            status_code=500,
-            detail=_error_payload("INTERNAL_ERROR", "Error interno del servidor", str(exc)),
-        ) from exc
+        raise _rag_http_error(exc, request_id, "rag_answer") from exc
+
+
+# ---------------------------------------------------------------------------
+# POST /rag-answer-batch
+# ---------------------------------------------------------------------------
+
+@router.post("/rag-answer-batch", response_model=RagAnswerBatchResponse)
+async def rag_answer_batch(body: RagAnswerBatchRequest, request: Request) -> ORJSONResponse:
+    """
+    Varias preguntas en un request: un embedding y una busqueda en Qdrant para todo el batch,
+    generacion concurrente acotada y un resultado o error por item, en el orden recibido.
+    """
+    with REQUESTS_IN_FLIGHT.labels(endpoint="rag-answer-batch").track_inprogress():
+        return await _rag_answer_batch(body, request)
+
+
+async def _rag_answer_batch(body: RagAnswerBatchRequest, request: Request) -> ORJSONResponse:
+    request_id = getattr(request.state, "request_id", "unknown")
+    correlation_id = str(getattr(request.state, "correlation_id", request_id))
+    top_k = os.getenv("RAG_CANDIDATE_TOPK", os.getenv("RAG_TOPK", "20"))
+    threshold = os.getenv("RAG_SCORE_THRESHOLD", "0.6")
+    items = [(item.query or "", _resolve_answer_filters(item) or None) for item in body.items]
+    logger.info("[rag-answer-batch] corr=%s items=%d", correlation_id, len(items))
+
+    try:
+        service = get_rag_service()
+        deadline = Deadline(REQUEST_TIMEOUT_SECONDS)
+        outcomes = await _run_unless_disconnected(
+            request,
+            service.rag_evaluate_batch_async(items, deadline=deadline),
+            deadline,
+        )
+    except Exception as exc:
+        raise _rag_http_error(exc, request_id, "rag_answer_batch") from exc
+
+    results: list[RagAnswerBatchItem] = []
+    for index, outcome in enumerate(outcomes):
+        if isinstance(outcome, BaseException):
+            http_error = _rag_http_error(outcome, request_id, f"rag_answer_batch[{index}]")
+            results.append(
+                RagAnswerBatchItem(
+                    index=index,
+                    error=RagErrorDetail(statusCode=http_error.status_code, **http_error.detail),
+                )
+            )
+            continue
+        results.append(
+            RagAnswerBatchItem(
+                index=index,
+                result=_build_answer_response(outcome, correlation_id, top_k, threshold),
+            )
+        )
+
+    failed = sum(1 for item in results if item.error is not None)
+    logger.info("[rag-answer-batch] corr=%s items=%d failed=%d", correlation_id, len(results), failed)
+    return _json_response(RagAnswerBatchResponse(items=results, correlationId=correlation_id))
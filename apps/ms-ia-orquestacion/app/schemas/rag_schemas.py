@@ -16,17 +16,50 @@ class RagIngestRequest(BaseModel):
     title: Optional[str] = Field(default=None, description="Titulo opcional del documento")
     text: str = Field(..., min_length=1, description="Texto completo del documento")
     metadata: Optional[dict[str, Any]] = Field(default=None, description="Metadata adicional")
+    mode: Literal["diff", "replace"] = Field(
+        default="diff",
+        description="diff: solo embebe chunks nuevos/modificados; replace: reinserta todo el source",
+    )
 
     model_config = ConfigDict(extra="forbid")
 
 
 class RagIngestResponse(BaseModel):
-    """Respuesta del POST /v1/ai/rag-ingest."""
+    """Resultado de la ingesta de un documento."""
 
     source: str
     title: Optional[str] = None
     chunks_deleted: int
     chunks_inserted: int
+    chunks_added: int = 0
+    chunks_unchanged: int = 0
+    chunks_removed: int = 0
+    stageMs: dict[str, float] = Field(default_factory=dict, description="Tiempo por etapa: chunk, embed, upsert")
+
+
+class RagIngestProgress(BaseModel):
+    """Contadores de avance de un job de ingesta."""
+
+    chunksTotal: int = 0
+    chunksDeleted: int = 0
+    chunksEmbedded: int = 0
+    chunksUpserted: int = 0
+
+
+class RagIngestJobResponse(BaseModel):
+    """Estado de un job de ingesta (POST /rag-ingest y GET /rag-ingest/{jobId})."""
+
+    jobId: str
+    status: Literal["queued", "running", "succeeded", "failed"]
+    source: str
+    title: Optional[str] = None
+    progress: RagIngestProgress = Field(default_factory=RagIngestProgress)
+    result: Optional[RagIngestResponse] = None
+    error: Optional[str] = None
+    attempts: int = 0
+    createdAt: Optional[str] = None
+    startedAt: Optional[str] = None
+    finishedAt: Optional[str] = None
 
 
 # ── RAG Answer ────────────────────────────────────────────────────────────
@@ -79,3 +112,39 @@ class RagAnswerResponse(BaseModel):
     bestScore: Optional[float] = None
     status: Literal["ok", "low_confidence", "no_context"] = "no_context"
     correlationId: Optional[str] = None
+    cacheHit: bool = False
+
+
+# ── RAG Answer Batch ──────────────────────────────────────────────────────
+
+
+class RagAnswerBatchRequest(BaseModel):
+    """Body del POST /v1/ai/rag-answer-batch. Cada item acepta los mismos campos que rag-answer."""
+
+    items: list[RagAnswerRequest] = Field(..., min_length=1, max_length=50)
+
+    model_config = ConfigDict(extra="forbid")
+
+
+class RagErrorDetail(BaseModel):
+    """Error de un item del batch, con el mismo formato que el error HTTP de rag-answer."""
+
+    statusCode: int
+    code: str
+    message: str
+    detail: Optional[Any] = None
+
+
+class RagAnswerBatchItem(BaseModel):
+    """Resultado de un item: result si tuvo exito, error si fallo."""
+
+    index: int
+    result: Optional[RagAnswerResponse] = None
+    error: Optional[RagErrorDetail] = None
+
+
+class RagAnswerBatchResponse(BaseModel):
+    """Respuesta del POST /v1/ai/rag-answer-batch. items respeta el orden del request."""
+
+    items: list[RagAnswerBatchItem]
+    correlationId: Optional[str] = None
@@ -0,0 +1,179 @@
+from __future__ import annotations
+
+import argparse
+import gc
+import json
+import math
+import random
+import time
+import tracemalloc
+from dataclasses import dataclass
+from typing import Any, Callable
+
+from qdrant_client import models
+
+from app.rag.reranker import rerank_cosine
+from app.rag.retriever import _to_candidates
+
+
+@dataclass
+class _LegacyCandidate:
+    chunk_id: str
+    source: str
+    version: str
+    title: str
+    chunk_index: int
+    text: str
+    metadata: dict[str, Any]
+    mongo_score: float
+    embedding: list[float] | None
+    page_start: int | None
+    page_end: int | None
+    rerank_score: float | None = None
+
+
+def _legacy_to_candidates(points: list[Any]) -> list[_LegacyCandidate]:
+    """Conversion previa: dict(payload), dict(metadata) y la lista de floats de cada punto."""
+    candidates = []
+    for doc in points:
+        payload = dict(doc.payload or {})
+        vector = doc.vector if isinstance(doc.vector, list) else None
+        candidates.append(
+            _LegacyCandidate(
+                chunk_id=str(doc.id),
+                source=str(payload.get("source") or ""),
+                version=str(payload.get("version") or ""),
+                title=str(payload.get("title") or ""),
+                chunk_index=int(payload.get("chunkIndex") or 0),
+                text=str(payload.get("chunkText") or ""),
+                metadata=dict(payload.get("metadata") or {}),
+                mongo_score=float(doc.score or 0.0),
+                embedding=vector,
+                page_start=payload.get("pageStart"),
+                page_end=payload.get("pageEnd"),
+            )
+        )
+    return candidates
+
+
+def _legacy_rerank(query: list[float], candidates: list[_LegacyCandidate]) -> list[_LegacyCandidate]:
+    for candidate in candidates:
+        vector = candidate.embedding or []
+        dot = sum(x * y for x, y in zip(query, vector))
+        norm = math.sqrt(sum(x * x for x in query)) * math.sqrt(sum(y * y for y in vector))
+        cosine = dot / norm if norm else candidate.mongo_score
+        candidate.rerank_score = 0.7 * candidate.mongo_score + 0.3 * cosine
+    return sorted(candidates, key=lambda c: c.rerank_score or 0.0, reverse=True)
+
+
+def _fake_points(count: int, dim: int, seed: int) -> list[models.ScoredPoint]:
+    rng = random.Random(seed)
+    return [
+        models.ScoredPoint(
+            id=idx,
+            version=0,
+            score=rng.random(),
+            payload={
+                "source": "consultorio_juridico",
+                "version": "v1",
+                "title": "Codigo Sustantivo del Trabajo",
+                "chunkIndex": idx,
+                "chunkText": "Texto del fragmento " * 40,
+                "metadata": {"version": "v1", "pageStart": 1, "pageEnd": 2, "docName": "cst.pdf"},
+                "pageStart": 1,
+                "pageEnd": 2,
+            },
+            vector=[rng.uniform(-1.0, 1.0) for _ in range(dim)],
+        )
+        for idx in range(count)
+    ]
+
+
+def _measure_memory(build: Callable[[], list[Any]], convert: Callable[[list[Any]], list[Any]]) -> dict[str, Any]:
+    """
+    Memoria por request: desde que llega la respuesta de Qdrant (build) hasta que se libera y solo
+    quedan los candidatos. peak incluye la respuesta; retained es lo que sobrevive al request.
+    """
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    points = build()
+    candidates = convert(points)
+    del points
+    gc.collect()
+    after = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    stats = after.compare_to(before, "filename")
+    retained_bytes = sum(stat.size_diff for stat in stats if stat.size_diff > 0)
+    retained_blocks = sum(stat.count_diff for stat in stats if stat.count_diff > 0)
+    del candidates
+    return {
+        "peakKiB": round(peak / 1024, 1),
+        "retainedKiB": round(retained_bytes / 1024, 1),
+        "retainedBlocks": retained_blocks,
+    }
+
+
+def _measure_allocations(run: Callable[[], Any]) -> int:
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    result = run()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    del result
+    return sum(stat.count_diff for stat in after.compare_to(before, "filename") if stat.count_diff > 0)
+
+
+def _time_us(run: Callable[[], Any], iterations: int) -> float:
+    started = time.perf_counter()
+    for _ in range(iterations):
+        run()
+    return round((time.perf_counter() - started) / iterations * 1_000_000, 1)
+
+
+def _build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Memoria y asignaciones de ChunkCandidate por request")
+    parser.add_argument("--candidates", type=int, default=30)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--iterations", type=int, default=200)
+    return parser
+
+
+def main() -> int:
+    args = _build_parser().parse_args()
+    build = lambda: _fake_points(args.candidates, args.dim, seed=7)  # noqa: E731
+    points = build()
+    query = [random.Random(11).uniform(-1.0, 1.0) for _ in range(args.dim)]
+
+    legacy_candidates = _legacy_to_candidates(points)
+    compact_candidates = _to_candidates(points, include_embedding=True)
+    legacy_order = [c.chunk_id for c in _legacy_rerank(query, legacy_candidates)]
+    compact_order = [c.chunk_id for c in rerank_cosine(query, compact_candidates)]
+    if legacy_order != compact_order:
+        raise AssertionError("rerank_cosine vectorizado no reproduce el orden previo")
+
+    report = {
+        "candidates": args.candidates,
+        "dim": args.dim,
+        "legacy": {
+            **_measure_memory(build, _legacy_to_candidates),
+            "rerankAllocations": _measure_allocations(lambda: _legacy_rerank(query, legacy_candidates)),
+            "convertUs": _time_us(lambda: _legacy_to_candidates(points), args.iterations),
+            "rerankUs": _time_us(lambda: _legacy_rerank(query, legacy_candidates), args.iterations),
+        },
+        "compact": {
+            **_measure_memory(build, lambda pts: _to_candidates(pts, include_embedding=True)),
+            "rerankAllocations": _measure_allocations(lambda: rerank_cosine(query, compact_candidates)),
+            "convertUs": _time_us(lambda: _to_candidates(points, include_embedding=True), args.iterations),
+            "rerankUs": _time_us(lambda: rerank_cosine(query, compact_candidates), args.iterations),
+        },
+    }
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
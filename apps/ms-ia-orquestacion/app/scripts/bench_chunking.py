@@ -0,0 +1,160 @@
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import re
+import time
+import tracemalloc
+from typing import Any, Callable
+
+from app.ingest.chunking import chunk_text, iter_page_chunks, normalize_text
+from app.ingest.pdf_loader import PageText, flatten_pages
+
+
+_WORDS = (
+    "el trabajador tiene derecho a vacaciones remuneradas segun el articulo del codigo sustantivo "
+    "contrato salario jornada empleador prestaciones cesantias indemnizacion despido justa causa"
+).split()
+
+
+def _legacy_infer_page_range(spans: list[tuple[int, int, int]], start: int, end: int) -> tuple[int | None, int | None]:
+    pages = [page for page, p_start, p_end in spans if p_start < end and start < p_end]
+    if not pages:
+        return None, None
+    return min(pages), max(pages)
+
+
+def _legacy_find_split_point(text: str, start: int, target_end: int, hard_end: int) -> int:
+    window = text[start:hard_end]
+    sentence_breaks = [m.start() for m in re.finditer(r"[\.!?]\s", window)]
+    line_breaks = [m.start() for m in re.finditer(r"\n", window)]
+    spaces = [m.start() for m in re.finditer(r"\s", window)]
+
+    candidates = sentence_breaks or line_breaks or spaces
+    if not candidates:
+        return hard_end
+    near = [start + c + 1 for c in candidates if start + 1 <= start + c + 1 <= hard_end]
+    if not near:
+        return hard_end
+    return min(near, key=lambda c: abs(c - target_end))
+
+
+def _legacy_chunk_text(
+    text: str,
+    page_spans: list[tuple[int, int, int]],
+    chunk_size: int,
+    overlap: int,
+    min_chunk_size: int,
+) -> list[dict[str, Any]]:
+    """
+    Chunker previo: tres regex por ventana, paginas por barrido lineal, normalize_text por chunk
+    y copia propia de text y normalized_text en cada chunk.
+    """
+    normalized = normalize_text(text)
+    chunks: list[dict[str, Any]] = []
+    start = 0
+    text_len = len(normalized)
+    while start < text_len:
+        target_end = min(start + chunk_size, text_len)
+        hard_end = min(start + int(chunk_size * 1.15), text_len)
+        end = _legacy_find_split_point(normalized, start, target_end, hard_end)
+        if end <= start:
+            end = min(start + chunk_size, text_len)
+        raw = normalized[start:end].strip()
+        if len(raw) < min_chunk_size and end < text_len:
+            end = min(text_len, start + chunk_size)
+            raw = normalized[start:end].strip()
+        if raw:
+            page_start, page_end = _legacy_infer_page_range(page_spans, start, end)
+            chunks.append(
+                {
+                    "text": raw,
+                    "normalized": normalize_text(raw),
+                    "start": start,
+                    "end": end,
+                    "pageStart": page_start,
+                    "pageEnd": page_end,
+                }
+            )
+        if end >= text_len:
+            break
+        start = max(start + 1, end - overlap)
+    return chunks
+
+
+def _synthetic_pages(count: int, seed: int) -> list[PageText]:
+    rng = random.Random(seed)
+    pages = []
+    for page in range(1, count + 1):
+        lines = []
+        for _ in range(rng.randint(25, 40)):
+            sentence = " ".join(rng.choice(_WORDS) for _ in range(rng.randint(6, 14)))
+            lines.append(sentence.capitalize() + rng.choice([".", ".", ",", ";", "?", ":"]))
+        pages.append(PageText(page=page, text="\n".join(lines)))
+    return pages
+
+
+def _time_ms(run: Callable[[], Any], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - started)
+    return round(best * 1000, 1)
+
+
+def _retained_kib(build: Callable[[], Any]) -> float:
+    """Memoria que siguen ocupando los chunks construidos (el texto de entrada ya estaba asignado)."""
+    tracemalloc.start()
+    chunks = build()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del chunks
+    return round(current / 1024, 1)
+
+
+def _build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Chunker previo vs lineal sobre un documento sintetico")
+    parser.add_argument("--pages", type=int, default=1000)
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--overlap", type=int, default=150)
+    parser.add_argument("--min-chunk-size", type=int, default=300)
+    parser.add_argument("--repeat", type=int, default=3)
+    return parser
+
+
+def main() -> int:
+    args = _build_parser().parse_args()
+    pages = _synthetic_pages(args.pages, seed=7)
+    full_text, spans = flatten_pages(pages)
+    params = (args.chunk_size, args.overlap, args.min_chunk_size)
+
+    legacy = _legacy_chunk_text(full_text, spans, *params)
+    linear = chunk_text(full_text, spans, *params)
+    expected = [(c["text"], c["start"], c["end"], c["pageStart"], c["pageEnd"]) for c in legacy]
+    if expected != [(c.text, c.start_char, c.end_char, c.page_start, c.page_end) for c in linear]:
+        raise AssertionError("el chunker lineal no reproduce los cortes del chunker previo")
+    streamed = [c.text for c in iter_page_chunks(pages, *params)]
+    if streamed != [c.text for c in linear]:
+        raise AssertionError("iter_page_chunks no reproduce los cortes de chunk_text")
+
+    legacy_ms = _time_ms(lambda: _legacy_chunk_text(full_text, spans, *params), args.repeat)
+    linear_ms = _time_ms(lambda: chunk_text(full_text, spans, *params), args.repeat)
+    report = {
+        "pages": args.pages,
+        "chars": len(full_text),
+        "chunks": len(linear),
+        "legacyMs": legacy_ms,
+        "linearMs": linear_ms,
+        "streamingMs": _time_ms(lambda: sum(1 for _ in iter_page_chunks(pages, *params)), args.repeat),
+        "speedup": round(legacy_ms / max(linear_ms, 0.001), 2),
+        "legacyRetainedKiB": _retained_kib(lambda: _legacy_chunk_text(full_text, spans, *params)),
+        "linearRetainedKiB": _retained_kib(lambda: chunk_text(full_text, spans, *params)),
+    }
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
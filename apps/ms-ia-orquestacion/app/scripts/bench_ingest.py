@@ -0,0 +1,212 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from pathlib import Path
+from statistics import median
+from typing import Any, Callable
+
+from app.scripts.benchkit import LocalEmbedder, SerializedQdrantClient, run_metadata, synthetic_lines
+
+
+def _synthetic_pdf(path: Path, pages: int, seed: int) -> None:
+    """PDF minimo (Helvetica, un stream por pagina) con header y footer repetidos, como los documentos reales."""
+    rng = random.Random(seed)
+    streams = []
+    for page in range(1, pages + 1):
+        lines = ["MINISTERIO DEL TRABAJO - CODIGO SUSTANTIVO DEL TRABAJO"]
+        lines.extend(synthetic_lines(rng, rng.randint(40, 55)))
+        lines.extend([f"Pagina {page}", "Documento oficial de consulta"])
+        ops = ["BT /F1 8 Tf 30 820 Td 10 TL"] + [f"({line}) Tj T*" for line in lines] + ["ET"]
+        streams.append("\n".join(ops).encode("latin-1"))
+
+    out = [b"%PDF-1.4\n"]
+    offsets: list[int] = []
+
+    def add(body: bytes) -> None:
+        offsets.append(sum(len(part) for part in out))
+        out.append(f"{len(offsets)} 0 obj\n".encode() + body + b"\nendobj\n")
+
+    kids = " ".join(f"{4 + 2 * idx} 0 R" for idx in range(pages))
+    add(b"<< /Type /Catalog /Pages 2 0 R >>")
+    add(f"<< /Type /Pages /Kids [{kids}] /Count {pages} >>".encode())
+    add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    for idx, stream in enumerate(streams):
+        add(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Resources << /Font << /F1 3 0 R >> >> "
+            f"/Contents {5 + 2 * idx} 0 R >>".encode()
+        )
+        add(f"<< /Length {len(stream)} >>\nstream\n".encode() + stream + b"\nendstream")
+    xref = sum(len(part) for part in out)
+    out.append(f"xref\n0 {len(offsets) + 1}\n0000000000 65535 f \n".encode())
+    out.extend(f"{offset:010d} 00000 n \n".encode() for offset in offsets)
+    out.append(f"trailer\n<< /Size {len(offsets) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode())
+    path.write_bytes(b"".join(out))
+
+
+def _fresh_collection(qdrant_path: str | None, dim: int, name: str) -> Any:
+    from qdrant_client import QdrantClient, models
+
+    client = QdrantClient(path=qdrant_path) if qdrant_path else QdrantClient(":memory:")
+    if client.collection_exists(name):
+        client.delete_collection(name)
+    client.create_collection(name, vectors_config=models.VectorParams(size=dim, distance=models.Distance.COSINE))
+    return SerializedQdrantClient(client)
+
+
+def _bench_pdf(files: list[str], args: argparse.Namespace, dim: int) -> dict[str, Any]:
+    from app.ingest.ingest_service import PDFIngestService, build_ingest_options
+
+    embedder = LocalEmbedder(dim, args.embed_latency_ms / 1000)
+    client = _fresh_collection(args.qdrant_path, dim, "bench_pdf")
+    service = PDFIngestService(collection_name="bench_pdf", client=client, embedder=embedder)
+    started = time.perf_counter()
+    reports = [
+        service.ingest_pdf(
+            build_ingest_options(
+                file_path=path,
+                doc_id=None,
+                source="bench",
+                chunk_size=args.chunk_size,
+                overlap=args.overlap,
+                batch_size=args.batch_size,
+                dry_run=False,
+                version=None,
+                replace_source=False,
+                extract_workers=args.workers,
+                use_pdf_cache=False,
+                dedup=not args.no_dedup,
+            )
+        ).to_dict()
+        for path in files
+    ]
+    duration_s = time.perf_counter() - started
+    pages = sum(report["totalPages"] for report in reports)
+    chunks = sum(report["totalChunks"] for report in reports)
+    stage_ms = {stage: round(sum(report["stageMs"][stage] for report in reports), 1) for stage in reports[0]["stageMs"]}
+    return {
+        "durationMs": round(duration_s * 1000, 1),
+        "pages": pages,
+        "chunks": chunks,
+        "inserted": sum(report["inserted"] for report in reports),
+        "nearDuplicates": sum(report["nearDuplicates"] for report in reports),
+        "pagesPerSecond": round(pages / duration_s, 2),
+        "chunksPerSecond": round(chunks / duration_s, 2),
+        "stageMs": stage_ms,
+        "embedRequests": embedder.requests,
+        "processPeakRssMb": max((report["processPeakRssMb"] or 0.0) for report in reports) or None,
+        "maxRssDeltaMb": max((report["rssDeltaMb"] for report in reports if report["rssDeltaMb"] is not None), default=None),
+    }
+
+
+def _bench_text(files: list[str], args: argparse.Namespace, dim: int) -> dict[str, Any]:
+    from app.ingest.pdf_loader import flatten_pages, load_pdf_pages
+    from app.ingest.ingest_service import current_rss_mb, process_peak_rss_mb
+    from app.services.rag_service import RAGService
+
+    texts = [flatten_pages(load_pdf_pages(path))[0] for path in files]
+    embedder = LocalEmbedder(dim, args.embed_latency_ms / 1000)
+    client = _fresh_collection(args.qdrant_path, dim, "bench_text")
+    service = RAGService(openai_client=embedder, qdrant_client=client, collection_name="bench_text")
+
+    started = time.perf_counter()
+    results = []
+    rss_deltas = []
+    for idx, text in enumerate(texts):
+        rss_before = current_rss_mb()
+        results.append(service.ingest(source=f"bench-{idx}", text=text, title=Path(files[idx]).stem))
+        rss_after = current_rss_mb()
+        if rss_before is not None and rss_after is not None:
+            rss_deltas.append(round(rss_after - rss_before, 1))
+    duration_s = time.perf_counter() - started
+    chunks = sum(int(result["chunks_added"]) + int(result["chunks_unchanged"]) for result in results)
+    stage_ms = {stage: round(sum(result["stageMs"][stage] for result in results), 1) for stage in results[0]["stageMs"]}
+    return {
+        "durationMs": round(duration_s * 1000, 1),
+        "chars": sum(len(text) for text in texts),
+        "chunks": chunks,
+        "chunksPerSecond": round(chunks / duration_s, 2),
+        "charsPerSecond": round(sum(len(text) for text in texts) / duration_s, 1),
+        "stageMs": stage_ms,
+        "embedRequests": embedder.requests,
+        "processPeakRssMb": process_peak_rss_mb(),
+        "maxRssDeltaMb": max(rss_deltas, default=None),
+    }
+
+
+def _best_of(run: Callable[[], dict[str, Any]], repeat: int) -> dict[str, Any]:
+    """Corrida de menor duracion (como _time_ms en bench_chunking) y la mediana para ver la dispersion."""
+    runs = [run() for _ in range(max(1, repeat))]
+    best = min(runs, key=lambda item: item["durationMs"])
+    return {**best, "medianDurationMs": round(median(item["durationMs"] for item in runs), 1), "runs": len(runs)}
+
+
+def _build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Throughput de ingesta offline: embedder determinista y Qdrant local")
+    parser.add_argument("--file", action="append", default=[], help="PDF a usar (repetible); sin --file genera PDFs sinteticos")
+    parser.add_argument("--docs", type=int, default=3, help="PDFs sinteticos")
+    parser.add_argument("--pages", type=int, default=60, help="Paginas por PDF sintetico")
+    parser.add_argument("--chunk-size", type=int, default=None)
+    parser.add_argument("--overlap", type=int, default=None)
+    parser.add_argument("--batch-size", type=int, default=None)
+    parser.add_argument("--workers", type=int, default=None, help="Procesos de extraccion (default RAG_INGEST_PDF_WORKERS)")
+    parser.add_argument("--dim", type=int, default=None, help="Dimension de los embeddings (default RAG_EMBED_DIM)")
+    parser.add_argument("--embed-latency-ms", type=float, default=0.0, help="Latencia simulada por request de embeddings")
+    parser.add_argument("--qdrant-path", type=str, default=None, help="Qdrant local en disco; por defecto en memoria")
+    parser.add_argument("--no-dedup", action="store_true")
+    parser.add_argument("--skip-text", action="store_true", help="Solo mide PDFIngestService")
+    parser.add_argument("--repeat", type=int, default=1)
+    return parser
+
+
+def main() -> int:
+    args = _build_parser().parse_args()
+    # Antes de cargar settings: el benchmark no debe invalidar la cache de respuestas real.
+    os.environ["RAG_ANSWER_CACHE_ENABLED"] = "false"
+    if args.dim:
+        os.environ["RAG_EMBED_DIM"] = str(args.dim)
+    from app.core.config import get_settings
+    from app.core.logger import configure_logging
+
+    configure_logging()
+    settings = get_settings()
+    dim = settings.embedding_dimensions
+
+    with tempfile.TemporaryDirectory(prefix="bench_ingest_") as scratch:
+        files = [str(Path(path).resolve()) for path in args.file]
+        if not files:
+            for idx in range(args.docs):
+                path = Path(scratch) / f"synthetic_{idx}.pdf"
+                _synthetic_pdf(path, args.pages, seed=idx)
+                files.append(str(path))
+
+        report: dict[str, Any] = {
+            **run_metadata(),
+            "files": len(files),
+            "mb": round(sum(os.path.getsize(path) for path in files) / (1024 * 1024), 3),
+            "config": {
+                "dim": dim,
+                "chunkSize": args.chunk_size or settings.chunk_size,
+                "overlap": args.overlap or settings.chunk_overlap,
+                "batchSize": args.batch_size or settings.embedding_batch_size,
+                "extractWorkers": args.workers or settings.ingest_pdf_workers,
+                "queueSize": settings.ingest_queue_size,
+                "upsertInFlight": settings.ingest_upsert_in_flight,
+                "dedup": not args.no_dedup and settings.ingest_dedup_enabled,
+                "embedLatencyMs": args.embed_latency_ms,
+                "qdrant": args.qdrant_path or ":memory:",
+            },
+            "pdfIngest": _best_of(lambda: _bench_pdf(files, args, dim), args.repeat),
+        }
+        if not args.skip_text:
+            report["textIngest"] = _best_of(lambda: _bench_text(files, args, dim), args.repeat)
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
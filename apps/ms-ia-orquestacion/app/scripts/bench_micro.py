@@ -0,0 +1,293 @@
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import timeit
+import tracemalloc
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable
+
+import numpy as np
+
+from app.scripts.benchkit import run_metadata, synthetic_lines
+
+
+_DEFAULT_BASELINE = Path(__file__).resolve().parents[1] / "data" / "bench" / "microbench_baseline.json"
+_QUESTIONS = Path(__file__).resolve().parents[1] / "data" / "evals" / "questions.json"
+# Holguras absolutas: por debajo de esto la diferencia es ruido de medicion.
+_MIN_TIME_DELTA_US = 2.0
+_MIN_PEAK_DELTA_KIB = 4.0
+_MIN_BLOCKS_DELTA = 16
+# Con menos rondas el mejor tiempo todavia refleja ruido de la maquina y el gate daria falsos positivos.
+_MIN_GATE_REPEAT = 5
+
+
+@dataclass(frozen=True)
+class Case:
+    name: str
+    # Argumento de la funcion medida: se construye una vez, fuera de la medicion.
+    build_input: Callable[[], Any]
+    run: Callable[[Any], Any]
+
+
+def _pages(count: int, seed: int) -> list[Any]:
+    from app.ingest.pdf_loader import PageText
+
+    rng = random.Random(seed)
+    return [PageText(page=page, text="\n".join(synthetic_lines(rng, 45))) for page in range(1, count + 1)]
+
+
+def _raw_page(seed: int) -> str:
+    """Texto como lo devuelve pypdf: CRLF, cortes con guion y espacios repetidos."""
+    rng = random.Random(seed)
+    lines = []
+    for line in synthetic_lines(rng, 45):
+        words = line.split(" ")
+        cut = rng.randrange(len(words))
+        words[cut] = words[cut][: len(words[cut]) // 2] + "-\r\n" + words[cut][len(words[cut]) // 2:]
+        lines.append("  ".join(words) + rng.choice(["", "   ", "\t"]))
+    return "\r\n".join(lines + ["", "   "])
+
+
+def _chunk_input() -> tuple[str, list[tuple[int, int, int]]]:
+    from app.ingest.pdf_loader import flatten_pages
+
+    return flatten_pages(_pages(200, seed=1))
+
+
+def _candidates(count: int, dim: int) -> tuple[np.ndarray, list[Any]]:
+    from app.rag.retriever import ChunkCandidate
+
+    rng = np.random.default_rng(3)
+    # Como el retrieval: una matriz float32 compartida y una vista por candidato.
+    matrix = rng.standard_normal((count, dim), dtype=np.float32)
+    texts = synthetic_lines(random.Random(3), count * 8)
+    candidates = [
+        ChunkCandidate(
+            chunk_id=f"c{idx}",
+            source="codigo_sustantivo",
+            version="v1",
+            title="Codigo Sustantivo del Trabajo",
+            chunk_index=idx,
+            text=" ".join(texts[idx * 8: idx * 8 + 8]),
+            metadata={},
+            mongo_score=float(rng.uniform(0.5, 0.9)),
+            embedding=matrix[idx],
+            page_start=idx + 1,
+            page_end=idx + 2,
+        )
+        for idx in range(count)
+    ]
+    return rng.standard_normal(dim, dtype=np.float32).tolist(), candidates
+
+
+def _messages() -> list[str]:
+    questions = json.loads(_QUESTIONS.read_text(encoding="utf-8"))
+    extra = [
+        "Hola, tengo 29 anos y vivo en Bogota, busco trabajo",
+        "Tengo un problema con la app, me sale error al pagar en Medellin",
+        "Quiero volver al menu principal",
+        "Me despidieron en Cali despues de 12 anos de empleo",
+    ]
+    return [str(item) for item in questions] + extra
+
+
+def _cases() -> list[Case]:
+    from app.ingest.chunking import chunk_text, normalize_text
+    from app.ingest.pdf_loader import _clean_page_text
+    from app.rag.prompting import build_grounded_prompt
+    from app.rag.reranker import rerank_cosine
+    from app.rag.service import _build_retrieval_filters
+    from app.services.ia_service import _detect_intent_rule, _extract_age_rule, _extract_city_rule
+
+    return [
+        Case("chunk_text_200p", _chunk_input, lambda data: chunk_text(data[0], data[1], 1000, 150, 300)),
+        Case("normalize_text_200p", lambda: _chunk_input()[0].replace("\n", "\r\n"), normalize_text),
+        Case("clean_page_text", lambda: _raw_page(5), _clean_page_text),
+        Case("rerank_cosine_30x1536", lambda: _candidates(30, 1536), lambda data: rerank_cosine(data[0], data[1])),
+        Case(
+            "build_grounded_prompt_5",
+            lambda: _candidates(5, 8)[1],
+            lambda chunks: build_grounded_prompt("Cuantos dias de vacaciones me corresponden al ano?", chunks),
+        ),
+        Case(
+            "build_retrieval_filters",
+            lambda: {"source": "codigo_sustantivo", "tenantId": "t1", "docId": None},
+            lambda filters: _build_retrieval_filters(filters, None, None),
+        ),
+        Case(
+            "ia_rule_extractors",
+            _messages,
+            lambda messages: [
+                (_detect_intent_rule(text), _extract_age_rule(text), _extract_city_rule(text)) for text in messages
+            ],
+        ),
+    ]
+
+
+class _Calibration:
+    """Carga fija de Python puro, medida intercalada con cada caso: normaliza los tiempos entre maquinas."""
+
+    def __init__(self) -> None:
+        self.timer = timeit.Timer(self._workload)
+        self.number, _ = self.timer.autorange()
+        self.best_us = float("inf")
+
+    @staticmethod
+    def _workload() -> int:
+        words = [f"palabra{idx % 97}" for idx in range(2000)]
+        counts: dict[str, int] = {}
+        for word in words:
+            counts[word] = counts.get(word, 0) + len(word.upper())
+        return sum(counts.values())
+
+    def sample(self) -> None:
+        self.best_us = min(self.best_us, self.timer.timeit(self.number) / self.number * 1e6)
+
+
+def _time_us(fn: Callable[[], Any], repeat: int, calibration: _Calibration) -> float:
+    """
+    Mejor tiempo por llamada (us) de repeat rondas de al menos ~0.2 s (timeit.autorange).
+    Cada ronda va precedida por una de calibracion, asi ambas ven la misma carga de la maquina.
+    """
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    best = float("inf")
+    for _ in range(repeat):
+        calibration.sample()
+        best = min(best, timer.timeit(number) / number)
+    return best * 1e6
+
+
+def _allocations(fn: Callable[[], Any]) -> tuple[float, int]:
+    """Pico de memoria (KiB) durante una llamada y bloques que siguen vivos en el resultado."""
+    fn()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    tracemalloc.reset_peak()
+    result = fn()
+    _, peak = tracemalloc.get_traced_memory()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    blocks = sum(max(0, stat.count_diff) for stat in after.compare_to(before, "filename"))
+    del result
+    return round(peak / 1024, 1), blocks
+
+
+def measure(names: list[str] | None, repeat: int) -> dict[str, Any]:
+    results: dict[str, Any] = {}
+    calibration = _Calibration()
+    for case in _cases():
+        if names and case.name not in names:
+            continue
+        data = case.build_input()
+        call = lambda case=case, data=data: case.run(data)  # noqa: E731
+        peak_kib, blocks = _allocations(call)
+        results[case.name] = {"us": round(_time_us(call, repeat, calibration), 2), "peakKiB": peak_kib, "retainedBlocks": blocks}
+    return {"calibrationUs": round(calibration.best_us, 2), "cases": results}
+
+
+def compare(
+    current: dict[str, Any],
+    baseline: dict[str, Any],
+    time_tolerance: float,
+    alloc_tolerance: float,
+) -> list[dict[str, Any]]:
+    """
+    Compara cada caso con el baseline. El tiempo se normaliza por la calibracion de cada corrida;
+    peakKiB y retainedBlocks son deterministas y usan una tolerancia mas chica.
+    """
+    scale = current["calibrationUs"] / baseline["calibrationUs"]
+    rows = []
+    for name, values in current["cases"].items():
+        base = baseline["cases"].get(name)
+        if base is None:
+            rows.append({"case": name, "status": "new"})
+            continue
+        expected_us = base["us"] * scale
+        time_ratio = values["us"] / expected_us
+        regressions = []
+        if time_ratio > 1 + time_tolerance and values["us"] - expected_us > _MIN_TIME_DELTA_US:
+            regressions.append("time")
+        if values["peakKiB"] > base["peakKiB"] * (1 + alloc_tolerance) + _MIN_PEAK_DELTA_KIB:
+            regressions.append("peakKiB")
+        if values["retainedBlocks"] > base["retainedBlocks"] * (1 + alloc_tolerance) + _MIN_BLOCKS_DELTA:
+            regressions.append("retainedBlocks")
+        if regressions:
+            status = "regression"
+        elif time_ratio < 1 - time_tolerance:
+            status = "improved"
+        else:
+            status = "ok"
+        rows.append(
+            {
+                "case": name,
+                "status": status,
+                "regressions": regressions,
+                "timeRatio": round(time_ratio, 3),
+                "us": values["us"],
+                "baselineUs": base["us"],
+                "peakKiB": values["peakKiB"],
+                "baselinePeakKiB": base["peakKiB"],
+                "retainedBlocks": values["retainedBlocks"],
+                "baselineRetainedBlocks": base["retainedBlocks"],
+            }
+        )
+    return rows
+
+
+def _build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Microbenchmarks de funciones calientes con gate contra un baseline")
+    parser.add_argument("--baseline", type=str, default=str(_DEFAULT_BASELINE))
+    parser.add_argument("--update-baseline", action="store_true", help="Guarda esta corrida como baseline")
+    parser.add_argument("--case", action="append", default=None, help="Solo estos casos (repetible)")
+    parser.add_argument("--repeat", type=int, default=7, help=f"Rondas por caso (minimo {_MIN_GATE_REPEAT} con baseline)")
+    parser.add_argument("--time-tolerance", type=float, default=0.25, help="Aumento de tiempo normalizado admitido")
+    parser.add_argument("--alloc-tolerance", type=float, default=0.10, help="Aumento de memoria admitido")
+    return parser
+
+
+def main() -> int:
+    args = _build_parser().parse_args()
+    if args.repeat < _MIN_GATE_REPEAT and (args.update_baseline or Path(args.baseline).exists()):
+        raise SystemExit(f"--repeat debe ser al menos {_MIN_GATE_REPEAT} para comparar o guardar un baseline")
+    current = {**run_metadata(), **measure(args.case, args.repeat)}
+    baseline_path = Path(args.baseline)
+
+    if args.update_baseline:
+        if args.case and baseline_path.exists():
+            # Actualizacion parcial: se conservan los demas casos pero con la calibracion de esta corrida.
+            previous = json.loads(baseline_path.read_text(encoding="utf-8"))
+            if abs(previous["calibrationUs"] / current["calibrationUs"] - 1) > 0.1:
+                raise SystemExit("La calibracion difiere del baseline: actualiza todos los casos a la vez")
+            current["cases"] = {**previous["cases"], **current["cases"]}
+        baseline_path.parent.mkdir(parents=True, exist_ok=True)
+        baseline_path.write_text(json.dumps(current, indent=2) + "\n", encoding="utf-8")
+        print(json.dumps(current, indent=2))
+        return 0
+
+    if not baseline_path.exists():
+        print(json.dumps(current, indent=2))
+        print(f"Sin baseline en {baseline_path}: corre con --update-baseline para crearlo")
+        return 0
+
+    baseline = json.loads(baseline_path.read_text(encoding="utf-8"))
+    rows = compare(current, baseline, args.time_tolerance, args.alloc_tolerance)
+    report = {
+        **current,
+        "baselineCommit": baseline.get("commit"),
+        "baselineCalibrationUs": baseline["calibrationUs"],
+        "comparison": rows,
+    }
+    print(json.dumps(report, indent=2))
+    regressions = [row["case"] for row in rows if row["status"] == "regression"]
+    if regressions:
+        print(f"Regresiones: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
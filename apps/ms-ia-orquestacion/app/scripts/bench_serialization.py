@@ -0,0 +1,129 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import logging
+import time
+from statistics import median
+from typing import Any, Callable
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_model_field
+
+from app.routers.rag_router import _build_answer_response, _json_response
+from app.schemas.rag_schemas import RagAnswerResponse
+
+
+_CHUNK_TEXT = (
+    "El trabajador tiene derecho a quince dias habiles de vacaciones remuneradas por cada anio de servicio. "
+    * 12
+)[:1100]
+
+
+def _build_evaluation(final_k: int) -> dict[str, Any]:
+    """Evaluacion con la misma forma que devuelve RetrievalPipelineService.evaluate."""
+    return {
+        "response": {
+            "answer": "Segun el documento [E1], corresponden quince dias habiles de vacaciones. " * 8,
+            "citations": [{"source": "consultorio_juridico", "chunkIndex": idx} for idx in range(final_k)],
+            "usedChunks": [
+                {
+                    "source": "consultorio_juridico",
+                    "chunkIndex": idx,
+                    "chunkText": _CHUNK_TEXT,
+                    "score": 0.8123,
+                    "title": "Codigo Sustantivo del Trabajo",
+                }
+                for idx in range(final_k)
+            ],
+        },
+        "metrics": {
+            "answerable": True,
+            "thresholdTriggered": False,
+            "top1Score": 0.8123,
+            "cacheHit": False,
+            "config": {"threshold": 0.6, "candidateTopK": 30, "finalK": final_k},
+        },
+    }
+
+
+_RESPONSE_FIELD = create_model_field(name="Response_rag_answer", type_=RagAnswerResponse, mode="serialization")
+# serialize_response es async; un loop reutilizado evita medir la creacion del loop.
+_LOOP = asyncio.new_event_loop()
+
+
+def _legacy_path(evaluation: dict[str, Any]) -> bytes:
+    """Camino previo: copias de dicts, RagAnswerResponse(**payload), response_model y json."""
+    response_payload = dict(evaluation.get("response", {}))
+    metrics = dict(evaluation.get("metrics", {}))
+    response_payload.update(
+        {
+            "confidenceScore": float(metrics["top1Score"]),
+            "bestScore": float(metrics["top1Score"]),
+            "status": "ok",
+            "correlationId": "bench",
+            "cacheHit": bool(metrics.get("cacheHit", False)),
+        }
+    )
+    model = RagAnswerResponse(**response_payload)
+    content = _LOOP.run_until_complete(serialize_response(field=_RESPONSE_FIELD, response_content=model))
+    return JSONResponse(content=content).body
+
+
+def _fast_path(evaluation: dict[str, Any]) -> bytes:
+    return _json_response(_build_answer_response(evaluation, "bench", "30", "0.6")).body
+
+
+def _measure(fn: Callable[[dict[str, Any]], bytes], evaluation: dict[str, Any], iterations: int) -> dict[str, float]:
+    samples: list[float] = []
+    body = b""
+    for _ in range(iterations):
+        started = time.perf_counter()
+        body = fn(evaluation)
+        samples.append((time.perf_counter() - started) * 1_000_000)
+    return {
+        "medianUs": round(median(samples), 1),
+        "p95Us": round(sorted(samples)[int(len(samples) * 0.95) - 1], 1),
+        "bytes": len(body),
+    }
+
+
+def _build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Costo de serializacion por request de rag-answer")
+    parser.add_argument("--final-k", default="5,20", help="Valores de final_k separados por coma")
+    parser.add_argument("--iterations", type=int, default=2000)
+    return parser
+
+
+def main() -> int:
+    args = _build_parser().parse_args()
+    logging.getLogger("ms-ia-orquestacion").setLevel(logging.WARNING)
+
+    report: list[dict[str, Any]] = []
+    for raw in args.final_k.split(","):
+        final_k = int(raw.strip())
+        evaluation = _build_evaluation(final_k)
+        legacy_body = json.loads(_legacy_path(evaluation))
+        fast_body = json.loads(_fast_path(evaluation))
+        if legacy_body != fast_body:
+            raise AssertionError(f"final_k={final_k}: el camino rapido no produce el mismo JSON")
+
+        legacy = _measure(_legacy_path, evaluation, args.iterations)
+        fast = _measure(_fast_path, evaluation, args.iterations)
+        report.append(
+            {
+                "finalK": final_k,
+                "legacy": legacy,
+                "fast": fast,
+                "speedup": round(legacy["medianUs"] / max(fast["medianUs"], 0.001), 2),
+            }
+        )
+
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
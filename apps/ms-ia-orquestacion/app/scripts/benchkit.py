@@ -0,0 +1,152 @@
+"""
+Piezas comunes de los benchmarks offline: reemplazos locales de OpenAI y Qdrant y un corpus sintetico.
+"""
+from __future__ import annotations
+
+import json
+import os
+import platform
+import random
+import re
+import subprocess
+import threading
+import time
+import types
+import zlib
+from typing import Any
+
+import numpy as np
+
+
+_WORDS = (
+    "el trabajador tiene derecho a vacaciones remuneradas segun el articulo del codigo sustantivo contrato "
+    "salario jornada empleador prestaciones cesantias indemnizacion despido justa causa preaviso licencia "
+    "maternidad dotacion auxilio transporte horas extras recargo nocturno dominical festivo convencion"
+).split()
+_TOKEN_RE = re.compile(r"\w+")
+
+_CLASSIFY_OUTPUT = json.dumps(
+    {"intent": "general", "confidence": 0.8, "entities": {"city": None, "age": None}, "shouldReset": False}
+)
+_ANSWER_OUTPUT = (
+    "Segun el documento, el trabajador tiene derecho a las prestaciones indicadas en el articulo citado, "
+    "liquidadas sobre el ultimo salario devengado."
+)
+
+
+def synthetic_lines(rng: random.Random, count: int) -> list[str]:
+    """Oraciones con vocabulario laboral: comparten palabras con las preguntas de app/data/evals."""
+    return [
+        " ".join(rng.choice(_WORDS) for _ in range(rng.randint(6, 14))).capitalize() + rng.choice(".,;:.")
+        for _ in range(count)
+    ]
+
+
+def run_metadata() -> dict[str, Any]:
+    """Commit, Python y CPUs de la corrida, para comparar resultados entre maquinas y versiones."""
+    try:
+        result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5, check=True)
+        commit = result.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {"commit": commit, "python": platform.python_version(), "cpus": os.cpu_count()}
+
+
+class LocalEmbedder:
+    """
+    Embeddings deterministas sin red (hashing trick: cada palabra suma +-1 en una dimension), asi
+    textos con palabras en comun tienen similitud coseno positiva como con un modelo real.
+    Sirve de embedder de PDFIngestService y, via .embeddings.create, de cliente OpenAI.
+    latency_s (+ ruido normal de desvio jitter_s) simula el round-trip de cada request.
+    """
+
+    def __init__(self, dim: int, latency_s: float = 0.0, jitter_s: float = 0.0, seed: int = 0) -> None:
+        self.dim = dim
+        self.latency_s = latency_s
+        self.jitter_s = jitter_s
+        self.busy_s = 0.0
+        self.requests = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.embeddings = types.SimpleNamespace(create=self._create_embeddings)
+
+    def _wait(self, latency_s: float) -> None:
+        if not latency_s and not self.jitter_s:
+            return
+        with self._lock:
+            delay = latency_s + self._rng.gauss(0.0, self.jitter_s) if self.jitter_s else latency_s
+        # Bloquea el thread como el SDK sincrono de OpenAI.
+        time.sleep(max(0.0, delay))
+
+    def _vector(self, text: str) -> list[float]:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for token in _TOKEN_RE.findall(text.lower()):
+            code = zlib.crc32(token.encode("utf-8"))
+            vector[code % self.dim] += 1.0 if code & 0x80000000 else -1.0
+        norm = float(np.linalg.norm(vector))
+        if norm == 0.0:
+            vector[0] = norm = 1.0
+        return (vector / norm).tolist()
+
+    def __call__(self, texts: list[str], batch_size: int | None = None) -> list[list[float]]:
+        started = time.perf_counter()
+        self._wait(self.latency_s)
+        vectors = [self._vector(text) for text in texts]
+        with self._lock:
+            self.busy_s += time.perf_counter() - started
+            self.requests += 1
+        return vectors
+
+    def _create_embeddings(self, model: str, input: list[str], dimensions: int | None = None, **_: Any) -> Any:
+        vectors = self(input)
+        data = [types.SimpleNamespace(index=idx, embedding=vector) for idx, vector in enumerate(vectors)]
+        return types.SimpleNamespace(data=data)
+
+
+class StubOpenAI(LocalEmbedder):
+    """
+    Cliente OpenAI local: embeddings de LocalEmbedder y chat.completions con respuesta fija
+    (JSON de clasificacion si se pide response_format json_object, texto de respuesta si no).
+    """
+
+    def __init__(
+        self,
+        dim: int,
+        embed_latency_s: float = 0.0,
+        chat_latency_s: float = 0.0,
+        jitter_s: float = 0.0,
+        seed: int = 0,
+    ) -> None:
+        super().__init__(dim, latency_s=embed_latency_s, jitter_s=jitter_s, seed=seed)
+        self.chat_latency_s = chat_latency_s
+        self.chat = types.SimpleNamespace(completions=types.SimpleNamespace(create=self._create_completion))
+        self.models = types.SimpleNamespace(retrieve=lambda model, **_: types.SimpleNamespace(id=model, object="model"))
+
+    def with_options(self, **_: Any) -> StubOpenAI:
+        # Como OpenAI.with_options (timeout, max_retries): sin red no hay nada que configurar.
+        return self
+
+    def _create_completion(self, model: str, messages: list[dict[str, str]], **kwargs: Any) -> Any:
+        self._wait(self.chat_latency_s)
+        content = _CLASSIFY_OUTPUT if kwargs.get("response_format") else _ANSWER_OUTPUT
+        message = types.SimpleNamespace(role="assistant", content=content)
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(index=0, message=message, finish_reason="stop")])
+
+
+class SerializedQdrantClient:
+    """El modo local de qdrant-client no es thread-safe; los pipelines lo usan desde varios threads."""
+
+    def __init__(self, client: Any) -> None:
+        self._client = client
+        self._lock = threading.RLock()
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._client, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args: Any, **kwargs: Any) -> Any:
+            with self._lock:
+                return attr(*args, **kwargs)
+
+        return call
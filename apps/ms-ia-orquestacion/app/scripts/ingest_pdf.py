@@ -5,13 +5,18 @@ import json
 import sys
 from pathlib import Path
 
-from app.core.config import get_settings
+from app.core.config import SERVICE_ROOT, get_settings
 from app.core.logger import configure_logging, get_logger
-from app.ingest.ingest_service import PDFIngestService, build_ingest_options
+from app.ingest.bulk import common_root, ingest_many, relative_doc_id, resolve_pdf_files
+from app.ingest.ingest_service import IngestOptions, PDFIngestService, build_ingest_options
+from app.ingest.manifest import IngestManifest
+from app.ingest.reindex import reindex_collection
 
 
 logger = get_logger("ms-ia-orquestacion.ingest.cli")
 
+DEFAULT_MANIFEST_PATH = SERVICE_ROOT / ".cache" / "ingest_manifest.json"
+
 
 def _find_default_pdf() -> Path:
     service_root = Path(__file__).resolve().parents[2]
@@ -29,6 +34,10 @@ def _find_default_pdf() -> Path:
 def _build_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(description="Ingest masivo de PDF a Qdrant")
     parser.add_argument("--file", type=str, default=None, help="Ruta del PDF a ingestar")
+    parser.add_argument("--dir", type=str, default=None, help="Modo masivo: ingesta todos los PDF del directorio (recursivo)")
+    parser.add_argument("--glob", type=str, default=None, help="Modo masivo: patron glob de PDFs (admite **)")
+    parser.add_argument("--concurrency", type=int, default=2, help="Modo masivo: documentos en paralelo")
+    parser.add_argument("--manifest", type=str, default=None, help="Modo masivo: manifest JSON para reanudar")
     parser.add_argument("--doc-id", type=str, default=None, help="ID de documento")
     parser.add_argument("--source", type=str, default=None, help="Source del documento")
     parser.add_argument("--chunk-size", type=int, default=None, help="Tamano de chunk en caracteres")
@@ -37,9 +46,72 @@ def _build_parser() -> argparse.ArgumentParser:
     parser.add_argument("--version", type=str, default=None, help="Version logica del documento")
     parser.add_argument("--dry-run", action="store_true", help="No inserta en Qdrant, solo calcula reporte")
     parser.add_argument("--replace-source", action="store_true", help="Elimina docs previos del mismo source antes de ingestar")
+    parser.add_argument("--no-pdf-cache", action="store_true", help="Extrae el PDF aunque exista en la cache de texto parseado")
+    parser.add_argument("--no-dedup", action="store_true", help="No descarta chunks casi duplicados (RAG_INGEST_DEDUP_ENABLED)")
+    parser.add_argument("--workers", type=int, default=None, help="Procesos para extraer texto del PDF (default RAG_INGEST_PDF_WORKERS)")
+    parser.add_argument(
+        "--reindex",
+        action="store_true",
+        help="Modo masivo: construye una coleccion nueva, la verifica y cambia el alias QDRANT_COLLECTION",
+    )
+    parser.add_argument("--smoke-query", type=str, default=None, help="Reindex: consulta que debe devolver resultados antes del cambio")
+    parser.add_argument("--keep-previous", action="store_true", help="Reindex: no borra la coleccion previa")
     return parser
 
 
+def _run_bulk(args: argparse.Namespace) -> int:
+    if args.replace_source or args.doc_id:
+        raise ValueError("--replace-source y --doc-id aplican a un solo archivo; no se admiten con --dir/--glob")
+    if args.reindex and args.dry_run:
+        raise ValueError("--reindex no admite --dry-run")
+
+    files = resolve_pdf_files(directory=args.dir, pattern=args.glob)
+    if not files:
+        raise FileNotFoundError("No se encontraron PDFs para --dir/--glob")
+
+    root = common_root(files, args.dir)
+
+    def make_options(path: str) -> IngestOptions:
+        return build_ingest_options(
+            file_path=path,
+            doc_id=relative_doc_id(path, root),
+            source=args.source,
+            chunk_size=args.chunk_size,
+            overlap=args.overlap,
+            batch_size=args.batch_size,
+            dry_run=args.dry_run,
+            version=args.version,
+            replace_source=False,
+            extract_workers=args.workers,
+            use_pdf_cache=not args.no_pdf_cache,
+            dedup=False if args.no_dedup else None,
+        )
+
+    if args.reindex:
+        logger.info("ingest_cli_reindex files=%d concurrency=%d", len(files), args.concurrency)
+        reindex_report = reindex_collection(
+            files,
+            make_options=make_options,
+            concurrency=args.concurrency,
+            smoke_query=args.smoke_query,
+            keep_previous=args.keep_previous,
+        )
+        print(json.dumps(reindex_report.to_dict(), ensure_ascii=True, indent=2))
+        return 0
+
+    manifest = None if args.dry_run else IngestManifest(args.manifest or str(DEFAULT_MANIFEST_PATH))
+    logger.info(
+        "ingest_cli_bulk files=%d concurrency=%d manifest=%s dry_run=%s",
+        len(files),
+        args.concurrency,
+        manifest.path if manifest else None,
+        args.dry_run,
+    )
+    report = ingest_many(files, make_options=make_options, manifest=manifest, concurrency=args.concurrency)
+    print(json.dumps(report.to_dict(), ensure_ascii=True, indent=2))
+    return 1 if report.failed else 0
+
+
 def main() -> int:
     configure_logging()
     settings = get_settings()
@@ -47,6 +119,11 @@ def main() -> int:
     args = parser.parse_args()
 
     try:
+        if args.dir or args.glob:
+            return _run_bulk(args)
+        if args.reindex:
+            raise ValueError("--reindex reconstruye la coleccion completa: requiere --dir o --glob")
+
         file_path = Path(args.file) if args.file else _find_default_pdf()
         options = build_ingest_options(
             file_path=str(file_path),
@@ -58,10 +135,13 @@ def main() -> int:
             dry_run=args.dry_run,
             version=args.version,
             replace_source=args.replace_source,
+            extract_workers=args.workers,
+            use_pdf_cache=not args.no_pdf_cache,
+            dedup=False if args.no_dedup else None,
         )
 
         logger.info(
-            "ingest_cli env=%s file=%s source=%s chunk_size=%d overlap=%d batch_size=%d dry_run=%s replace_source=%s",
+            "ingest_cli env=%s file=%s source=%s chunk_size=%d overlap=%d batch_size=%d dry_run=%s replace_source=%s workers=%d",
             settings.env_path,
             options.file_path,
             options.source,
@@ -70,6 +150,7 @@ def main() -> int:
             options.batch_size,
             options.dry_run,
             options.replace_source,
+            options.extract_workers,
         )
 
         service = PDFIngestService()
@@ -0,0 +1,506 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import math
+import multiprocessing
+import os
+import random
+import socket
+import tempfile
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable
+
+import httpx
+from prometheus_client.parser import text_string_to_metric_families
+
+from app.scripts.benchkit import SerializedQdrantClient, StubOpenAI, run_metadata, synthetic_lines
+
+
+_ENDPOINTS = {
+    "rag-answer": "/v1/ai/rag-answer",
+    "classify-extract": "/v1/ai/classify-extract",
+}
+_DEFAULT_QUESTIONS = Path(__file__).resolve().parents[1] / "data" / "evals" / "questions.json"
+_COLLECTION = "loadtest"
+_STARTUP_TIMEOUT_S = 180.0
+_QUANTILES = (("p50", 0.50), ("p95", 0.95), ("p99", 0.99))
+# Histogramas del servidor que se desglosan por label (metrica -> label).
+_SERVER_HISTOGRAMS = {
+    "rag_stage_duration_seconds": "stage",
+    "rag_executor_queue_wait_seconds": "executor",
+}
+_SERVER_COUNTERS = {
+    "rag_admission_rejected_total": "executor",
+    "rag_answer_status_total": "status",
+}
+
+
+@dataclass(frozen=True)
+class _Sample:
+    endpoint: str
+    status: str
+    latency_s: float
+
+
+# ---------------------------------------------------------------------------
+# Servidor local con reemplazos (proceso aparte)
+# ---------------------------------------------------------------------------
+
+def _serve(port: int, options: dict[str, Any]) -> None:
+    """
+    Levanta la app FastAPI con uvicorn, OpenAI reemplazado por StubOpenAI y Qdrant local con un
+    corpus sintetico. Corre en un proceso propio para no compartir GIL ni event loop con el generador.
+    """
+    scratch = tempfile.mkdtemp(prefix="load_test_")
+    os.environ.update(
+        {
+            "RAG_INGEST_WORKERS": "0",
+            # El generador espera /ready: ningun paso mide el primer request en frio.
+            "RAG_WARMUP_ENABLED": "true",
+            "RAG_ANSWER_CACHE_ENABLED": "true" if options["answer_cache"] else "false",
+            "RAG_ANSWER_CACHE_PATH": str(Path(scratch) / "rag_answers.sqlite3"),
+            "RAG_INGEST_JOBS_PATH": str(Path(scratch) / "ingest_jobs.sqlite3"),
+            "RAG_SCORE_THRESHOLD": str(options["score_threshold"]),
+            "RAG_FILTER_SOURCE": "",
+            "RAG_FILTER_VERSION": "",
+            "RAG_TRACE_EXPORT_FILE": "",
+        }
+    )
+    if options["dim"]:
+        os.environ["RAG_EMBED_DIM"] = str(options["dim"])
+
+    import uvicorn
+    from qdrant_client import QdrantClient
+
+    from app.core.config import get_settings
+    from app.db.qdrant import create_rag_collection
+    from app.main import app
+    from app.services import ia_service, rag_service
+
+    stub = StubOpenAI(get_settings().embedding_dimensions, jitter_s=options["jitter_s"], seed=options["seed"])
+    qdrant = QdrantClient(path=options["qdrant_path"]) if options["qdrant_path"] else QdrantClient(":memory:")
+    client = SerializedQdrantClient(qdrant)
+    if client.collection_exists(_COLLECTION):
+        client.delete_collection(_COLLECTION)
+    create_rag_collection(client, _COLLECTION)
+
+    service = rag_service.RAGService(openai_client=stub, qdrant_client=client, collection_name=_COLLECTION)
+    rng = random.Random(options["seed"])
+    for idx in range(options["docs"]):
+        text = "\n".join(synthetic_lines(rng, options["lines_per_doc"]))
+        service.ingest(source=f"loadtest-{idx}", text=text, title=f"Documento sintetico {idx}")
+    # El corpus se embebe sin latencia; desde aca cada request paga la del modelo simulado.
+    stub.latency_s = options["embed_latency_s"]
+    stub.chat_latency_s = options["chat_latency_s"]
+
+    # Los routers resuelven los servicios con get_rag_service()/get_ia_service(): se fijan las instancias locales.
+    rag_service._rag_service_instance = service
+    ia_service._ia_service_instance = ia_service.IAService(client=stub)
+
+    logging.getLogger().setLevel(options["log_level"].upper())
+    uvicorn.run(app, host="127.0.0.1", port=port, log_level=options["log_level"], access_log=False)
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return int(sock.getsockname()[1])
+
+
+def _start_local_server(args: argparse.Namespace) -> tuple[multiprocessing.Process, str]:
+    port = args.port or _free_port()
+    options = {
+        "dim": args.dim,
+        "docs": args.docs,
+        "lines_per_doc": args.lines_per_doc,
+        "embed_latency_s": args.embed_latency_ms / 1000,
+        "chat_latency_s": args.llm_latency_ms / 1000,
+        "jitter_s": args.jitter_ms / 1000,
+        "seed": args.seed,
+        "score_threshold": args.score_threshold,
+        "answer_cache": args.answer_cache,
+        "qdrant_path": args.qdrant_path,
+        "log_level": args.server_log_level,
+    }
+    process = multiprocessing.get_context("spawn").Process(target=_serve, args=(port, options), daemon=True)
+    process.start()
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + _STARTUP_TIMEOUT_S
+    while time.monotonic() < deadline:
+        if not process.is_alive():
+            raise RuntimeError(f"El servidor local termino al iniciar (exitcode={process.exitcode})")
+        try:
+            if httpx.get(f"{base_url}/ready", timeout=1.0).status_code == 200:
+                return process, base_url
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.25)
+    process.terminate()
+    raise RuntimeError(f"El servidor local no quedo listo (/ready) en {_STARTUP_TIMEOUT_S:.0f}s")
+
+
+# ---------------------------------------------------------------------------
+# Metricas del servidor (/metrics)
+# ---------------------------------------------------------------------------
+
+async def _scrape(client: httpx.AsyncClient) -> dict[tuple[str, tuple[tuple[str, str], ...]], float] | None:
+    try:
+        response = await client.get("/metrics", timeout=10.0)
+        response.raise_for_status()
+    except httpx.HTTPError:
+        return None
+    return {
+        (sample.name, tuple(sorted(sample.labels.items()))): float(sample.value)
+        for family in text_string_to_metric_families(response.text)
+        for sample in family.samples
+    }
+
+
+def _bucket_quantile(buckets: list[tuple[float, float]], count: float, q: float) -> float:
+    """Como histogram_quantile de Prometheus: interpolacion lineal dentro del bucket."""
+    rank = q * count
+    previous_le, previous_count = 0.0, 0.0
+    for le, cumulative in buckets:
+        if cumulative >= rank:
+            if math.isinf(le):
+                return previous_le
+            if cumulative == previous_count:
+                return le
+            return previous_le + (le - previous_le) * (rank - previous_count) / (cumulative - previous_count)
+        previous_le, previous_count = le, cumulative
+    return previous_le
+
+
+def _server_breakdown(before: dict | None, after: dict | None) -> dict[str, Any] | None:
+    """
+    Desglose del servidor para la ventana medida: diferencia de /metrics entre el fin del warmup y el
+    fin del paso. Las etapas salen de latencyMs de cada request (rag_stage_duration_seconds) y los
+    percentiles son aproximados por buckets.
+    """
+    if before is None or after is None:
+        return None
+
+    def delta(key: tuple[str, tuple[tuple[str, str], ...]]) -> float:
+        return after.get(key, 0.0) - before.get(key, 0.0)
+
+    report: dict[str, Any] = {}
+    for metric, label in _SERVER_HISTOGRAMS.items():
+        groups: dict[str, dict[str, Any]] = {}
+        for name, labels in after:
+            values = dict(labels)
+            if name == f"{metric}_bucket" and label in values:
+                group = groups.setdefault(values[label], {"buckets": []})
+                group["buckets"].append((float(values["le"]), delta((name, labels))))
+            elif name == f"{metric}_count" and label in values:
+                groups.setdefault(values[label], {"buckets": []})["count"] = delta((name, labels))
+            elif name == f"{metric}_sum" and label in values:
+                groups.setdefault(values[label], {"buckets": []})["sum"] = delta((name, labels))
+        summary: dict[str, Any] = {}
+        for key, group in sorted(groups.items()):
+            count = group.get("count", 0.0)
+            if count <= 0:
+                continue
+            buckets = sorted(group["buckets"])
+            summary[key] = {
+                "count": int(count),
+                "meanMs": round(group.get("sum", 0.0) / count * 1000, 1),
+                **{f"{name}Ms": round(_bucket_quantile(buckets, count, q) * 1000, 1) for name, q in _QUANTILES},
+            }
+        report[metric] = summary
+    for metric, label in _SERVER_COUNTERS.items():
+        report[metric] = {
+            dict(labels)[label]: int(delta((name, labels)))
+            for name, labels in after
+            if name == metric and label in dict(labels) and delta((name, labels)) > 0
+        }
+    return report
+
+
+# ---------------------------------------------------------------------------
+# Generador de carga
+# ---------------------------------------------------------------------------
+
+def _payload(endpoint: str, question: str) -> dict[str, Any]:
+    return {"query": question} if endpoint == "rag-answer" else {"text": question}
+
+
+async def _send(client: httpx.AsyncClient, endpoint: str, question: str, timeout_s: float) -> str:
+    try:
+        response = await client.post(_ENDPOINTS[endpoint], json=_payload(endpoint, question), timeout=timeout_s)
+    except httpx.TimeoutException:
+        return "timeout"
+    except httpx.HTTPError:
+        return "error"
+    return str(response.status_code)
+
+
+async def _open_loop(
+    client: httpx.AsyncClient,
+    plan: Callable[[int], tuple[str, str]],
+    rps: float,
+    warmup_s: float,
+    duration_s: float,
+    timeout_s: float,
+    on_measure_start: Callable[[], Any],
+) -> list[_Sample]:
+    """
+    Llegadas a tasa fija, sin esperar respuestas. La latencia se mide desde el instante programado
+    (no desde el envio), asi un generador atrasado no esconde la cola (coordinated omission).
+    """
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    end = started + warmup_s + duration_s
+    samples: list[_Sample] = []
+    tasks: list[asyncio.Task] = [asyncio.create_task(_at(started + warmup_s, on_measure_start))]
+
+    async def one(idx: int, scheduled: float) -> None:
+        endpoint, question = plan(idx)
+        status = await _send(client, endpoint, question, timeout_s)
+        if scheduled - started >= warmup_s:
+            samples.append(_Sample(endpoint, status, loop.time() - scheduled))
+
+    for idx in itertools.count():
+        scheduled = started + idx / rps
+        if scheduled >= end:
+            break
+        delay = scheduled - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(one(idx, scheduled)))
+    await asyncio.gather(*tasks)
+    return samples
+
+
+async def _closed_loop(
+    client: httpx.AsyncClient,
+    plan: Callable[[int], tuple[str, str]],
+    concurrency: int,
+    warmup_s: float,
+    duration_s: float,
+    timeout_s: float,
+    on_measure_start: Callable[[], Any],
+) -> list[_Sample]:
+    """concurrency usuarios que envian el siguiente request apenas reciben la respuesta."""
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    end = started + warmup_s + duration_s
+    samples: list[_Sample] = []
+    counter = itertools.count()
+    measure = asyncio.create_task(_at(started + warmup_s, on_measure_start))
+
+    async def user() -> None:
+        while loop.time() < end:
+            endpoint, question = plan(next(counter))
+            sent = loop.time()
+            status = await _send(client, endpoint, question, timeout_s)
+            if sent - started >= warmup_s:
+                samples.append(_Sample(endpoint, status, loop.time() - sent))
+
+    await asyncio.gather(measure, *(user() for _ in range(concurrency)))
+    return samples
+
+
+async def _at(when: float, callback: Callable[[], Any]) -> None:
+    await asyncio.sleep(max(0.0, when - asyncio.get_running_loop().time()))
+    await callback()
+
+
+def _latency_summary(latencies: list[float]) -> dict[str, Any]:
+    ordered = sorted(latencies)
+    summary: dict[str, Any] = {"count": len(ordered), "meanMs": round(sum(ordered) / len(ordered) * 1000, 1)}
+    for name, q in _QUANTILES:
+        summary[f"{name}Ms"] = round(ordered[min(len(ordered) - 1, math.ceil(q * len(ordered)) - 1)] * 1000, 1)
+    summary["maxMs"] = round(ordered[-1] * 1000, 1)
+    return summary
+
+
+def _summarize(samples: list[_Sample], duration_s: float) -> dict[str, Any]:
+    """Throughput, tasa de error y distribucion de latencia por status, total y por endpoint."""
+
+    def block(items: list[_Sample]) -> dict[str, Any]:
+        if not items:
+            return {"requests": 0, "throughputRps": 0.0, "okRps": 0.0, "errorRate": None, "latencyMs": {}}
+        by_status: dict[str, list[float]] = {}
+        for sample in items:
+            by_status.setdefault(sample.status, []).append(sample.latency_s)
+        ok = sum(1 for sample in items if sample.status.startswith("2"))
+        return {
+            "requests": len(items),
+            "throughputRps": round(len(items) / duration_s, 2),
+            "okRps": round(ok / duration_s, 2),
+            "errorRate": round(1 - ok / len(items), 4),
+            "latencyMs": {
+                "all": _latency_summary([sample.latency_s for sample in items]),
+                **{status: _latency_summary(values) for status, values in sorted(by_status.items())},
+            },
+        }
+
+    endpoints = sorted({sample.endpoint for sample in samples})
+    return {
+        **block(samples),
+        "endpoints": {endpoint: block([sample for sample in samples if sample.endpoint == endpoint]) for endpoint in endpoints},
+    }
+
+
+def _saturation_reason(
+    step: dict[str, Any],
+    mode: str,
+    target: float,
+    previous: dict[str, Any] | None,
+    args: argparse.Namespace,
+) -> str | None:
+    """Un paso satura si sube el error, se pasa el SLO de p99 o el throughput util deja de seguir a la carga."""
+    if step["errorRate"] is None or step["errorRate"] > args.max_error_rate:
+        return "errorRate"
+    if args.slo_p99_ms and step["latencyMs"]["all"]["p99Ms"] > args.slo_p99_ms:
+        return "p99"
+    if mode == "rps" and step["okRps"] < 0.9 * target:
+        return "throughput"
+    if mode == "concurrency" and previous is not None and step["okRps"] < previous["okRps"] * 1.05:
+        return "throughput"
+    return None
+
+
+async def _run_steps(base_url: str, args: argparse.Namespace, questions: list[str]) -> dict[str, Any]:
+    mode = "rps" if args.rps else "concurrency"
+    targets = [float(item) for item in (args.rps or args.concurrency).split(",") if item.strip()]
+    endpoints = args.endpoint or ["rag-answer"]
+
+    def plan(idx: int) -> tuple[str, str]:
+        return endpoints[idx % len(endpoints)], questions[idx % len(questions)]
+
+    limits = httpx.Limits(max_connections=args.max_connections, max_keepalive_connections=args.max_connections)
+    steps: list[dict[str, Any]] = []
+    saturated: dict[str, Any] | None = None
+    async with httpx.AsyncClient(base_url=base_url, limits=limits) as client:
+        for target in targets:
+            snapshots: dict[str, Any] = {}
+
+            async def mark_start() -> None:
+                snapshots["before"] = await _scrape(client)
+
+            if mode == "rps":
+                samples = await _open_loop(
+                    client, plan, target, args.warmup_s, args.duration_s, args.timeout_s, mark_start
+                )
+            else:
+                samples = await _closed_loop(
+                    client, plan, int(target), args.warmup_s, args.duration_s, args.timeout_s, mark_start
+                )
+            step = {"target": {mode: target}, **_summarize(samples, args.duration_s)}
+            step["server"] = _server_breakdown(snapshots.get("before"), await _scrape(client))
+            reason = _saturation_reason(step, mode, target, steps[-1] if steps else None, args)
+            step["saturated"] = reason
+            steps.append(step)
+            print(
+                f"{mode}={target:g} requests={step['requests']} okRps={step['okRps']} "
+                f"errorRate={step['errorRate']} p99Ms={step['latencyMs'].get('all', {}).get('p99Ms')} saturated={reason}",
+                flush=True,
+            )
+            if reason is not None:
+                saturated = {mode: target, "reason": reason}
+                break
+
+    sustained = [step["okRps"] for step in steps if step["saturated"] is None]
+    return {
+        "mode": mode,
+        "steps": steps,
+        "saturatedAt": saturated,
+        "maxSustainedRps": max(sustained) if sustained else None,
+    }
+
+
+def _load_questions(path: Path) -> list[str]:
+    data = json.loads(path.read_text(encoding="utf-8"))
+    questions = [str(item).strip() for item in data if str(item).strip()] if isinstance(data, list) else []
+    if not questions:
+        raise ValueError(f"{path} debe ser una lista de preguntas no vacia")
+    return questions
+
+
+def _build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Prueba de carga de /rag-answer y /classify-extract")
+    parser.add_argument("--url", type=str, default=None, help="Servicio ya levantado; sin --url se levanta uno local con reemplazos")
+    parser.add_argument("--endpoint", action="append", choices=sorted(_ENDPOINTS), help="Repetible: los requests se alternan")
+    parser.add_argument("--questions", type=str, default=str(_DEFAULT_QUESTIONS))
+    load = parser.add_mutually_exclusive_group()
+    load.add_argument("--rps", type=str, default=None, help="Lazo abierto: tasas por paso, p.ej. 5,10,20")
+    load.add_argument("--concurrency", type=str, default=None, help="Lazo cerrado: usuarios por paso, p.ej. 4,8,16")
+    parser.add_argument("--duration-s", type=float, default=30.0, help="Ventana medida por paso")
+    parser.add_argument("--warmup-s", type=float, default=5.0, help="Carga previa descartada en cada paso")
+    parser.add_argument("--timeout-s", type=float, default=65.0)
+    parser.add_argument("--max-connections", type=int, default=512)
+    parser.add_argument("--max-error-rate", type=float, default=0.01, help="Tasa de error que marca saturacion")
+    parser.add_argument("--slo-p99-ms", type=float, default=None, help="p99 que marca saturacion")
+    parser.add_argument("--output", type=str, default=None, help="Guarda el reporte JSON")
+    stand_ins = parser.add_argument_group("servidor local (sin --url)")
+    stand_ins.add_argument("--port", type=int, default=0)
+    stand_ins.add_argument("--embed-latency-ms", type=float, default=60.0)
+    stand_ins.add_argument("--llm-latency-ms", type=float, default=900.0)
+    stand_ins.add_argument("--jitter-ms", type=float, default=150.0, help="Desvio normal sumado a cada latencia simulada")
+    stand_ins.add_argument("--dim", type=int, default=None, help="Dimension de los embeddings (default RAG_EMBED_DIM)")
+    stand_ins.add_argument("--docs", type=int, default=40, help="Documentos sinteticos del corpus")
+    stand_ins.add_argument("--lines-per-doc", type=int, default=60)
+    stand_ins.add_argument("--score-threshold", type=float, default=0.0, help="0 hace que toda pregunta llegue a generate")
+    stand_ins.add_argument("--answer-cache", action="store_true", help="Habilita la cache de respuestas (temporal)")
+    stand_ins.add_argument("--qdrant-path", type=str, default=None, help="Qdrant local en disco; por defecto en memoria")
+    stand_ins.add_argument("--server-log-level", type=str, default="error")
+    stand_ins.add_argument("--seed", type=int, default=7)
+    return parser
+
+
+def main() -> int:
+    args = _build_parser().parse_args()
+    if not args.rps and not args.concurrency:
+        args.rps = "5"
+    questions = _load_questions(Path(args.questions))
+
+    process: multiprocessing.Process | None = None
+    base_url = args.url
+    if base_url is None:
+        process, base_url = _start_local_server(args)
+    try:
+        result = asyncio.run(_run_steps(base_url.rstrip("/"), args, questions))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.join(timeout=10)
+
+    report = {
+        **run_metadata(),
+        "target": base_url if args.url else "local",
+        "config": {
+            "endpoints": args.endpoint or ["rag-answer"],
+            "questions": len(questions),
+            "durationS": args.duration_s,
+            "warmupS": args.warmup_s,
+            "timeoutS": args.timeout_s,
+            "standIns": None
+            if args.url
+            else {
+                "embedLatencyMs": args.embed_latency_ms,
+                "llmLatencyMs": args.llm_latency_ms,
+                "jitterMs": args.jitter_ms,
+                "docs": args.docs,
+                "scoreThreshold": args.score_threshold,
+                "answerCache": args.answer_cache,
+                "qdrant": args.qdrant_path or ":memory:",
+            },
+        },
+        **result,
+    }
+    payload = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(payload, encoding="utf-8")
+    print(payload)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
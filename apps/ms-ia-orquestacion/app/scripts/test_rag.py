@@ -1,5 +1,46 @@
-from app.rag.reranker import rerank_cosine, should_reject_by_threshold
-from app.rag.retriever import ChunkCandidate
+import asyncio
+import contextvars
+import dataclasses
+import json
+import os
+import tempfile
+import threading
+import types
+from pathlib import Path
+
+import httpx
+from prometheus_client import REGISTRY
+from qdrant_client import QdrantClient, models
+from qdrant_client.http.exceptions import ResponseHandlingException
+
+from app.core.config import get_settings
+from app.core.admission import OverloadedError
+from app.core.deadline import Deadline, DeadlineExceeded, RequestCancelled
+from app.core.metrics import observe_pipeline_metrics
+from app.core.singleflight import SingleFlight
+from app.core.tracing import build_http_event_hooks, start_trace
+from app.db.qdrant import resolve_alias, switch_alias
+from app.ingest.bulk import common_root, ingest_many, relative_doc_id
+from app.ingest.chunking import chunk_text, iter_page_chunks, normalize_text
+from app.ingest.dedup import NearDuplicateFilter
+from app.ingest.ingest_service import IngestOptions, PDFIngestService, build_ingest_options
+from app.ingest.jobs import IngestJobStore
+from app.ingest.manifest import IngestManifest
+from app.ingest.pdf_cache import ParsedPdfCache
+from app.ingest.pdf_loader import PageText, flatten_pages
+from app.ingest.pipeline import timed
+from app.ingest.upload import QdrantBatchUploader, build_batch
+from app.rag import service as rag_pipeline
+from app.rag.answer_cache import AnswerCache, build_answer_cache_key
+from app.rag.compression import compress_context
+from app.rag.reranker import cosine_scores, rerank_cosine, should_reject_by_threshold
+from app.rag.retriever import ChunkCandidate, retrieve_candidates, retrieve_candidates_batch
+from app.routers.rag_router import _rag_http_error, _run_unless_disconnected
+from app.scripts.bench_micro import compare
+from app.scripts.benchkit import SerializedQdrantClient, StubOpenAI
+from app.scripts.load_test import _bucket_quantile
+from app.services import rag_service, warmup
+from app.services.rag_service import RAGService, _chunk_hashes
 
 
 def test_rerank_cosine_order() -> None:
@@ -36,14 +77,757 @@ def test_rerank_cosine_order() -> None:
     assert ranked[0].chunk_id == "a", "rerank_cosine no priorizo la similitud esperada"
 
 
+def test_candidates_share_embedding_matrix() -> None:
+    client = QdrantClient(":memory:")
+    client.create_collection("rag", vectors_config=models.VectorParams(size=3, distance=models.Distance.COSINE))
+    vectors = [[float(idx), 1.0, 0.0] for idx in range(1, 4)]
+    client.upsert("rag", points=build_batch([1, 2, 3], vectors, [{"chunkText": f"t{idx}"} for idx in range(3)]))
+    candidates = retrieve_candidates(client, "rag", [1.0, 0.0, 0.0], topk=3, filters=None, include_embedding=True)
+    base = candidates[0].embedding.base
+    assert base is not None and base.shape == (3, 3), "los embeddings deben ser vistas de una matriz compartida"
+    assert all(candidate.embedding.base is base for candidate in candidates)
+    assert str(base.dtype) == "float32"
+    assert not hasattr(candidates[0], "__dict__"), "ChunkCandidate debe usar __slots__"
+
+    rows = [candidate.embedding for candidate in candidates]
+    scores = cosine_scores([1.0, 0.0, 0.0], rows)
+    assert list(cosine_scores([1.0, 0.0, 0.0], rows[::-1])) == list(scores[::-1]), "filas reordenadas se apilan"
+
+
 def test_threshold_gate() -> None:
     assert should_reject_by_threshold(0.5, 0.72) is True
     assert should_reject_by_threshold(0.9, 0.72) is False
 
 
+def test_answer_cache_roundtrip() -> None:
+    cache = AnswerCache(path=":memory:", max_entries=2)
+    key = build_answer_cache_key("pregunta", ["a", "b"], "gpt-4.1-mini", 0.3, "grounded-v1")
+    assert key == build_answer_cache_key("pregunta", ["a", "b"], "gpt-4.1-mini", 0.3, "grounded-v1")
+    assert key != build_answer_cache_key("pregunta", ["b", "a"], "gpt-4.1-mini", 0.3, "grounded-v1")
+
+    cache.put(key, "respuesta")
+    assert cache.get(key) == "respuesta"
+
+    cache.put("k2", "dos")
+    cache.put("k3", "tres")
+    assert cache.stats()["entries"] == 2, "el cache no respeto max_entries"
+
+    cache.invalidate_corpus()
+    assert cache.get("k3") is None, "invalidate_corpus no descarto respuestas previas"
+
+    cache.put("k4", "cuatro", used_chunk_ids=["a"])
+    assert cache.get_entry("k4") == ("cuatro", ["a"]) and cache.get_entry("k3") is None
+
+
+def test_compress_context_keeps_alignment() -> None:
+    chunks = [
+        ChunkCandidate(
+            chunk_id=str(idx),
+            source="s",
+            version="v1",
+            title="",
+            chunk_index=idx,
+            text=text,
+            metadata={},
+            mongo_score=0.8,
+            embedding=None,
+            page_start=1,
+            page_end=1,
+        )
+        for idx, text in enumerate(
+            [
+                "El contrato laboral fija el salario. Las vacaciones son quince dias habiles.",
+                "La audiencia se programa con antelacion. El horario de atencion es de lunes a viernes.",
+            ]
+        )
+    ]
+    result = compress_context(
+        query="cuantos dias de vacaciones",
+        chunks=chunks,
+        token_budget=12,
+        count_tokens=lambda text: len(text.split()),
+    )
+    assert len(result.evidence) == len(chunks), "la compresion debe devolver un texto por chunk"
+    assert "vacaciones" in result.evidence[0]
+    assert result.evidence_tokens_after <= 12 < result.evidence_tokens_before
+
+    tight = compress_context(
+        query="cuantos dias de vacaciones",
+        chunks=chunks,
+        token_budget=3,
+        count_tokens=lambda text: len(text.split()),
+    )
+    assert tight.evidence_tokens_after <= 3, "la oracion de respaldo debe truncarse al presupuesto"
+    assert tight.evidence[0] == "Las vacaciones son" and tight.evidence[1] == ""
+
+
+def test_deadline_budget() -> None:
+    deadline = Deadline(5.0)
+    assert deadline.timeout_for("generate", cap=1.0) == 1.0
+    assert 4.0 < deadline.timeout_for("generate") <= 5.0
+
+    expired = Deadline(0.0)
+    try:
+        expired.check("retrieve")
+        raise AssertionError("un deadline agotado debe cortar la etapa")
+    except DeadlineExceeded as exc:
+        assert exc.stage == "retrieve"
+
+    shared = Deadline(1.0).fork()
+    shared.extend_to(deadline)
+    assert shared.remaining() > 1.0, "extend_to debe adoptar el deadline mas tardio"
+    shared.cancel()
+    try:
+        shared.check("embed")
+        raise AssertionError("un deadline cancelado debe cortar la etapa")
+    except RequestCancelled:
+        pass
+
+
+def test_ingest_job_lifecycle() -> None:
+    store = IngestJobStore(path=":memory:")
+    job = store.enqueue(source="doc", text="texto", title="Doc")
+    assert job["status"] == "queued"
+
+    claimed = store.claim_next("worker-1")
+    assert claimed is not None and claimed["jobId"] == job["jobId"] and claimed["text"] == "texto"
+    assert store.claim_next("worker-2") is None, "un job running no debe reclamarse dos veces"
+
+    store.update_progress(job["jobId"], {"chunksTotal": 4, "chunksEmbedded": 4, "chunksUpserted": 2})
+    assert store.get(job["jobId"])["progress"]["chunksUpserted"] == 2
+
+    store.complete(job["jobId"], {"source": "doc", "title": "Doc", "chunks_deleted": 0, "chunks_inserted": 4})
+    done = store.get(job["jobId"])
+    assert done["status"] == "succeeded" and done["result"]["chunks_inserted"] == 4
+
+
+def test_ingest_job_failure_is_retried() -> None:
+    store = IngestJobStore(path=":memory:", max_attempts=2)
+    job = store.enqueue(source="doc", text="texto")
+
+    store.claim_next("worker-1")
+    assert store.fail(job["jobId"], "RuntimeError: qdrant caido") is True
+    retried = store.get(job["jobId"])
+    assert retried["status"] == "queued" and retried["error"] == "RuntimeError: qdrant caido"
+
+    assert store.claim_next("worker-1") is not None
+    store.heartbeat(job["jobId"])
+    assert store.fail(job["jobId"], "RuntimeError: qdrant caido") is False
+    failed = store.get(job["jobId"])
+    assert failed["status"] == "failed" and failed["attempts"] == 2
+
+
+def test_ingest_jobs_for_one_source_run_in_order() -> None:
+    store = IngestJobStore(path=":memory:")
+    first = store.enqueue(source="doc", text="version 1")
+    second = store.enqueue(source="doc", text="version 2")
+    other = store.enqueue(source="otro", text="texto")
+
+    assert store.claim_next("worker-1")["jobId"] == first["jobId"]
+    # Con "doc" en curso, otro worker toma el siguiente source y no la segunda version de "doc".
+    assert store.claim_next("worker-2")["jobId"] == other["jobId"]
+    assert store.claim_next("worker-3") is None
+
+    store.complete(first["jobId"], {"source": "doc", "title": None, "chunks_deleted": 0, "chunks_inserted": 1})
+    assert store.claim_next("worker-3")["jobId"] == second["jobId"]
+
+
+def test_chunk_hashes_ignore_position() -> None:
+    before = _chunk_hashes("doc", ["alfa", "beta", "gamma"])
+    after = _chunk_hashes("doc", ["nuevo", "alfa", "beta  ", "gamma"])
+    assert set(before) <= set(after), "mover un chunk o cambiar espacios no debe cambiar su hash"
+
+    repeated = _chunk_hashes("doc", ["igual", "igual"])
+    assert repeated[0] != repeated[1], "chunks repetidos necesitan ids distintos"
+    assert _chunk_hashes("otro", ["alfa"])[0] != before[0]
+
+
+def test_streaming_chunks_match_batch() -> None:
+    pages = [
+        PageText(page=1, text="Articulo 1. El trabajador tiene derecho a vacaciones.\nSe pagan en dinero. Norma-"),
+        PageText(page=2, text="tiva vigente para el empleador. " * 6),
+        PageText(page=3, text="Articulo 2. La jornada maxima es de ocho horas diarias! Fin?"),
+    ]
+    full_text, spans = flatten_pages(pages)
+    expected = [(c.text, c.start_char, c.end_char) for c in chunk_text(full_text, spans, 80, 15, 20)]
+    streamed = [(c.text, c.start_char, c.end_char) for c in iter_page_chunks(iter(pages), 80, 15, 20)]
+    assert streamed == expected, "el chunking en streaming debe cortar igual que el chunking en memoria"
+
+    normalized = normalize_text(full_text)
+    for chunk in iter_page_chunks(iter(pages), 80, 15, 20):
+        assert chunk.text == normalized[chunk.text_start: chunk.text_end], "los offsets deben apuntar al texto normalizado"
+
+
+def test_parsed_pdf_cache_roundtrip() -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        cache = ParsedPdfCache(directory)
+        writer = cache.writer("doc", total_pages=3)
+        for text in ["Pagina uno\ncon dos lineas", "", "Pagina tres \"citada\""]:
+            writer.write(text)
+        writer.commit()
+        assert cache.page_count("doc") == 3
+        assert list(cache.iter_pages("doc")) == ["Pagina uno\ncon dos lineas", "", "Pagina tres \"citada\""]
+
+        partial = cache.writer("cortado", total_pages=2)
+        partial.write("solo una")
+        partial.commit()
+        assert cache.page_count("cortado") is None, "una extraccion incompleta no debe quedar en cache"
+
+
+def test_uploader_barrier_is_last() -> None:
+    class _RecordingClient:
+        def __init__(self) -> None:
+            self.calls: list[tuple[list, bool]] = []
+            self.lock = threading.Lock()
+
+        def upsert(self, collection_name: str, points: models.Batch, wait: bool) -> None:
+            with self.lock:
+                self.calls.append((list(points.ids), wait))
+
+    for single_shard in (True, False):
+        client = _RecordingClient()
+        uploader = QdrantBatchUploader(client, "rag", max_in_flight=2, single_shard=single_shard)
+        done: list[int] = []
+        for idx in range(5):
+            uploader.submit(build_batch([f"p{idx}"], [[float(idx)]], [{"i": idx}]), on_done=lambda idx=idx: done.append(idx))
+        assert uploader.finish() == 5
+        assert done == [0, 1, 2, 3, 4], "on_done debe llamarse en orden de envio"
+        assert client.calls[-1] == (["p4"], True), "el ultimo batch es la barrera con wait=True"
+        # Con varios shards el orden por shard no alcanza: cada batch espera a quedar aplicado.
+        assert all(wait != single_shard for _, wait in client.calls[:-1])
+
+    local = QdrantClient(":memory:")
+    local.create_collection("rag", vectors_config=models.VectorParams(size=1, distance=models.Distance.COSINE))
+    assert QdrantBatchUploader(local, "rag").single_shard
+    assert not QdrantBatchUploader(local, "missing").single_shard
+
+
+def test_switch_alias_returns_previous() -> None:
+    client = QdrantClient(":memory:")
+    for name in ("rag__1", "rag__2"):
+        client.create_collection(name, vectors_config=models.VectorParams(size=2, distance=models.Distance.COSINE))
+    assert switch_alias(client, "rag", "rag__1") is None
+    assert switch_alias(client, "rag", "rag__2") == "rag__1"
+    assert resolve_alias(client, "rag") == "rag__2"
+    assert resolve_alias(client, "rag__2") is None, "una coleccion real no es un alias"
+
+
+def test_near_duplicate_filter_within_document() -> None:
+    client = QdrantClient(":memory:")
+    client.create_collection("rag", vectors_config=models.VectorParams(size=2, distance=models.Distance.COSINE))
+    boilerplate = " ".join(f"articulo {idx} del codigo sustantivo del trabajo vigente" for idx in range(20))
+    edited = boilerplate.replace("articulo 7 del", "articulo 7 bis del", 1)
+    texts = [boilerplate, edited, "El empleador debe pagar las cesantias antes del 14 de febrero de cada ano."]
+
+    dedup = NearDuplicateFilter(client, "rag", threshold=0.85, source="cst", version="v1")
+    kept = dedup.filter(["p0", "p1", "p2"], texts, [{"docId": "doc", "chunkIndex": idx} for idx in range(3)])
+    assert [position for position, _ in kept] == [0, 2], "el chunk casi identico no debe embeberse"
+    assert dedup.merges == {"p0": [{"docId": "doc", "chunkIndex": 1}]}
+
+
+def test_near_duplicate_filter_across_documents() -> None:
+    client = QdrantClient(":memory:")
+    client.create_collection("rag", vectors_config=models.VectorParams(size=2, distance=models.Distance.COSINE))
+    text = " ".join(f"articulo {idx} del codigo sustantivo del trabajo vigente" for idx in range(20))
+    stored = NearDuplicateFilter(client, "rag", threshold=0.85, source="cst", version="v1")
+    canonical = "00000000-0000-0000-0000-000000000001"
+    [(_, sketch)] = stored.filter([canonical], [text], [{"docId": "a", "chunkIndex": 0}])
+    client.upsert(
+        "rag",
+        points=build_batch([canonical], [[1.0, 0.0]], [{"source": "cst", "version": "v1", "docId": "a", **sketch.payload()}]),
+    )
+
+    same_source = NearDuplicateFilter(client, "rag", threshold=0.85, source="cst", version="v1")
+    assert same_source.filter(["b0"], [text], [{"docId": "b", "chunkIndex": 0}]) == []
+    assert same_source.merges == {canonical: [{"docId": "b", "chunkIndex": 0}]}
+    # Otro source u otra version: el chunk se inserta, asi lo encuentran los filtros del retrieval.
+    for source, version in (("decretos", "v1"), ("cst", "v2")):
+        other = NearDuplicateFilter(client, "rag", threshold=0.85, source=source, version=version)
+        assert [position for position, _ in other.filter(["c0"], [text], [{"docId": "c", "chunkIndex": 0}])] == [0]
+        assert other.merges == {}
+
+
+def test_bulk_ingest_isolates_failures_and_doc_ids() -> None:
+    with tempfile.TemporaryDirectory() as root:
+        for folder in ("a", "b"):
+            Path(root, folder).mkdir()
+            Path(root, folder, "ley.pdf").write_bytes(b"%PDF-1.4 truncado")
+        files = sorted(str(path) for path in Path(root).rglob("*.pdf"))
+        assert common_root(files) == str(Path(root).resolve())
+        assert [relative_doc_id(path, root) for path in files] == ["a/ley", "b/ley"]
+
+        def make_options(path: str) -> IngestOptions:
+            return build_ingest_options(path, relative_doc_id(path, root), "s", None, None, None, True, None, False)
+
+        service = PDFIngestService(collection_name="bulk", client=QdrantClient(":memory:"), embedder=lambda texts: [])
+        missing = str(Path(root, "missing.pdf"))
+        # Sin manifest (dry-run/reindex): un PDF ilegible o inexistente no corta la corrida.
+        report = ingest_many(files + [missing], make_options, manifest=None, service=service)
+        assert [result["status"] for result in report.results] == ["failed"] * 3
+        # Con manifest falla el hash del archivo inexistente, antes de manifest.start().
+        manifest = IngestManifest(str(Path(root, "manifest.json")))
+        report = ingest_many([missing], make_options, manifest=manifest, service=service)
+        assert report.failed == 1 and manifest.entry(missing)["status"] == "failed"
+
+
+def test_timed_closes_inner_iterator() -> None:
+    closed: list[bool] = []
+
+    def produce():
+        try:
+            yield from range(5)
+        finally:
+            closed.append(True)
+
+    timings = {"extract": 0.0}
+    wrapped = timed(produce(), timings, "extract")
+    assert [next(wrapped), next(wrapped)] == [0, 1]
+    wrapped.close()
+    assert closed == [True], "cerrar el envoltorio debe cerrar el iterable de adentro"
+    assert timings["extract"] > 0.0
+
+
+def test_bucket_quantile_interpolates() -> None:
+    # 10 observaciones: 4 en (0, 0.1], 6 en (0.1, 0.5], ninguna por encima.
+    buckets = [(0.1, 4.0), (0.5, 10.0), (float("inf"), 10.0)]
+    assert abs(_bucket_quantile(buckets, 10.0, 0.2) - 0.05) < 1e-9
+    assert abs(_bucket_quantile(buckets, 10.0, 0.7) - 0.3) < 1e-9
+    assert abs(_bucket_quantile(buckets, 10.0, 1.0) - 0.5) < 1e-9
+
+
+def test_microbench_compare_normalizes_time() -> None:
+    baseline = {"calibrationUs": 100.0, "cases": {"f": {"us": 50.0, "peakKiB": 10.0, "retainedBlocks": 5}}}
+    # Maquina el doble de lenta: 100 us ya no es regresion; mas memoria si lo es.
+    slower = {"calibrationUs": 200.0, "cases": {"f": {"us": 100.0, "peakKiB": 10.0, "retainedBlocks": 5}}}
+    assert compare(slower, baseline, 0.25, 0.10)[0]["status"] == "ok"
+    grown = {"calibrationUs": 100.0, "cases": {"f": {"us": 80.0, "peakKiB": 40.0, "retainedBlocks": 5}}}
+    assert compare(grown, baseline, 0.25, 0.10)[0]["regressions"] == ["time", "peakKiB"]
+
+
+def test_warmup_retries_until_ready() -> None:
+    attempts: list[int] = []
+
+    def flaky_warm_up() -> dict[str, float]:
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise RuntimeError("qdrant no disponible")
+        return {"ragService": 1.0}
+
+    original = warmup.warm_up
+    warmup.warm_up = flaky_warm_up
+    try:
+        warmup._warmup_loop(retry_s=0.0)
+        state = warmup._state.to_dict()
+    finally:
+        warmup.warm_up = original
+        warmup._state = warmup.WarmupState()
+    assert state["status"] == "ready" and state["attempts"] == 2
+    assert state["error"] is None and state["steps"] == {"ragService": 1.0}
+
+
+def test_singleflight_cancels_when_last_waiter_leaves() -> None:
+    started = asyncio.Event()
+    cancelled: list[bool] = []
+
+    async def slow(shared: Deadline | None) -> str:
+        started.set()
+        try:
+            await asyncio.sleep(30)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+        return "ok"
+
+    async def scenario() -> Deadline | None:
+        group: SingleFlight[str] = SingleFlight("test")
+        leader = asyncio.ensure_future(group.do("k", slow, deadline=Deadline(30)))
+        await started.wait()
+        follower = asyncio.ensure_future(group.do("k", slow, deadline=Deadline(30)))
+        await asyncio.sleep(0)
+        shared = group._calls["k"].deadline
+
+        leader.cancel()
+        await asyncio.sleep(0.01)
+        assert not cancelled and not shared.cancelled, "con un waiter restante la ejecucion sigue"
+        follower.cancel()
+        await asyncio.sleep(0.01)
+        assert group.in_flight() == 0
+        return shared
+
+    shared = asyncio.run(scenario())
+    assert cancelled == [True] and shared.cancelled
+
+
+def test_client_disconnect_cancels_with_499() -> None:
+    cancelled: list[bool] = []
+
+    class DisconnectedRequest:
+        async def is_disconnected(self) -> bool:
+            return True
+
+    async def work() -> str:
+        try:
+            await asyncio.sleep(30)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+        return "ok"
+
+    async def scenario() -> None:
+        await _run_unless_disconnected(DisconnectedRequest(), work(), deadline)
+        await asyncio.sleep(0)
+
+    deadline = Deadline(30)
+    try:
+        asyncio.run(scenario())
+    except RequestCancelled as exc:
+        error = _rag_http_error(exc, "req-1", "rag_answer")
+    else:
+        raise AssertionError("la desconexion debe levantar RequestCancelled")
+    assert deadline.cancelled and cancelled == [True]
+    assert error.status_code == 499 and error.detail["code"] == "CLIENT_CLOSED_REQUEST"
+
+
+def _local_rag_service() -> tuple[RAGService, StubOpenAI, SerializedQdrantClient]:
+    """RAGService con OpenAI reemplazado por StubOpenAI y Qdrant en memoria, con dos sources."""
+    dim = get_settings().embedding_dimensions
+    stub = StubOpenAI(dim)
+    client = SerializedQdrantClient(QdrantClient(":memory:"))
+    client.create_collection("rag", vectors_config=models.VectorParams(size=dim, distance=models.Distance.COSINE))
+    service = RAGService(openai_client=stub, qdrant_client=client, collection_name="rag")
+    service._pipeline.answer_cache = None
+    service.ingest(source="vacaciones", text="El trabajador tiene derecho a quince dias habiles de vacaciones remuneradas por ano.")
+    service.ingest(source="cesantias", text="El empleador consigna las cesantias del trabajador antes del catorce de febrero.")
+    return service, stub, client
+
+
+def _stage_count(stage: str) -> float:
+    return REGISTRY.get_sample_value("rag_stage_duration_seconds_count", {"stage": stage}) or 0.0
+
+
+def test_text_ingest_updates_pages_without_reembedding() -> None:
+    service, stub, client = _local_rag_service()
+    text = "El preaviso del contrato a termino fijo debe darse con treinta dias de anticipacion."
+    service.ingest(source="preaviso", text=text, metadata={"pageStart": 1, "pageEnd": 1})
+    requests_before = stub.requests
+
+    result = service.ingest(source="preaviso", text=text, metadata={"pageStart": 4, "pageEnd": 5})
+    assert result["chunks_added"] == 0 and stub.requests == requests_before
+    assert set(result["stageMs"]) == {"chunk", "embed", "upsert"} and result["stageMs"]["embed"] == 0.0
+    points, _ = client.scroll(
+        "rag",
+        scroll_filter=models.Filter(must=[models.FieldCondition(key="source", match=models.MatchValue(value="preaviso"))]),
+    )
+    assert all((point.payload["pageStart"], point.payload["pageEnd"]) == (4, 5) for point in points)
+    assert all("contentHash" in point.payload and "textHash" not in point.payload for point in points)
+
+
+def test_retrieve_candidates_batch_keeps_order() -> None:
+    _, stub, client = _local_rag_service()
+    embeddings = stub(["vacaciones del trabajador", "cesantias del trabajador"])
+    batches = retrieve_candidates_batch(
+        client=client,
+        collection_name="rag",
+        query_embeddings=embeddings,
+        topk=5,
+        filters=[{"source": "cesantias"}, {"source": "vacaciones"}],
+        include_embedding=True,
+    )
+    assert [{candidate.source for candidate in batch} for batch in batches] == [{"cesantias"}, {"vacaciones"}]
+    assert batches[0][0].embedding is not None
+
+
+def test_prefetch_batch_observes_shared_stages_once() -> None:
+    service, stub, _ = _local_rag_service()
+    pipeline = service._pipeline
+    requests_before, embed_before, generate_before = stub.requests, _stage_count("embed"), _stage_count("generate")
+
+    prefetched = pipeline.prefetch_batch(["vacaciones remuneradas", "cesantias"], [None, {"source": "cesantias"}])
+    assert stub.requests == requests_before + 1, "un solo request de embeddings para el batch"
+    assert {candidate.source for candidate in prefetched[1].candidates} == {"cesantias"}
+
+    for item in prefetched:
+        pipeline.evaluate("pregunta", None, overrides={"score_threshold": 0.0}, prefetched=item)
+    assert _stage_count("embed") == embed_before + 1, "embed compartido se observa una vez por batch"
+    assert _stage_count("generate") == generate_before + 2
+
+
+def test_cosine_rerank_ignores_exhausted_deadline() -> None:
+    service, _, _ = _local_rag_service()
+    pipeline = service._pipeline
+    [prefetched] = pipeline.prefetch_batch(["vacaciones remuneradas"], [None])
+    overrides = {"rerank_mode": "cosine", "rerank_enabled": True, "score_threshold": 0.0}
+    # Sin presupuesto, el rerank coseno (local) igual corre; dry-run evita la generacion.
+    result = pipeline.evaluate("vacaciones", None, overrides=overrides, dry_run=True, deadline=Deadline(0), prefetched=prefetched)
+    assert result["metrics"]["usedChunksCount"] > 0
+
+
+def test_compressed_out_chunks_are_not_reported() -> None:
+    service, _, _ = _local_rag_service()
+    pipeline = service._pipeline
+    [prefetched] = pipeline.prefetch_batch(["vacaciones remuneradas"], [None])
+    assert {candidate.source for candidate in prefetched.candidates} == {"vacaciones", "cesantias"}
+
+    settings = dataclasses.replace(
+        get_settings(), rag_context_compression_enabled=True, rag_context_scorer="lexical", rag_context_token_budget=25
+    )
+    compressions: list[int] = []
+
+    def counted_compress(*args, **kwargs):
+        compressions.append(1)
+        return compress_context(*args, **kwargs)
+
+    pipeline.answer_cache = AnswerCache(path=":memory:", max_entries=10)
+    originals = (rag_pipeline.get_settings, rag_pipeline.compress_context)
+    rag_pipeline.get_settings = lambda: settings
+    rag_pipeline.compress_context = counted_compress
+    try:
+        overrides = {"score_threshold": 0.0, "final_k": 5}
+        result = pipeline.evaluate("vacaciones remuneradas", None, overrides=overrides, prefetched=prefetched)
+        cached = pipeline.evaluate("vacaciones remuneradas", None, overrides=overrides, prefetched=prefetched)
+    finally:
+        rag_pipeline.get_settings, rag_pipeline.compress_context = originals
+    assert result["metrics"]["promptTokens"]["compressed"]
+    assert {chunk["source"] for chunk in result["response"]["usedChunks"]} == {"vacaciones"}
+    assert result["metrics"]["usedChunksCount"] == len(result["response"]["usedChunks"])
+
+    assert cached["metrics"]["cacheHit"] and compressions == [1], "un hit del cache no vuelve a comprimir"
+    assert cached["response"]["usedChunks"] == result["response"]["usedChunks"]
+
+
+def test_observe_pipeline_metrics() -> None:
+    def sample(name: str, labels: dict[str, str]) -> float:
+        return REGISTRY.get_sample_value(name, labels) or 0.0
+
+    before = {stage: _stage_count(stage) for stage in ("embed", "retrieval", "generate", "total")}
+    rejections = sample("rag_threshold_rejections_total", {})
+    cache_hits = sample("rag_cache_requests_total", {"cache": "answer", "result": "hit"})
+    metrics = {
+        "latencyMs": {"embed": 4.0, "retrieval": 6.0, "rerank": 1.0, "generate": 0.0, "total": 12.0},
+        "thresholdTriggered": True,
+        "top1Score": 0.4,
+        "cacheHit": True,
+    }
+    observe_pipeline_metrics(metrics, skip_stages=("retrieval",))
+    assert _stage_count("embed") == before["embed"] + 1 and _stage_count("total") == before["total"] + 1
+    assert _stage_count("retrieval") == before["retrieval"], "skip_stages no se observa"
+    assert _stage_count("generate") == before["generate"], "una etapa omitida (0.0) no se observa"
+    assert sample("rag_threshold_rejections_total", {}) == rejections + 1
+    assert sample("rag_cache_requests_total", {"cache": "answer", "result": "hit"}) == cache_hits + 1
+
+
+def test_qdrant_client_errors_are_counted() -> None:
+    counted = REGISTRY.get_sample_value("rag_dependency_errors_total", {"dependency": "qdrant"}) or 0.0
+    exc = ResponseHandlingException(ConnectionRefusedError(111, "Connection refused"))
+    error = _rag_http_error(exc, "req-1", "rag_answer")
+    assert error.status_code == 502 and error.detail["code"] == "QDRANT_ERROR"
+    assert REGISTRY.get_sample_value("rag_dependency_errors_total", {"dependency": "qdrant"}) == counted + 1
+
+
+def test_server_timing_and_trace_export() -> None:
+    from app.main import app
+
+    service, _, _ = _local_rag_service()
+
+    async def post_answer() -> httpx.Response:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as http:
+            return await http.post(
+                "/v1/ai/rag-answer", json={"query": "vacaciones remuneradas"}, headers={"x-request-id": "trace-test"}
+            )
+
+    with tempfile.TemporaryDirectory() as tmp:
+        export_path = Path(tmp) / "traces.jsonl"
+        original_export = os.environ.get("RAG_TRACE_EXPORT_FILE")
+        os.environ["RAG_TRACE_EXPORT_FILE"] = str(export_path)
+        rag_service._rag_service_instance = service
+        try:
+            response = asyncio.run(post_answer())
+        finally:
+            rag_service._rag_service_instance = None
+            if original_export is None:
+                os.environ.pop("RAG_TRACE_EXPORT_FILE", None)
+            else:
+                os.environ["RAG_TRACE_EXPORT_FILE"] = original_export
+        assert response.status_code == 200
+        timings = dict(item.split(";dur=") for item in response.headers["Server-Timing"].split(", "))
+        assert {"total", "embed", "retrieve"} <= set(timings), timings
+
+        spans = [json.loads(line) for line in export_path.read_text(encoding="utf-8").splitlines()]
+        assert spans and all(item["traceId"] == "trace-test" for item in spans)
+        [root] = [item for item in spans if item["parentId"] is None]
+        assert root["name"] == "total"
+        span_ids = {item["spanId"] for item in spans}
+        assert all(item["parentId"] in span_ids for item in spans if item is not root)
+
+
+def test_qdrant_client_passes_event_hooks() -> None:
+    def request_unreachable_qdrant() -> list[dict]:
+        client = QdrantClient(
+            url="http://127.0.0.1:9", timeout=1, check_compatibility=False, event_hooks=build_http_event_hooks("qdrant")
+        )
+        trace = start_trace("hooks-test")
+        try:
+            client.get_collections()
+        except Exception:
+            pass
+        return [item.to_dict() for item in trace.spans]
+
+    # Contexto aparte: start_trace no debe dejar un trace activo para los demas tests.
+    spans = contextvars.copy_context().run(request_unreachable_qdrant)
+    names = [item["name"] for item in spans]
+    assert "qdrant-http" in names, "QdrantClient debe pasar event_hooks al cliente httpx"
+    assert all(item["traceId"] == "hooks-test" for item in spans)
+
+
+def _reindex_test_options(path: str) -> IngestOptions:
+    return build_ingest_options(
+        file_path=path,
+        doc_id=None,
+        source="reindex-test",
+        chunk_size=None,
+        overlap=None,
+        batch_size=None,
+        dry_run=False,
+        version=None,
+        replace_source=False,
+    )
+
+
+def test_reindex_aborts_when_a_pdf_fails() -> None:
+    from app.ingest import ingest_service, reindex
+
+    alias = get_settings().qdrant_collection
+    client = QdrantClient(":memory:")
+    client.create_collection(f"{alias}__old", vectors_config=models.VectorParams(size=4, distance=models.Distance.COSINE))
+    switch_alias(client, alias, f"{alias}__old")
+
+    originals = (reindex.get_qdrant_client, ingest_service.get_qdrant_client)
+    reindex.get_qdrant_client = ingest_service.get_qdrant_client = lambda: client
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            missing = str(Path(tmp) / "no-existe.pdf")
+            try:
+                reindex.reindex_collection([missing], make_options=_reindex_test_options)
+                raise AssertionError("un PDF fallido debe abortar la reindexacion")
+            except RuntimeError as exc:
+                assert "abortada" in str(exc) and "no-existe.pdf" in str(exc)
+    finally:
+        reindex.get_qdrant_client, ingest_service.get_qdrant_client = originals
+    assert resolve_alias(client, alias) == f"{alias}__old", "el alias no debe moverse"
+    assert [item.name for item in client.get_collections().collections] == [f"{alias}__old"]
+
+
+def test_openai_calls_skip_retries_under_deadline() -> None:
+    service, stub, _ = _local_rag_service()
+    options: list[dict] = []
+
+    def with_options(**kwargs):
+        options.append(kwargs)
+        return stub
+
+    stub.with_options = with_options
+    overrides = {"score_threshold": 0.0, "rerank_mode": "llm", "rerank_enabled": True}
+    service._pipeline.evaluate("vacaciones remuneradas", None, overrides=overrides, deadline=Deadline(30))
+    # embed, rerank LLM y generacion: ningun intento extra por encima del presupuesto restante.
+    assert len(options) >= 3 and all(item.get("max_retries") == 0 for item in options), options
+
+    options.clear()
+    service._pipeline.evaluate("vacaciones remuneradas", None, overrides={"score_threshold": 0.0})
+    assert all(item.get("max_retries") != 0 for item in options), "sin deadline se conservan los reintentos"
+
+
+def test_overloaded_error_shape_matches_across_routers() -> None:
+    from app.main import app
+    from app.routers import ia_router
+
+    class FullExecutor:
+        async def run(self, fn, *args):
+            raise OverloadedError("classify", 2)
+
+    async def post_classify() -> httpx.Response:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as http:
+            return await http.post("/v1/ai/classify-extract", json={"text": "Necesito ayuda con mi contrato de trabajo"})
+
+    originals = (ia_router.get_ia_service, ia_router.get_classify_executor)
+    ia_router.get_ia_service = lambda: types.SimpleNamespace(classify_extract=lambda text: None)
+    ia_router.get_classify_executor = FullExecutor
+    try:
+        response = asyncio.run(post_classify())
+    finally:
+        ia_router.get_ia_service, ia_router.get_classify_executor = originals
+    assert response.status_code == 503 and response.headers["Retry-After"] == "2"
+    expected = _rag_http_error(OverloadedError("classify", 2), "req-1", "rag_answer").detail
+    assert response.json()["error"] == expected, "classify y RAG deben devolver el mismo cuerpo de 503"
+
+
+def test_rag_answer_batch_falls_back_per_item() -> None:
+    from app.main import app
+
+    service, _, client = _local_rag_service()
+
+    def unavailable(*args, **kwargs):
+        raise RuntimeError("qdrant no disponible")
+
+    async def post_batch() -> httpx.Response:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as http:
+            body = {"items": [{"query": "vacaciones remuneradas"}, {"query": "cesantias", "source": "cesantias"}]}
+            return await http.post("/v1/ai/rag-answer-batch", json=body)
+
+    rag_service._rag_service_instance = service
+    try:
+        # Falla la busqueda del batch: cada item la repite por su cuenta.
+        client.query_batch_points = unavailable
+        response = asyncio.run(post_batch())
+        assert response.status_code == 200
+        assert [item["error"] for item in response.json()["items"]] == [None, None]
+
+        # Falla tambien la busqueda por item: un error por item, no un 5xx del batch.
+        client.query_points = unavailable
+        response = asyncio.run(post_batch())
+        assert response.status_code == 200
+        errors = [item["error"] for item in response.json()["items"]]
+        assert all(error is not None and error["statusCode"] >= 500 for error in errors)
+    finally:
+        rag_service._rag_service_instance = None
+
+
 def main() -> None:
     test_rerank_cosine_order()
+    test_candidates_share_embedding_matrix()
     test_threshold_gate()
+    test_answer_cache_roundtrip()
+    test_compress_context_keeps_alignment()
+    test_deadline_budget()
+    test_ingest_job_lifecycle()
+    test_ingest_job_failure_is_retried()
+    test_ingest_jobs_for_one_source_run_in_order()
+    test_chunk_hashes_ignore_position()
+    test_streaming_chunks_match_batch()
+    test_parsed_pdf_cache_roundtrip()
+    test_uploader_barrier_is_last()
+    test_switch_alias_returns_previous()
+    test_near_duplicate_filter_within_document()
+    test_near_duplicate_filter_across_documents()
+    test_bulk_ingest_isolates_failures_and_doc_ids()
+    test_timed_closes_inner_iterator()
+    test_bucket_quantile_interpolates()
+    test_microbench_compare_normalizes_time()
+    test_warmup_retries_until_ready()
+    test_singleflight_cancels_when_last_waiter_leaves()
+    test_client_disconnect_cancels_with_499()
+    test_text_ingest_updates_pages_without_reembedding()
+    test_retrieve_candidates_batch_keeps_order()
+    test_prefetch_batch_observes_shared_stages_once()
+    test_cosine_rerank_ignores_exhausted_deadline()
+    test_compressed_out_chunks_are_not_reported()
+    test_observe_pipeline_metrics()
+    test_qdrant_client_errors_are_counted()
+    test_server_timing_and_trace_export()
+    test_qdrant_client_passes_event_hooks()
+    test_reindex_aborts_when_a_pdf_fails()
+    test_openai_calls_skip_retries_under_deadline()
+    test_overloaded_error_shape_matches_across_routers()
+    test_rag_answer_batch_falls_back_per_item()
     print("OK: test_rag passed")
 
 
@@ -2,9 +2,12 @@ import json
 import logging
 import os
 import re
+import threading
+from typing import Any
 
-from openai import OpenAI
+from openai import APIStatusError, OpenAI
 
+from app.core.metrics import DEPENDENCY_ERRORS
 from app.schemas.ia_schemas import (
     ClassifyExtractEntities,
     ClassifyExtractResponse,
@@ -43,15 +46,27 @@ def _extract_city_rule(text: str) -> str | None:
 
 
 class IAService:
-    def __init__(self) -> None:
+    def __init__(self, client: Any | None = None) -> None:
+        """client reemplaza al cliente OpenAI configurado por entorno (pruebas de carga offline)."""
         api_key = os.getenv("OPENAI_API_KEY")
-        if not api_key:
+        if client is not None:
+            self.client = client
+        elif not api_key:
             logger.error("OPENAI_API_KEY no está configurada; se usará fallback")
             self.client = None
         else:
             self.client = OpenAI(api_key=api_key)
         self.model = os.getenv("OPENAI_MODEL", "gpt-4.1-mini")
 
+    def warm_up(self) -> None:
+        """Abre la conexion HTTP a OpenAI con un request barato (sin cliente no hay nada que abrir)."""
+        if not self.client:
+            return
+        try:
+            self.client.models.retrieve(self.model)
+        except APIStatusError as exc:
+            logger.info("warmup_openai_status status=%s", exc.status_code)
+
     def _build_prompt(self, text: str) -> str:
         return (
             "Devuelve SOLO un JSON válido con esta forma exacta: "
@@ -106,6 +121,7 @@ class IAService:
                 temperature=0,
             )
         except Exception as exc:
+            DEPENDENCY_ERRORS.labels(dependency="openai").inc()
             logger.exception("openai_request_failed: %s", exc)
             return self._fallback_response()
 
@@ -134,10 +150,13 @@ class IAService:
         return output
 
 _ia_service_instance = None
+_ia_service_lock = threading.Lock()
 
 
 def get_ia_service() -> IAService:
     global _ia_service_instance
     if _ia_service_instance is None:
-        _ia_service_instance = IAService()
+        with _ia_service_lock:
+            if _ia_service_instance is None:
+                _ia_service_instance = IAService()
     return _ia_service_instance
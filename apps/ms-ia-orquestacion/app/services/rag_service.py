@@ -2,32 +2,52 @@
 
 from __future__ import annotations
 
+import asyncio
 import hashlib
+import json
 import logging
 import os
+import threading
+import time
 import uuid
 from datetime import datetime, timezone
-from typing import Any
+from functools import partial
+from typing import Any, Callable
 
 import httpx
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from openai import OpenAI
-from qdrant_client import models
+from openai import APIStatusError, DefaultHttpxClient, OpenAI
+from qdrant_client import QdrantClient, models
 
+from app.core.admission import OverloadedError, get_rag_executor
 from app.core.config import get_settings
+from app.core.deadline import Deadline
+from app.core.singleflight import SingleFlight
+from app.core.tracing import build_http_event_hooks
 from app.db.qdrant import ensure_rag_collection, get_qdrant_client, get_qdrant_runtime_summary, qdrant_ping
-from app.rag.service import RetrievalPipelineService
+from app.ingest.chunking import chunk_text
+from app.ingest.upload import QdrantBatchUploader, build_batch
+from app.rag.answer_cache import get_answer_cache, invalidate_answer_cache
+from app.rag.service import PrefetchedRetrieval, RetrievalPipelineService
 
 
 logger = logging.getLogger("ms-ia-orquestacion")
 
 
 class RAGService:
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        openai_client: Any | None = None,
+        qdrant_client: QdrantClient | None = None,
+        collection_name: str | None = None,
+    ) -> None:
+        """
+        openai_client, qdrant_client y collection_name reemplazan a los configurados por entorno
+        (benchmark offline); con qdrant_client propio la coleccion la prepara quien lo pasa.
+        """
         settings = get_settings()
-        if not settings.openai_api_key:
+        if openai_client is None and not settings.openai_api_key:
             raise ValueError("OPENAI_API_KEY no configurada. El servicio RAG requiere OpenAI.")
-        if not settings.qdrant_url:
+        if qdrant_client is None and not settings.qdrant_url:
             raise ValueError("QDRANT_URL no configurada. El servicio RAG requiere Qdrant.")
 
         timeout = httpx.Timeout(
@@ -37,28 +57,25 @@ class RAGService:
             write=float(os.getenv("RAG_OPENAI_WRITE_TIMEOUT_S", "25")),
             pool=float(os.getenv("RAG_OPENAI_POOL_TIMEOUT_S", "5")),
         )
-        self._openai = OpenAI(
+        self._openai = openai_client or OpenAI(
             api_key=settings.openai_api_key,
             max_retries=int(os.getenv("RAG_OPENAI_MAX_RETRIES", "2")),
             timeout=timeout,
+            http_client=DefaultHttpxClient(timeout=timeout, event_hooks=build_http_event_hooks("openai")),
         )
-        self._qdrant = get_qdrant_client()
-        self._qdrant_collection = settings.qdrant_collection
-        ensure_rag_collection()
-
-        chunk_size = int(os.getenv("RAG_CHUNK_SIZE", "255"))
-        chunk_overlap = int(os.getenv("RAG_CHUNK_OVERLAP", "50"))
-        self._splitter = RecursiveCharacterTextSplitter(
-            chunk_size=chunk_size,
-            chunk_overlap=chunk_overlap,
-            length_function=len,
-            is_separator_regex=False,
-        )
+        self._qdrant = qdrant_client or get_qdrant_client()
+        self._qdrant_collection = collection_name or settings.qdrant_collection
+        if qdrant_client is None:
+            ensure_rag_collection()
+
+        self._chunk_size = int(os.getenv("RAG_CHUNK_SIZE", "255"))
+        self._chunk_overlap = int(os.getenv("RAG_CHUNK_OVERLAP", "50"))
+        self._min_chunk_size = int(os.getenv("RAG_CHUNK_MIN_SIZE", "60"))
 
         logger.info(
             "RAGService inicializado (qdrant=%s collection=%s embed_model=%s dims=%d)",
-            settings.qdrant_url,
-            settings.qdrant_collection,
+            settings.qdrant_url if qdrant_client is None else "local",
+            self._qdrant_collection,
             settings.embedding_model,
             settings.embedding_dimensions,
         )
@@ -69,8 +86,33 @@ class RAGService:
             openai_client=self._openai,
             embedding_model=settings.embedding_model,
             answer_model=settings.openai_model,
+            answer_cache=get_answer_cache(),
+            openai_timeout_s=float(os.getenv("RAG_OPENAI_TIMEOUT_S", "30")),
+            qdrant_timeout_s=float(settings.qdrant_timeout_s),
+            rerank_timeout_s=settings.rag_rerank_timeout_s,
         )
 
+        self._inflight: SingleFlight[dict[str, Any]] = SingleFlight("rag-evaluate")
+
+    def warm_up(self) -> dict[str, float]:
+        """
+        Abre las conexiones HTTP a Qdrant y OpenAI (quedan en el pool keep-alive) con requests baratos.
+        Devuelve la duracion de cada una en ms.
+        """
+        timings: dict[str, float] = {}
+        started = time.perf_counter()
+        self._qdrant.get_collection(self._qdrant_collection)
+        timings["qdrant"] = round((time.perf_counter() - started) * 1000, 1)
+
+        started = time.perf_counter()
+        try:
+            self._openai.models.retrieve(get_settings().embedding_model)
+        except APIStatusError as exc:
+            # Hubo respuesta HTTP (p.ej. una key sin permiso de lectura de modelos): la conexion ya quedo abierta.
+            logger.info("warmup_openai_status status=%s", exc.status_code)
+        timings["openai"] = round((time.perf_counter() - started) * 1000, 1)
+        return timings
+
     def diagnostics(self) -> dict[str, Any]:
         info = get_runtime_env_summary()
         info["ping"] = qdrant_ping()
@@ -84,73 +126,198 @@ class RAGService:
         )
         return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
 
+    def _stored_chunks(self, source_filter: models.Filter) -> tuple[dict[str, tuple[str, dict[str, Any]]], list[str]]:
+        """
+        Chunks ya indexados del source: contentHash -> (point id, payload) y los ids sin contentHash
+        (ingestados antes del modo diff), que se reemplazan completos.
+        """
+        stored: dict[str, tuple[str, dict[str, Any]]] = {}
+        legacy_ids: list[str] = []
+        offset: str | int | None = None
+        while True:
+            points, offset = self._qdrant.scroll(
+                collection_name=self._qdrant_collection,
+                scroll_filter=source_filter,
+                with_payload=["contentHash", "chunkIndex", "title", "version", "metadata", "pageStart", "pageEnd"],
+                with_vectors=False,
+                limit=1_000,
+                offset=offset,
+            )
+            for point in points:
+                payload = dict(point.payload or {})
+                text_hash = payload.get("contentHash")
+                if isinstance(text_hash, str) and text_hash not in stored:
+                    stored[text_hash] = (str(point.id), payload)
+                else:
+                    legacy_ids.append(str(point.id))
+            if offset is None:
+                return stored, legacy_ids
+
+    def _split_text(self, text: str) -> list[str]:
+        """Mismo chunker que la ingesta de PDF (cortes en fin de oracion, linea o espacio)."""
+        chunks = chunk_text(text, [], self._chunk_size, self._chunk_overlap, self._min_chunk_size)
+        return [chunk.text for chunk in chunks]
+
     def ingest(
         self,
         source: str,
         text: str,
         title: str | None = None,
         metadata: dict[str, Any] | None = None,
+        progress: Callable[[dict[str, int]], None] | None = None,
+        mode: str = "diff",
     ) -> dict[str, Any]:
+        """
+        Sincroniza los chunks del source con el texto recibido.
+
+        mode="diff" solo embebe e inserta los chunks nuevos o modificados (por contentHash), actualiza
+        el payload de los que cambiaron de posicion o metadata y borra los que desaparecieron.
+        mode="replace" borra todo el source y reinserta cada chunk.
+        progress (opcional) recibe los contadores chunksTotal/chunksDeleted/chunksEmbedded/chunksUpserted.
+        El resultado incluye stageMs (chunk, embed, upsert) como el reporte de la ingesta de PDF.
+        """
         settings = get_settings()
         metadata = metadata or {}
-        chunks = self._splitter.split_text(text)
+        timings = {"chunk": 0.0, "embed": 0.0, "upsert": 0.0}
+        started = time.perf_counter()
+        chunks = self._split_text(text)
+        timings["chunk"] = time.perf_counter() - started
+        counters = {"chunksTotal": len(chunks), "chunksDeleted": 0, "chunksEmbedded": 0, "chunksUpserted": 0}
+
+        def _report(**updates: int) -> None:
+            counters.update(updates)
+            if progress is not None:
+                progress(dict(counters))
+
         if not chunks:
-            return {
-                "source": source,
-                "title": title,
-                "chunks_deleted": 0,
-                "chunks_inserted": 0,
-            }
+            return _ingest_result(source, title, added=0, unchanged=0, removed=0, timings=timings)
 
         source_filter = models.Filter(
             must=[models.FieldCondition(key="source", match=models.MatchValue(value=source))]
         )
-        existing, _ = self._qdrant.scroll(
-            collection_name=self._qdrant_collection,
-            scroll_filter=source_filter,
-            with_payload=False,
-            with_vectors=False,
-            limit=10_000,
-        )
-        chunks_deleted = len(existing)
-        if chunks_deleted:
-            self._qdrant.delete(
-                collection_name=self._qdrant_collection,
-                points_selector=models.FilterSelector(filter=source_filter),
-            )
+        hashes = _chunk_hashes(source, chunks)
+        version = str(metadata.get("version", settings.version_default))
+        stored: dict[str, tuple[str, dict[str, Any]]] = {}
+        stale_ids: list[str] = []
+
+        if mode == "replace":
+            existing, legacy_ids = self._stored_chunks(source_filter)
+            chunks_deleted = len(existing) + len(legacy_ids)
+            if chunks_deleted:
+                self._qdrant.delete(
+                    collection_name=self._qdrant_collection,
+                    points_selector=models.FilterSelector(filter=source_filter),
+                )
+            _report(chunksDeleted=chunks_deleted)
+            pending = list(range(len(chunks)))
+        else:
+            stored, stale_ids = self._stored_chunks(source_filter)
+            current = set(hashes)
+            stale_ids.extend(point_id for text_hash, (point_id, _) in stored.items() if text_hash not in current)
+            pending = [idx for idx, text_hash in enumerate(hashes) if text_hash not in stored]
+            chunks_deleted = len(stale_ids)
 
-        vectors = self._embed_texts(chunks, settings.embedding_dimensions)
+        batch_size = max(1, settings.embedding_batch_size)
         now = datetime.now(timezone.utc).isoformat()
-        points: list[models.PointStruct] = []
-        for idx, (chunk_text, vector) in enumerate(zip(chunks, vectors)):
-            hash_id = hashlib.sha256(f"{source}|{idx}|{chunk_text}".encode("utf-8")).hexdigest()
-            point_id = str(uuid.uuid5(uuid.NAMESPACE_URL, hash_id))
-            points.append(
-                models.PointStruct(
-                    id=point_id,
-                    vector=vector,
-                    payload={
+        embedded = 0
+        upserted = 0
+
+        def _upserted(count: int) -> None:
+            nonlocal upserted
+            upserted += count
+            _report(chunksUpserted=upserted)
+
+        # El embedding del batch siguiente se solapa con los upserts en vuelo; finish() es la barrera
+        # antes de tocar payloads y borrar, para no dejar el source a medio sincronizar.
+        uploader = QdrantBatchUploader(
+            self._qdrant,
+            self._qdrant_collection,
+            max_in_flight=settings.ingest_upsert_in_flight,
+        )
+        try:
+            for start in range(0, len(pending), batch_size):
+                positions = pending[start: start + batch_size]
+                started = time.perf_counter()
+                vectors = self._embed_texts([chunks[idx] for idx in positions], settings.embedding_dimensions)
+                timings["embed"] += time.perf_counter() - started
+                embedded += len(positions)
+                _report(chunksEmbedded=embedded)
+                payloads = [
+                    {
                         "source": source,
-                        "version": str(metadata.get("version", get_settings().version_default)),
+                        "version": version,
                         "title": title or "",
-                        "chunkText": chunk_text,
+                        "chunkText": chunks[idx],
                         "chunkIndex": idx,
+                        # textHash es del ingest de PDF (docId|chunkIndex|texto); este hash es otro.
+                        "contentHash": hashes[idx],
                         "metadata": metadata,
                         "pageStart": metadata.get("pageStart"),
                         "pageEnd": metadata.get("pageEnd"),
                         "createdAt": now,
                         "updatedAt": now,
-                    },
+                    }
+                    for idx in positions
+                ]
+                uploader.submit(
+                    build_batch([_point_id(hashes[idx]) for idx in positions], vectors, payloads),
+                    on_done=partial(_upserted, len(positions)),
                 )
+            uploader.finish()
+            timings["upsert"] = uploader.request_s
+        finally:
+            uploader.close()
+
+        # Chunks sin cambios de texto: solo se corrige el payload si cambio su posicion, metadata o paginas.
+        payload_updates = []
+        for idx, text_hash in enumerate(hashes):
+            if text_hash not in stored:
+                continue
+            point_id, payload = stored[text_hash]
+            expected = {
+                "chunkIndex": idx,
+                "title": title or "",
+                "version": version,
+                "metadata": metadata,
+                "pageStart": metadata.get("pageStart"),
+                "pageEnd": metadata.get("pageEnd"),
+            }
+            if any(payload.get(key) != value for key, value in expected.items()):
+                payload_updates.append(
+                    models.SetPayloadOperation(
+                        set_payload=models.SetPayload(payload={**expected, "updatedAt": now}, points=[point_id])
+                    )
+                )
+        for start in range(0, len(payload_updates), batch_size):
+            self._qdrant.batch_update_points(
+                collection_name=self._qdrant_collection,
+                update_operations=payload_updates[start: start + batch_size],
             )
 
-        self._qdrant.upsert(collection_name=self._qdrant_collection, points=points)
-        return {
-            "source": source,
-            "title": title,
-            "chunks_deleted": chunks_deleted,
-            "chunks_inserted": len(points),
-        }
+        # Se borra al final para que el source nunca quede sin chunks durante la re-ingesta.
+        if stale_ids:
+            self._qdrant.delete(
+                collection_name=self._qdrant_collection,
+                points_selector=models.PointIdsList(points=stale_ids),
+            )
+            _report(chunksDeleted=len(stale_ids))
+
+        unchanged = len(chunks) - len(pending)
+        if pending or chunks_deleted or payload_updates:
+            invalidate_answer_cache()
+        logger.info(
+            "rag_ingest source=%s mode=%s chunks=%d added=%d unchanged=%d removed=%d payload_updates=%d",
+            source,
+            mode,
+            len(chunks),
+            len(pending),
+            unchanged,
+            chunks_deleted,
+            len(payload_updates),
+        )
+        return _ingest_result(
+            source, title, added=len(pending), unchanged=unchanged, removed=chunks_deleted, timings=timings
+        )
 
     def rag_answer(self, query: str, filters: dict[str, Any] | None = None) -> dict[str, Any]:
         return self._pipeline.answer(query=query, incoming_filters=filters)
@@ -161,14 +328,153 @@ class RAGService:
         filters: dict[str, Any] | None = None,
         overrides: dict[str, Any] | None = None,
         dry_run: bool = True,
+        deadline: Deadline | None = None,
     ) -> dict[str, Any]:
         return self._pipeline.evaluate(
             query=query,
             incoming_filters=filters,
             overrides=overrides,
             dry_run=dry_run,
+            deadline=deadline,
         )
 
+    async def rag_evaluate_async(
+        self,
+        query: str,
+        filters: dict[str, Any] | None = None,
+        overrides: dict[str, Any] | None = None,
+        dry_run: bool = True,
+        deadline: Deadline | None = None,
+    ) -> dict[str, Any]:
+        """
+        Igual que rag_evaluate pero en el executor acotado de RAG y con single-flight:
+        requests concurrentes con la misma pregunta normalizada, filtros y config
+        comparten una sola ejecucion del pipeline (y un solo cupo del executor).
+        Si todos los requests que esperan se van (timeout o desconexion), la ejecucion
+        se cancela: no arranca si seguia en cola y se corta en la siguiente etapa si ya corria.
+        """
+        key = _singleflight_key(query, filters, overrides, dry_run)
+        return await self._inflight.do(
+            key,
+            lambda shared_deadline: get_rag_executor().run(
+                self.rag_evaluate,
+                query=query,
+                filters=filters,
+                overrides=overrides,
+                dry_run=dry_run,
+                deadline=shared_deadline,
+            ),
+            deadline=deadline,
+        )
+
+    async def rag_evaluate_batch_async(
+        self,
+        items: list[tuple[str, dict[str, Any] | None]],
+        deadline: Deadline | None = None,
+    ) -> list[dict[str, Any] | BaseException]:
+        """
+        Evalua varias preguntas (query, filtros): embedding y retrieval en una sola llamada
+        a OpenAI y a Qdrant, y luego rerank + generacion por item con fan-out acotado
+        (RAG_BATCH_CONCURRENCY). Devuelve un resultado o la excepcion de cada item, en orden.
+        Si falla el embedding o la busqueda del batch, cada item la repite por su cuenta y un
+        error queda en su item; solo la cola llena del executor rechaza el batch entero.
+        """
+        executor = get_rag_executor()
+        queries = [query for query, _ in items]
+        filters = [item_filters for _, item_filters in items]
+        prefetched: list[PrefetchedRetrieval | None]
+        try:
+            prefetched = list(
+                await executor.run(
+                    self._pipeline.prefetch_batch,
+                    queries,
+                    filters,
+                    deadline=deadline,
+                )
+            )
+        except OverloadedError:
+            raise
+        except Exception as exc:
+            logger.warning("rag_batch_prefetch_failed items=%d error=%s: %s", len(items), type(exc).__name__, exc)
+            prefetched = [None] * len(items)
+
+        semaphore = asyncio.Semaphore(get_settings().rag_batch_concurrency)
+
+        async def _evaluate_item(position: int) -> dict[str, Any]:
+            async with semaphore:
+                return await executor.run(
+                    self._pipeline.evaluate,
+                    query=queries[position],
+                    incoming_filters=filters[position],
+                    dry_run=False,
+                    deadline=deadline,
+                    prefetched=prefetched[position],
+                )
+
+        return await asyncio.gather(
+            *(_evaluate_item(position) for position in range(len(items))),
+            return_exceptions=True,
+        )
+
+
+def _chunk_hashes(source: str, chunks: list[str]) -> list[str]:
+    """
+    Hash de contenido por chunk, independiente de su posicion en el documento.
+    Un ordinal distingue chunks con el mismo texto dentro del documento.
+    """
+    seen: dict[str, int] = {}
+    hashes: list[str] = []
+    for chunk in chunks:
+        normalized = " ".join(chunk.split())
+        ordinal = seen.get(normalized, 0)
+        seen[normalized] = ordinal + 1
+        hashes.append(hashlib.sha256(f"{source}|{ordinal}|{normalized}".encode("utf-8")).hexdigest())
+    return hashes
+
+
+def _point_id(text_hash: str) -> str:
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, text_hash))
+
+
+def _ingest_result(
+    source: str,
+    title: str | None,
+    added: int,
+    unchanged: int,
+    removed: int,
+    timings: dict[str, float],
+) -> dict[str, Any]:
+    return {
+        "source": source,
+        "title": title,
+        "chunks_deleted": removed,
+        "chunks_inserted": added,
+        "chunks_added": added,
+        "chunks_unchanged": unchanged,
+        "chunks_removed": removed,
+        "stageMs": {stage: round(seconds * 1000, 1) for stage, seconds in timings.items()},
+    }
+
+
+def _singleflight_key(
+    query: str,
+    filters: dict[str, Any] | None,
+    overrides: dict[str, Any] | None,
+    dry_run: bool,
+) -> str:
+    raw = json.dumps(
+        {
+            "query": " ".join(query.casefold().split()),
+            "filters": filters or {},
+            "overrides": overrides or {},
+            "dryRun": dry_run,
+        },
+        sort_keys=True,
+        default=str,
+        ensure_ascii=True,
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
 
 def get_runtime_env_summary() -> dict[str, Any]:
     summary = get_qdrant_runtime_summary()
@@ -179,10 +485,14 @@ def get_runtime_env_summary() -> dict[str, Any]:
 
 
 _rag_service_instance: RAGService | None = None
+_rag_service_lock = threading.Lock()
 
 
 def get_rag_service() -> RAGService:
     global _rag_service_instance
     if _rag_service_instance is None:
-        _rag_service_instance = RAGService()
+        # Los primeros requests concurrentes (o el warmup) no deben construir dos instancias.
+        with _rag_service_lock:
+            if _rag_service_instance is None:
+                _rag_service_instance = RAGService()
     return _rag_service_instance
@@ -0,0 +1,110 @@
+from __future__ import annotations
+
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Any, Callable
+
+from app.ai.embeddings import get_encoding
+from app.core.admission import get_classify_executor, get_rag_executor
+from app.core.config import get_settings
+from app.core.logger import get_logger
+from app.services.ia_service import get_ia_service
+from app.services.rag_service import get_rag_service
+
+
+logger = get_logger("ms-ia-orquestacion.warmup")
+
+
+@dataclass
+class WarmupState:
+    status: str = "pending"  # pending | warming | ready | failed
+    attempts: int = 0
+    durationMs: int | None = None
+    steps: dict[str, float] = field(default_factory=dict)
+    error: str | None = None
+
+    def to_dict(self) -> dict[str, Any]:
+        return asdict(self)
+
+
+_state = WarmupState()
+_state_lock = threading.Lock()
+_stop = threading.Event()
+
+
+def _step(steps: dict[str, float], name: str, fn: Callable[[], Any]) -> Any:
+    started = time.perf_counter()
+    result = fn()
+    steps[name] = round((time.perf_counter() - started) * 1000, 1)
+    return result
+
+
+def warm_up() -> dict[str, float]:
+    """
+    Una pasada de calentamiento, con lo que si no pagaria el primer request: construir RAGService
+    (clientes, get_collections, ensure de la coleccion e indices de payload, cache de respuestas),
+    abrir las conexiones HTTP a Qdrant y OpenAI, cargar los tokenizers y crear los executors.
+    Devuelve ms por paso; una excepcion corta la pasada.
+    """
+    settings = get_settings()
+    steps: dict[str, float] = {}
+    service = _step(steps, "ragService", get_rag_service)
+    steps.update({f"connect.{name}": value for name, value in service.warm_up().items()})
+    _step(steps, "iaService", lambda: get_ia_service().warm_up())
+    _step(steps, "tokenizers", lambda: [get_encoding(model) for model in (settings.embedding_model, settings.openai_model)])
+    _step(steps, "executors", lambda: (get_rag_executor(), get_classify_executor()))
+    return steps
+
+
+def _update(**changes: Any) -> None:
+    with _state_lock:
+        for key, value in changes.items():
+            setattr(_state, key, value)
+
+
+def _warmup_loop(retry_s: float) -> None:
+    """Reintenta hasta lograrlo (p.ej. Qdrant todavia no levanto) o hasta stop_warmup()."""
+    while not _stop.is_set():
+        _update(status="warming", attempts=_state.attempts + 1)
+        started = time.perf_counter()
+        try:
+            steps = warm_up()
+        except Exception as exc:
+            logger.warning("warmup_failed attempt=%d retry_in_s=%.1f error=%s", _state.attempts, retry_s, exc)
+            _update(status="failed", error=str(exc))
+            _stop.wait(retry_s)
+            continue
+        duration_ms = int((time.perf_counter() - started) * 1000)
+        _update(status="ready", durationMs=duration_ms, steps=steps, error=None)
+        logger.info("warmup_ready attempts=%d duration_ms=%d steps=%s", _state.attempts, duration_ms, steps)
+        return
+
+
+def start_warmup() -> threading.Thread:
+    """Calienta en un thread aparte: /health responde de inmediato y /ready da 503 hasta terminar."""
+    _stop.clear()
+    thread = threading.Thread(
+        target=_warmup_loop,
+        args=(get_settings().rag_warmup_retry_s,),
+        name="rag-warmup",
+        daemon=True,
+    )
+    thread.start()
+    return thread
+
+
+def stop_warmup() -> None:
+    _stop.set()
+
+
+def readiness() -> tuple[bool, dict[str, Any]]:
+    """
+    (listo, estado). Sin RAG_WARMUP_ENABLED no hay calentamiento que esperar y siempre esta listo;
+    con warmup, recien cuando termino una pasada completa.
+    """
+    if not get_settings().rag_warmup_enabled:
+        return True, {"status": "disabled"}
+    with _state_lock:
+        state = _state.to_dict()
+    return state["status"] == "ready", state